@@ -0,0 +1,108 @@
+"""POST /like on one viral post, with likes counted on the post's row and with BUFFERED_LIKES.
+
+Runs fully in-process against a throwaway SQLite file: --users users each
+like the same post once, --concurrency at a time, so every request is a
+201. Each mode gets a post of its own:
+
+    python -m benchmarks.hot_likes --users 2000 --concurrency 8
+
+Once the buffered run is over, the counter is stopped as the server's
+shutdown would, which flushes and folds what is left, and both posts are
+checked to show exactly --users likes.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from benchmarks.token_latency import percentile
+
+
+async def like_storm(client, post_id: int, tokens: list[str], concurrency: int) -> list[float]:
+    """Latency of every like of post_id, one per token."""
+    queue = asyncio.Queue()
+    for token in tokens:
+        queue.put_nowait(token)
+    latencies = []
+
+    async def worker():
+        while not queue.empty():
+            token = queue.get_nowait()
+            start = time.perf_counter()
+            response = await client.post(
+                "/like", json={"post_id": post_id}, headers={"Authorization": f"Bearer {token}"}
+            )
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 201, response.text
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies
+
+
+async def run(users: int, concurrency: int):
+    import httpx
+
+    from storeapi.config import config
+    from storeapi.database import database, engine, post_table, user_table
+    from storeapi.main import app
+    from storeapi.migrations import migrate
+    from storeapi.routers.post import like_counter
+    from storeapi.security import create_access_token
+
+    logging.getLogger("storeapi").addHandler(logging.NullHandler())
+    migrate(engine)
+    emails = [f"user{id}@bench.test" for id in range(1, users + 1)]
+    with engine.begin() as connection:
+        connection.execute(user_table.insert(), [
+            {"id": id, "email": email, "password": "x", "confirmed": True}
+            for id, email in enumerate(emails, 1)
+        ])
+        connection.execute(post_table.insert(), [
+            {"id": 1, "body": "Counted on its row", "user_id": 1},
+            {"id": 2, "body": "Buffered", "user_id": 1},
+        ])
+    tokens = [create_access_token(email) for email in emails]
+
+    await database.connect()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        print(f"{'mode':<10} {'likes/s':>9} {'p50':>9} {'p99':>9}")
+        for post_id, buffered in ((1, False), (2, True)):
+            config.BUFFERED_LIKES = buffered
+            if buffered:
+                like_counter.start()
+            start = time.perf_counter()
+            latencies = await like_storm(client, post_id, tokens, concurrency)
+            elapsed = time.perf_counter() - start
+            if buffered:
+                await like_counter.stop()
+            print(
+                f"{'buffered' if buffered else 'row':<10} {users / elapsed:>9.0f} "
+                f"{percentile(latencies, 50) * 1000:>7.1f}ms {percentile(latencies, 99) * 1000:>7.1f}ms"
+            )
+            response = await client.get(f"/post/{post_id}")
+            assert response.json()["post"]["likes"] == users, response.json()["post"]
+        print(f"like counter flushes: {like_counter.flushes}")
+    await database.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({
+            "ENV_STATE": "test",
+            "TEST_DATABASE_URL": f"sqlite:///{tmp}/bench.db",
+            "TEST_DATABASE_ROLLBACK": "false",
+            "TEST_RESPONSE_CACHE_SIZE": "0",
+        })
+        asyncio.run(run(args.users, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
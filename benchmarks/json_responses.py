@@ -0,0 +1,99 @@
+"""Time to serialize 10k-row responses, validated through pydantic and with FAST_JSON_RESPONSES.
+
+Runs fully in-process against a throwaway SQLite file holding one post with
+--rows comments and --rows posts, with the response cache off:
+
+    python -m benchmarks.json_responses --rows 10000 --repeat 5
+
+"dump" times only the encoding of --rows posts already fetched; the routes
+are whole requests through the app. Every response is also checked to be
+byte for byte the same in both modes.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+
+async def run(rows: int, repeat: int):
+    import httpx
+    import sqlalchemy
+
+    from storeapi.config import config
+    from storeapi.database import comment_table, database, engine, post_table, user_table
+    from storeapi.main import app
+    from storeapi.migrations import migrate
+    from storeapi.models.post import UserPostWithLikes
+    from storeapi.routers.post import dump_posts
+    from storeapi.rows import fetch_columns, model_columns
+    from storeapi.serialization import orjson
+
+    # Keep the app's warnings (slow queries over 10k rows) out of the report
+    logging.getLogger("storeapi").addHandler(logging.NullHandler())
+    migrate(engine)
+    with engine.begin() as connection:
+        connection.execute(user_table.insert().values(id=1, email="bench@test.com", password="x"))
+        connection.execute(post_table.insert(), [
+            {"id": id, "body": f"Post {id} with a few more words é", "user_id": 1}
+            for id in range(1, rows + 1)
+        ])
+        connection.execute(comment_table.insert(), [
+            {"body": f"Comment {id} on the first post", "post_id": 1, "user_id": 1}
+            for id in range(rows)
+        ])
+
+    await database.connect()
+    query = sqlalchemy.select(*model_columns(post_table, UserPostWithLikes))
+    posts = await fetch_columns(database, query, UserPostWithLikes)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        cases = {
+            f"dump {rows} posts": lambda: dump_posts(posts),
+            "GET /post/{id}": lambda: client.get("/post/1"),
+            "GET /post/{id}/comment": lambda: client.get("/post/1/comment"),
+            "GET /post?format=ndjson": lambda: client.get("/post", params={"format": "ndjson"}),
+        }
+        print(f"json library for the fast path: {'orjson' if orjson else 'json'}")
+        print(f"{'case':<28} {'pydantic':>10} {'fast':>10} {'speedup':>8}")
+        for name, case in cases.items():
+            timings, bodies = {}, {}
+            for fast in (False, True):
+                config.FAST_JSON_RESPONSES = fast
+                samples = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    result = case()
+                    if asyncio.iscoroutine(result):
+                        result = (await result).content
+                    samples.append(time.perf_counter() - start)
+                timings[fast] = statistics.median(samples) * 1000
+                bodies[fast] = result
+            assert bodies[False] == bodies[True], f"{name}: responses differ"
+            print(
+                f"{name:<28} {timings[False]:>8.1f}ms {timings[True]:>8.1f}ms "
+                f"{timings[False] / timings[True]:>7.1f}x"
+            )
+    await database.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({
+            "ENV_STATE": "test",
+            "TEST_DATABASE_URL": f"sqlite:///{tmp}/bench.db",
+            "TEST_DATABASE_ROLLBACK": "false",
+            "TEST_RESPONSE_CACHE_SIZE": "0",
+        })
+        asyncio.run(run(args.rows, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""Throughput and latency of every route against a seeded SQLite database.
+
+Runs fully in-process and offline: the app is driven through httpx's ASGI
+transport, one route at a time, at a fixed concurrency. The data set is
+seeded from --seed, with post popularity (comments, likes and reads)
+following a Zipf distribution of exponent --skew (0 is uniform):
+
+    python -m benchmarks.load_test --users 100 --posts 5000 --comments 20000 --likes 20000
+    python -m benchmarks.load_test --save baseline.json
+    python -m benchmarks.load_test --baseline baseline.json --threshold 0.25
+
+With --baseline, exits with status 1 if any route's p95 grew, or its
+throughput shrank, by more than --threshold compared to the baseline.
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+from benchmarks.token_latency import percentile
+
+PASSWORD = "bench-password"
+BATCH_SIZE = 20
+
+
+def zipf_sampler(rng: random.Random, values: list[int], skew: float) -> Callable[[int], list[int]]:
+    """Returns sample(k): k values, the i-th most popular drawn with weight 1 / i ** skew."""
+    popularity = values[:]
+    rng.shuffle(popularity)
+    cum_weights = list(itertools.accumulate(1 / rank ** skew for rank in range(1, len(values) + 1)))
+    return lambda k: rng.choices(popularity, cum_weights=cum_weights, k=k)
+
+
+def seed(args: argparse.Namespace) -> dict:
+    """Fill a fresh database; returns what the scenarios need to know about it."""
+    from storeapi.database import comment_table, engine, like_table, post_table, user_table
+    from storeapi.migrations import migrate, reconcile_likes
+    from storeapi.security import get_password_hash
+
+    rng = random.Random(args.seed)
+    migrate(engine)
+    # Every user shares one password, so seeding pays for a single bcrypt hash
+    password = get_password_hash(PASSWORD)
+    emails = [f"user{i}@bench.test" for i in range(1, args.users + 1)]
+    user_ids = list(range(1, args.users + 1))
+    post_ids = list(range(1, args.posts + 1))
+    popular_post = zipf_sampler(rng, post_ids, args.skew)
+
+    likes: set[tuple[int, int]] = set()
+    target = min(args.likes, args.users * args.posts)
+    while len(likes) < target:
+        likes.update(zip(popular_post(target - len(likes)), rng.choices(user_ids, k=target - len(likes))))
+
+    with engine.begin() as connection:
+        connection.execute(user_table.insert(), [
+            {"id": id, "email": email, "password": password, "confirmed": True}
+            for id, email in zip(user_ids, emails)
+        ])
+        connection.execute(post_table.insert(), [
+            {"id": id, "body": f"Post {id}", "user_id": rng.choice(user_ids)} for id in post_ids
+        ])
+        if args.comments:
+            connection.execute(comment_table.insert(), [
+                {"body": f"Comment {i}", "post_id": post_id, "user_id": rng.choice(user_ids)}
+                for i, post_id in enumerate(popular_post(args.comments))
+            ])
+        if likes:
+            connection.execute(like_table.insert(), [
+                {"post_id": post_id, "user_id": user_id} for post_id, user_id in likes
+            ])
+        reconcile_likes(connection)
+
+    return {"rng": rng, "emails": emails, "popular_post": popular_post}
+
+
+@dataclass
+class Scenario:
+    name: str
+    send: Callable[[int], Awaitable]
+    # Statuses that count as success; anything else is an error
+    expected: frozenset[int] = frozenset({200})
+    auth: bool = False
+
+
+def scenarios(client, data: dict) -> list[Scenario]:
+    from storeapi.security import create_access_token, create_confirmation_token
+
+    rng: random.Random = data["rng"]
+    emails: list[str] = data["emails"]
+    popular_post = data["popular_post"]
+
+    def post_id() -> int:
+        return popular_post(1)[0]
+
+    def headers() -> dict:
+        # Tokens are minted directly; POST /token has a scenario of its own
+        return {"Authorization": f"Bearer {create_access_token(rng.choice(emails))}"}
+
+    return [
+        Scenario("GET /post", lambda i: client.get("/post")),
+        Scenario("GET /post?sorting=old", lambda i: client.get("/post", params={"sorting": "old"})),
+        Scenario(
+            "GET /post?sorting=most_likes",
+            lambda i: client.get("/post", params={"sorting": "most_likes"}),
+        ),
+        Scenario(
+            "GET /post?include=comments",
+            lambda i: client.get("/post", params={"include": "comments"}),
+        ),
+        Scenario("GET /post/{post_id}", lambda i: client.get(f"/post/{post_id()}")),
+        Scenario("GET /post/{post_id}/comment", lambda i: client.get(f"/post/{post_id()}/comment")),
+        Scenario(
+            "POST /post",
+            lambda i: client.post("/post", json={"body": f"New post {i}"}, headers=headers()),
+            frozenset({201}),
+        ),
+        Scenario(
+            "POST /comment",
+            lambda i: client.post(
+                "/comment", json={"body": f"New comment {i}", "post_id": post_id()}, headers=headers()
+            ),
+            frozenset({201}),
+        ),
+        # Popular posts are often already liked by the user
+        Scenario(
+            "POST /like",
+            lambda i: client.post("/like", json={"post_id": post_id()}, headers=headers()),
+            frozenset({201, 409}),
+        ),
+        Scenario(
+            "POST /post/batch",
+            lambda i: client.post(
+                "/post/batch",
+                json=[{"body": f"Batch post {i}.{j}"} for j in range(BATCH_SIZE)],
+                headers=headers(),
+            ),
+        ),
+        Scenario(
+            "POST /comment/batch",
+            lambda i: client.post(
+                "/comment/batch",
+                json=[{"body": f"Batch comment {i}.{j}", "post_id": id} for j, id in
+                      enumerate(popular_post(BATCH_SIZE))],
+                headers=headers(),
+            ),
+        ),
+        Scenario(
+            "POST /like/batch",
+            lambda i: client.post(
+                "/like/batch",
+                json=[{"post_id": id} for id in popular_post(BATCH_SIZE)],
+                headers=headers(),
+            ),
+        ),
+        Scenario(
+            "GET /confirm/{token}",
+            lambda i: client.get(f"/confirm/{create_confirmation_token(rng.choice(emails))}"),
+        ),
+        Scenario(
+            "POST /register",
+            lambda i: client.post(
+                "/register", json={"email": f"new{i}@bench.test", "password": PASSWORD}
+            ),
+            frozenset({201}),
+            auth=True,
+        ),
+        Scenario(
+            "POST /token",
+            lambda i: client.post("/token", data={"username": rng.choice(emails), "password": PASSWORD}),
+            auth=True,
+        ),
+        # Matches every seeded post, so every hit has to be ranked
+        Scenario("GET /search", lambda i: client.get("/search", params={"q": "post"})),
+        Scenario("GET /metrics", lambda i: client.get("/metrics")),
+    ]
+
+
+@dataclass
+class Result:
+    requests: int = 0
+    errors: int = 0
+    elapsed: float = 0.0
+    samples: list[float] = field(default_factory=list)
+    statuses: collections.Counter = field(default_factory=collections.Counter)
+
+    def summary(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "statuses": {str(code): count for code, count in sorted(self.statuses.items())},
+            "throughput": round(self.requests / self.elapsed, 2),
+            "mean_ms": round(statistics.fmean(self.samples) * 1000, 3),
+            "p50_ms": round(percentile(self.samples, 50) * 1000, 3),
+            "p95_ms": round(percentile(self.samples, 95) * 1000, 3),
+            "p99_ms": round(percentile(self.samples, 99) * 1000, 3),
+        }
+
+
+async def drive(scenario: Scenario, requests: int, concurrency: int, first: int = 0) -> Result:
+    """Send requests through `concurrency` workers that each keep one request in flight."""
+    result = Result()
+    counter = itertools.count(first)
+    last = first + requests
+
+    async def worker():
+        while (i := next(counter)) < last:
+            start = time.perf_counter()
+            response = await scenario.send(i)
+            result.samples.append(time.perf_counter() - start)
+            result.statuses[response.status_code] += 1
+            if response.status_code not in scenario.expected:
+                result.errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.elapsed = time.perf_counter() - start
+    result.requests = requests
+    return result
+
+
+async def run(args: argparse.Namespace) -> dict:
+    import httpx
+
+    from storeapi.config import config
+    from storeapi.database import database
+    from storeapi.main import app
+    from storeapi.routers.post import like_counter
+    from storeapi.search import search_index
+    from storeapi.security import password_executor
+
+    # The app's logging is not configured here; keep its warnings (slow
+    # queries, 404s) out of the report without skipping the logging calls
+    logging.getLogger("storeapi").addHandler(logging.NullHandler())
+    data = seed(args)
+    await database.connect()
+    await search_index.load()
+    if config.BUFFERED_LIKES:
+        like_counter.start()
+    routes = {}
+    # Unhandled exceptions become 500s and count as errors instead of ending the run
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for scenario in scenarios(client, data):
+            if args.routes and scenario.name not in args.routes:
+                continue
+            requests = args.auth_requests if scenario.auth else args.requests
+            # Warm-up requests use their own indexes, so created rows stay unique
+            await drive(scenario, args.warmup, args.concurrency, first=requests)
+            result = await drive(scenario, requests, args.concurrency)
+            routes[scenario.name] = result.summary()
+            print(format_row(scenario.name, routes[scenario.name]), flush=True)
+    await like_counter.stop()
+    await database.disconnect()
+    password_executor.shutdown()
+    return routes
+
+
+def format_row(name: str, summary: dict) -> str:
+    return (
+        f"{name:<32} {summary['throughput']:>9.1f}/s "
+        f"p50={summary['p50_ms']:.1f}ms p95={summary['p95_ms']:.1f}ms "
+        f"p99={summary['p99_ms']:.1f}ms errors={summary['errors']} statuses={summary['statuses']}"
+    )
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[str]:
+    """Routes whose p95 or throughput is more than threshold worse than the baseline."""
+    regressions = []
+    for name, now in current["routes"].items():
+        before = baseline["routes"].get(name)
+        if before is None:
+            continue
+        if now["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {before['p95_ms']:.1f}ms -> {now['p95_ms']:.1f}ms")
+        if now["throughput"] < before["throughput"] * (1 - threshold):
+            regressions.append(
+                f"{name}: throughput {before['throughput']:.1f}/s -> {now['throughput']:.1f}/s"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--posts", type=int, default=2000)
+    parser.add_argument("--comments", type=int, default=10000)
+    parser.add_argument("--likes", type=int, default=10000)
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of post popularity")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500, help="requests per route")
+    parser.add_argument("--auth-requests", type=int, default=32, help="requests for bcrypt-bound routes")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per route")
+    parser.add_argument("--routes", nargs="*", help="only these scenarios, e.g. 'GET /post'")
+    parser.add_argument("--no-response-cache", action="store_true")
+    parser.add_argument("--buffered-likes", action="store_true", help="run with BUFFERED_LIKES")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against results saved with --save")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    parameters = {
+        name: getattr(args, name)
+        for name in ("users", "posts", "comments", "likes", "skew", "seed", "concurrency",
+                     "requests", "auth_requests", "no_response_cache", "buffered_likes")
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({
+            "ENV_STATE": "test",
+            "TEST_DATABASE_URL": f"sqlite:///{tmp}/bench.db",
+            "TEST_DATABASE_ROLLBACK": "false",
+            "TEST_PASSWORD_HASH_QUEUE_LIMIT": str(args.auth_requests + args.warmup),
+            "TEST_INTERNAL_ROUTES_ENABLED": "true",
+        })
+        if args.no_response_cache:
+            os.environ["TEST_RESPONSE_CACHE_SIZE"] = "0"
+        if args.buffered_likes:
+            os.environ["TEST_BUFFERED_LIKES"] = "true"
+        results = {"parameters": parameters, "routes": asyncio.run(run(args))}
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["parameters"] != parameters:
+            print("warning: baseline was recorded with different parameters", file=sys.stderr)
+        regressions = compare(baseline, results, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
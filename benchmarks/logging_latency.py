@@ -0,0 +1,103 @@
+"""Request latency with logging off, logging inline, and logging through the background queue.
+
+Runs fully in-process against a throwaway SQLite file, at DEBUG level so that
+every route logs its queries:
+
+    python -m benchmarks.logging_latency --requests 2000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from benchmarks.token_latency import summary
+
+
+def silence_console(handlers: list[logging.Handler]):
+    """Keep RichHandler output out of the report while still paying for rendering it."""
+    for handler in handlers:
+        if hasattr(handler, "console"):
+            handler.console.file = open(os.devnull, "w")
+
+
+def reset_logging():
+    from storeapi import logging_conf
+
+    logging_conf.stop_logging()
+    for name in ("storeapi", "uvicorn", "databases", "aiosqlite"):
+        logger = logging.getLogger(name)
+        logger.handlers.clear()
+        logger.setLevel(logging.NOTSET)
+        logger.propagate = True
+
+
+def set_mode(mode: str):
+    from storeapi import logging_conf
+    from storeapi.config import config
+
+    reset_logging()
+    if mode == "off":
+        return
+    config.LOG_QUEUE_SIZE = 10_000 if mode == "queued" else 0
+    logging_conf.configure_logging()
+    if logging_conf.queue_handler is not None:
+        silence_console(logging_conf.queue_handler.listener.handlers)
+    else:
+        silence_console(logging.getLogger("storeapi").handlers)
+
+
+async def run(requests: int):
+    import httpx
+
+    from storeapi.database import comment_table, database, engine, post_table, user_table
+    from storeapi.main import app
+    from storeapi.migrations import migrate
+
+    migrate(engine)
+    await database.connect()
+    user_id = await database.execute(user_table.insert().values(email="bench@test.com", password="x"))
+    post_id = await database.execute(post_table.insert().values(body="Bench", user_id=user_id))
+    await database.execute(
+        comment_table.insert().values([
+            {"body": f"Comment {i}", "post_id": post_id, "user_id": user_id} for i in range(10)
+        ])
+    )
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for mode in ("warmup", "off", "inline", "queued"):
+            set_mode("off" if mode == "warmup" else mode)
+            samples = []
+            for index in range(requests):
+                url = "/" if index % 2 else f"/post/{post_id}/comment"
+                start = time.perf_counter()
+                response = await client.get(url)
+                samples.append(time.perf_counter() - start)
+                response.raise_for_status()
+            if mode != "warmup":
+                print(f"logging {mode:<7} {summary(samples)}")
+
+    reset_logging()
+    await database.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)  # storeapi.log is written to the working directory
+        os.environ.update({
+            "ENV_STATE": "test",
+            "TEST_DATABASE_URL": f"sqlite:///{tmp}/bench.db",
+            "TEST_DATABASE_ROLLBACK": "false",
+            "TEST_LOG_LEVEL": "DEBUG",
+        })
+        asyncio.run(run(args.requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Peak memory traced while serving listings of 100k rows.
+
+Runs fully in-process against a throwaway SQLite file holding --rows posts,
+all but one of them without comments, and --rows comments on the first
+post, with the response cache off:
+
+    python -m benchmarks.row_memory --rows 100000
+
+Every route is requested once with pydantic validation and once with
+FAST_JSON_RESPONSES. The peak counts everything allocated during the request,
+response body included, as reported by tracemalloc.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+
+
+async def run(rows: int):
+    import httpx
+
+    from storeapi.config import config
+    from storeapi.database import comment_table, database, engine, post_table, user_table
+    from storeapi.main import app
+    from storeapi.migrations import migrate
+
+    # Keep the app's warnings (slow queries over 100k rows) out of the report
+    logging.getLogger("storeapi").addHandler(logging.NullHandler())
+    migrate(engine)
+    with engine.begin() as connection:
+        connection.execute(user_table.insert().values(id=1, email="bench@test.com", password="x"))
+        connection.execute(post_table.insert(), [
+            {"id": id, "body": f"Post {id} with a few more words", "user_id": 1, "likes": id % 50}
+            for id in range(1, rows + 1)
+        ])
+        connection.execute(comment_table.insert(), [
+            {"body": f"Comment {id} on the first post", "post_id": 1, "user_id": 1}
+            for id in range(rows)
+        ])
+
+    await database.connect()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        routes = {
+            "GET /post?format=ndjson": "/post?format=ndjson",
+            "GET /post/{id}": "/post/1",
+            "GET /post/{id}/comment": "/post/1/comment",
+            "GET /post/{id}/comment?format=ndjson": "/post/1/comment?format=ndjson",
+        }
+        print(f"{'route':<36} {'mode':<9} {'peak':>9} {'time':>9} {'body':>9}")
+        for name, url in routes.items():
+            for fast in (False, True):
+                config.FAST_JSON_RESPONSES = fast
+                # Warm up imports and caches outside the traced request
+                await client.get(url)
+                tracemalloc.start()
+                start = time.perf_counter()
+                response = await client.get(url)
+                elapsed = time.perf_counter() - start
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                assert response.status_code == 200, response.text
+                print(
+                    f"{name:<36} {'fast' if fast else 'pydantic':<9} {peak / 2**20:>7.1f}MB "
+                    f"{elapsed * 1000:>7.0f}ms {len(response.content) / 2**20:>7.1f}MB"
+                )
+    await database.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({
+            "ENV_STATE": "test",
+            "TEST_DATABASE_URL": f"sqlite:///{tmp}/bench.db",
+            "TEST_DATABASE_ROLLBACK": "false",
+            "TEST_RESPONSE_CACHE_SIZE": "0",
+        })
+        asyncio.run(run(args.rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""CPU spent turning each request's statements into SQL, with and without the compiled cache.
+
+Builds the statements the hottest routes send, with fresh values every
+iteration as real requests do, and times the databases SQLite backend's
+compile step for each route. No database is touched:
+
+    python -m benchmarks.statement_cache --iterations 5000
+"""
+import argparse
+import os
+import time
+from typing import Callable
+
+
+def requests() -> dict[str, Callable[[int], list]]:
+    """Route -> the statements one request to it compiles, for request number n."""
+    import sqlalchemy
+
+    from storeapi.database import comment_table, like_table, post_table, user_table
+    from storeapi.routers.post import PostSorting, select_post_comments, select_posts
+
+    def get_user(n: int):
+        return user_table.select().where(user_table.c.email == f"user{n}@bench.test")
+
+    def like(n: int) -> list:
+        already_liked = sqlalchemy.exists().where(
+            like_table.c.post_id == n, like_table.c.user_id == 1
+        )
+        return [
+            get_user(n),
+            post_table.update()
+            .where(post_table.c.id == n)
+            .values(likes=post_table.c.likes + 1)
+            .returning(post_table.c.id),
+            like_table.insert()
+            .from_select(
+                ["post_id", "user_id"],
+                sqlalchemy.select(sqlalchemy.literal(n), sqlalchemy.literal(1)).where(~already_liked),
+            )
+            .returning(like_table.c.id),
+        ]
+
+    def comment(n: int) -> list:
+        post_exists = sqlalchemy.exists().where(post_table.c.id == n)
+        return [
+            get_user(n),
+            comment_table.insert()
+            .from_select(
+                ["body", "post_id", "user_id"],
+                sqlalchemy.select(
+                    sqlalchemy.literal(f"Comment {n}"), sqlalchemy.literal(n), sqlalchemy.literal(1)
+                ).where(post_exists),
+            )
+            .returning(comment_table.c.id),
+        ]
+
+    return {
+        "GET /post": lambda n: [select_posts(PostSorting.new, {"id": n}).limit(21)],
+        "GET /post?sorting=most_likes": lambda n: [
+            select_posts(PostSorting.most_likes, {"likes": n, "id": n}).limit(21)
+        ],
+        "GET /post/{id}": lambda n: [
+            post_table.select().where(post_table.c.id == n),
+            select_post_comments(n),
+        ],
+        "POST /comment": comment,
+        "POST /like": like,
+        "POST /like/batch": lambda n: [
+            get_user(n),
+            sqlalchemy.select(post_table.c.id).where(post_table.c.id.in_(range(n % 20 + 1))),
+        ],
+    }
+
+
+def cpu_per_request(connection, build: Callable[[int], list], iterations: int) -> float:
+    """Mean CPU microseconds to compile one request's statements."""
+    statements = [build(n) for n in range(1, iterations + 1)]
+    start = time.process_time()
+    for batch in statements:
+        for query in batch:
+            connection._compile(query)
+    return (time.process_time() - start) / iterations * 1_000_000
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.statement_cache")
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("ENV_STATE", "test")
+    from databases.backends.sqlite import SQLiteBackend
+
+    from storeapi.statements import CachedSQLiteConnection, CompiledCache
+
+    backend = SQLiteBackend("sqlite:///unused.db")
+    plain = backend.connection()
+    cached = CachedSQLiteConnection(backend._pool, backend._dialect, CompiledCache(500))
+
+    print(f"{'route':<32} {'compile':>10} {'cached':>10} {'speedup':>8}")
+    for route, build in requests().items():
+        before = cpu_per_request(plain, build, args.iterations)
+        after = cpu_per_request(cached, build, args.iterations)
+        print(f"{route:<32} {before:>8.1f}us {after:>8.1f}us {before / after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Latency of POST /token, and event loop stalls, under concurrent logins.
+
+Runs fully in-process against a throwaway SQLite file:
+
+    python -m benchmarks.token_latency --concurrency 16 --requests 64 --workers 4
+    python -m benchmarks.token_latency --concurrency 16 --requests 64 --workers 0  # hash inline
+
+Loop lag is how late a 10ms timer fires while the logins run, i.e. the extra
+latency every other request on the worker pays.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def summary(samples: list[float]) -> str:
+    return (
+        f"p50={percentile(samples, 50) * 1000:.1f}ms "
+        f"p99={percentile(samples, 99) * 1000:.1f}ms "
+        f"mean={statistics.fmean(samples) * 1000:.1f}ms"
+    )
+
+
+async def timed(coro) -> float:
+    start = time.perf_counter()
+    response = await coro
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def run(concurrency: int, requests: int):
+    import httpx
+
+    from storeapi.database import database, engine, user_table
+    from storeapi.main import app
+    from storeapi.migrations import migrate
+    from storeapi.security import get_password_hash, password_executor
+
+    migrate(engine)
+    await database.connect()
+    await database.execute(
+        user_table.insert().values(
+            email="bench@test.com", password=get_password_hash("12345"), confirmed=True
+        )
+    )
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        semaphore = asyncio.Semaphore(concurrency)
+        login = {"username": "bench@test.com", "password": "12345"}
+
+        async def token() -> float:
+            async with semaphore:
+                return await timed(client.post("/token", data=login))
+
+        async def loop_lag(stop: asyncio.Event, samples: list[float]):
+            while not stop.is_set():
+                start = time.perf_counter()
+                await asyncio.sleep(0.01)
+                samples.append(time.perf_counter() - start - 0.01)
+
+        stop = asyncio.Event()
+        lag_samples: list[float] = []
+        lag_task = asyncio.create_task(loop_lag(stop, lag_samples))
+        start = time.perf_counter()
+        token_samples = await asyncio.gather(*(token() for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await lag_task
+
+    await database.disconnect()
+    password_executor.shutdown()
+
+    print(f"POST /token  {summary(token_samples)} throughput={requests / elapsed:.1f}/s")
+    print(f"loop lag     {summary(lag_samples)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=4, help="password hash workers, 0 hashes inline")
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({
+            "ENV_STATE": "test",
+            "TEST_DATABASE_URL": f"sqlite:///{tmp}/bench.db",
+            "TEST_DATABASE_ROLLBACK": "false",
+            "TEST_PASSWORD_HASH_WORKERS": str(args.workers),
+            "TEST_PASSWORD_HASH_EXECUTOR": args.executor,
+            "TEST_PASSWORD_HASH_QUEUE_LIMIT": str(args.requests),
+        })
+        asyncio.run(run(args.concurrency, args.requests))
+
+
+if __name__ == "__main__":
+    main()
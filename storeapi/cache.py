@@ -0,0 +1,94 @@
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class CacheBackend(ABC):
+    """Key/value cache interface.
+
+    The in-process LRUCache is the only implementation for now; a backend
+    shared between workers only has to provide the same methods.
+    """
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        # Called with every key the backend drops by itself, on eviction or expiry
+        self.on_evict: Callable[[Hashable], None] | None = None
+
+    @abstractmethod
+    def get(self, key: Hashable) -> Any | None:
+        """Return the cached value, or None if it is missing or expired."""
+
+    @abstractmethod
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        """Store a value, expiring after ttl seconds (or the backend default)."""
+
+    @abstractmethod
+    def delete(self, key: Hashable) -> None:
+        """Drop a key if it is present."""
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Drop every key."""
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class LRUCache(CacheBackend):
+    """Bounded in-process cache with least-recently-used eviction and a TTL."""
+
+    def __init__(
+            self, maxsize: int, ttl: float, timer: Callable[[], float] = time.monotonic
+    ) -> None:
+        super().__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= self.timer():
+            del self._entries[key]
+            self.misses += 1
+            self._evicted(key)
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        if self.maxsize <= 0:
+            self._evicted(key)
+            return
+        expires_at = self.timer() + (self.ttl if ttl is None else ttl)
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            evicted, _ = self._entries.popitem(last=False)
+            self._evicted(evicted)
+
+    def delete(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def _evicted(self, key: Hashable) -> None:
+        if self.on_evict is not None:
+            self.on_evict(key)
@@ -0,0 +1,79 @@
+"""Maintenance commands, run as ``python -m storeapi.commands <command>``."""
+import argparse
+import asyncio
+import logging
+
+from storeapi.database import database, engine, like_shard_table, post_table
+from storeapi.migrations import migrate, reconcile_likes_queries
+from storeapi.search import search_index
+from storeapi.tasks import requeue_dead_letters
+
+logger = logging.getLogger(__name__)
+
+
+async def reconcile_post_likes() -> int:
+    """Recompute posts.likes from the likes table.
+
+    Only posts whose counter has drifted are rewritten. The buffered counts
+    in the like counter shards are dropped, as posts.likes now includes
+    them; with BUFFERED_LIKES on, run it while no server is counting likes.
+    Returns the number of posts that were corrected.
+    """
+    corrected = 0
+    async with database.transaction():
+        await database.execute(like_shard_table.delete())
+        for query in reconcile_likes_queries():
+            corrected += len(await database.fetch_all(query.returning(post_table.c.id)))
+    logger.info("Reconciled like counters for %s posts", corrected)
+    return corrected
+
+
+async def migrate_schema() -> int:
+    """Apply pending schema migrations. Returns the resulting schema version."""
+    return migrate(engine)
+
+
+async def requeue_dead_emails() -> int:
+    """Retry every email that ran out of attempts. Returns how many were requeued."""
+    requeued = await requeue_dead_letters()
+    logger.info("Requeued %s dead emails", requeued)
+    return requeued
+
+
+async def rebuild_search_index() -> int:
+    """Reindex every post and comment. Returns the number of documents indexed.
+
+    Only the FTS5 index is shared; the in-memory index belongs to each server
+    process, which loads it when it starts and catches up from then on.
+    """
+    indexed = await search_index.rebuild()
+    logger.info("Indexed %s documents for search", indexed)
+    return indexed
+
+
+COMMANDS = {
+    "migrate": migrate_schema,
+    "rebuild-search": rebuild_search_index,
+    "reconcile-likes": reconcile_post_likes,
+    "requeue-dead-emails": requeue_dead_emails,
+}
+
+
+async def run(command: str):
+    await database.connect()
+    try:
+        return await COMMANDS[command]()
+    finally:
+        await database.disconnect()
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m storeapi.commands")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    args = parser.parse_args(argv)
+    result = asyncio.run(run(args.command))
+    print(f"{args.command}: {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 from functools import lru_cache
-from typing import Optional
+from typing import Literal, Optional
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -15,9 +15,103 @@ class BaseConfig(BaseSettings):
 class GlobalConfig(BaseConfig):
     DATABASE_URL: Optional[str] = None
     DATABASE_ROLLBACK: bool = False
+    # Apply schema migrations when a server process starts. Processes take
+    # turns; turn it off to migrate with `python -m storeapi.commands migrate`
+    # before starting them instead
+    MIGRATE_ON_STARTUP: bool = True
+    # GET routes read from these, e.g. '["postgresql://replica1/storeapi"]'
+    READ_REPLICA_URLS: list[str] = []
+    READ_REPLICA_POLICY: Literal["round_robin", "least_loaded"] = "round_robin"
+    # How long a client that just wrote reads from the primary, on any worker
+    # (it is told so by a cookie)
+    READ_YOUR_WRITES_SECONDS: float = 5.0
+    # Pool bounds for client/server databases; SQLite opens a connection per use
+    DATABASE_POOL_MIN_SIZE: int = 1
+    DATABASE_POOL_MAX_SIZE: int = 10
+    # Seconds to wait when opening a connection (databases' pools take no
+    # separate checkout timeout); the sync engine also waits this long for a
+    # free pooled connection
+    DATABASE_ACQUIRE_TIMEOUT: float = 30.0
+    # Prepared statements kept per connection (asyncpg, sqlite3)
+    DATABASE_STATEMENT_CACHE_SIZE: int = 256
+    # Compiled SQLAlchemy statements reused across executions (SQLite); 0 compiles every time
+    DATABASE_COMPILED_CACHE_SIZE: int = 500
+    # Applied to every SQLite connection; WAL lets readers run alongside a writer
+    SQLITE_JOURNAL_MODE: str = "wal"
+    SQLITE_SYNCHRONOUS: str = "normal"
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    # Take the write lock when a transaction begins. A deferred transaction
+    # that reads before writing fails with SQLITE_BUSY instead of waiting
+    # whenever another writer got there first.
+    SQLITE_IMMEDIATE_TRANSACTIONS: bool = True
+    # Statements at least this slow are logged as warnings; None turns the log off
+    SLOW_QUERY_MS: Optional[float] = 200.0
+    # Also log the query plan of slow statements (runs an extra EXPLAIN)
+    SLOW_QUERY_EXPLAIN: bool = False
     MAILGUN_DOMAIN: Optional[str] = None
     MAILGUN_API_KEY: Optional[str] = None
+    MAILGUN_BASE_URL: str = "https://api.mailgun.net"
+    MAILGUN_TIMEOUT: float = 10.0
+    # Concurrent sends, and keep-alive connections held to Mailgun
+    MAIL_WORKERS: int = 4
+    MAIL_MAX_ATTEMPTS: int = 8
+    # Retry n waits MAIL_RETRY_BASE_DELAY * 2 ** (n - 1) seconds, capped
+    MAIL_RETRY_BASE_DELAY: float = 2.0
+    MAIL_RETRY_MAX_DELAY: float = 600.0
+    # How often the outbox is checked for retries and for mail queued by other workers
+    MAIL_POLL_INTERVAL: float = 5.0
+    # A claimed email is handed out again if not settled within this many seconds
+    MAIL_LEASE_SECONDS: float = 60.0
+    # Emails sharing a subject and body go out together, up to Mailgun's limit of 1000
+    MAIL_BATCH_SIZE: int = 1000
+    # How long a newly queued email waits for others to join its batch
+    MAIL_BATCH_WINDOW: float = 0.5
     LOGTAIL_API_KEY: Optional[str] = None
+    # Defaults to DEBUG in dev and INFO elsewhere
+    LOG_LEVEL: Optional[str] = None
+    # Records go through a bounded queue to a background thread; size 0 logs inline
+    LOG_QUEUE_SIZE: int = 10_000
+    LOG_QUEUE_POLICY: Literal["drop", "block"] = "drop"
+    LOG_SHIP_BATCH_SIZE: int = 1000
+    LOG_SHIP_INTERVAL: float = 1.0
+    USER_CACHE_SIZE: int = 1024
+    USER_CACHE_TTL: float = 60.0
+    TOKEN_CACHE_SIZE: int = 4096
+    # Rendered GET /post and /post/{id} responses; size 0 turns caching off
+    RESPONSE_CACHE_SIZE: int = 512
+    RESPONSE_CACHE_TTL: float = 5.0
+    # Dump post and comment responses straight from the rows, skipping
+    # pydantic validation; same bytes, uses orjson if installed
+    FAST_JSON_RESPONSES: bool = False
+    # Count likes in memory and add them to sharded counter rows in batches,
+    # instead of updating the post's row on every like. A crash loses the
+    # likes of the last flush interval, at most BUFFERED_LIKES_MAX_UNFLUSHED
+    # of them (reconcile-likes recounts them).
+    BUFFERED_LIKES: bool = False
+    BUFFERED_LIKES_SHARDS: int = 16
+    BUFFERED_LIKES_FLUSH_INTERVAL: float = 1.0
+    BUFFERED_LIKES_MAX_UNFLUSHED: int = 1000
+    # How often shard rows are folded into posts.likes, where counts show up
+    BUFFERED_LIKES_FOLD_INTERVAL: float = 5.0
+    # bcrypt runs on this pool; 0 workers hashes inline on the event loop
+    PASSWORD_HASH_EXECUTOR: Literal["thread", "process"] = "thread"
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_QUEUE_LIMIT: int = 64
+    # Shared by all workers of one server so /metrics covers every process;
+    # empty it before starting the server. Unset reports this process only.
+    METRICS_MULTIPROC_DIR: Optional[str] = None
+    METRICS_WRITE_INTERVAL: float = 5.0
+    # /metrics and /internal/* expose SQL, query plans and request ids; they
+    # answer 404 unless enabled, and with a token set also need it as a
+    # bearer token
+    INTERNAL_ROUTES_ENABLED: bool = False
+    INTERNAL_ROUTES_TOKEN: Optional[str] = None
+    # "auto" uses SQLite FTS5 when available and an in-memory index otherwise
+    SEARCH_BACKEND: Literal["auto", "fts5", "memory"] = "auto"
+    # How stale the in-memory index may get before a search picks up what
+    # other workers wrote
+    SEARCH_REFRESH_INTERVAL: float = 5.0
 
 
 class DevConfig(GlobalConfig):
@@ -1,6 +1,11 @@
-import databases
+import sqlite3
+
 import sqlalchemy
+from databases import DatabaseURL
+
 from storeapi.config import config
+from storeapi.instrumentation import InstrumentedDatabase
+from storeapi.replicas import ReplicaSet
 
 metadata = sqlalchemy.MetaData()
 
@@ -10,6 +15,11 @@ post_table = sqlalchemy.Table(
     sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
     sqlalchemy.Column("body", sqlalchemy.String),
     sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False),
+    # Denormalized count of rows in likes, maintained by like_post
+    sqlalchemy.Column("likes", sqlalchemy.Integer, nullable=False, server_default="0"),
+    sqlalchemy.Index("ix_posts_user_id", "user_id"),
+    # Serves the most_likes ordering and its (likes, id) keyset seek
+    sqlalchemy.Index("ix_posts_likes_id", "likes", "id"),
 )
 
 user_table = sqlalchemy.Table(
@@ -27,7 +37,9 @@ comment_table = sqlalchemy.Table(
     sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
     sqlalchemy.Column("body", sqlalchemy.String),
     sqlalchemy.Column("post_id", sqlalchemy.ForeignKey("posts.id"), nullable=False),
-    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False)
+    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False),
+    sqlalchemy.Index("ix_comments_post_id", "post_id"),
+    sqlalchemy.Index("ix_comments_user_id", "user_id"),
 )
 
 like_table = sqlalchemy.Table(
@@ -35,14 +47,135 @@ like_table = sqlalchemy.Table(
     metadata,
     sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
     sqlalchemy.Column("post_id", sqlalchemy.ForeignKey("posts.id"), nullable=False),
-    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False)
+    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False),
+    # One like per user per post; also serves lookups by post_id
+    sqlalchemy.Index("ix_likes_post_id_user_id", "post_id", "user_id", unique=True),
+    sqlalchemy.Index("ix_likes_user_id", "user_id"),
+)
+
+# Like counts not yet in posts.likes, written by likes.LikeCounter when
+# BUFFERED_LIKES is on. Each post's count is spread over up to
+# BUFFERED_LIKES_SHARDS rows, so flushes from different processes rarely
+# update the same row; reads add them up.
+like_shard_table = sqlalchemy.Table(
+    "post_like_shards",
+    metadata,
+    sqlalchemy.Column("post_id", sqlalchemy.ForeignKey("posts.id"), primary_key=True),
+    sqlalchemy.Column("shard", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("count", sqlalchemy.Integer, nullable=False),
 )
 
-engine = sqlalchemy.create_engine(
-    config.DATABASE_URL, connect_args={"check_same_thread": False}
+# Outbound email, written in the same transaction as the change that causes
+# it and delivered by tasks.EmailOutbox. Delivered rows are deleted; rows that
+# ran out of attempts stay behind with status "dead".
+email_outbox_table = sqlalchemy.Table(
+    "email_outbox",
+    metadata,
+    sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("recipient", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("subject", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("body", sqlalchemy.Text, nullable=False),
+    # JSON object substituted for %recipient.<name>% in subject and body
+    sqlalchemy.Column("variables", sqlalchemy.Text),
+    sqlalchemy.Column("status", sqlalchemy.String, nullable=False, server_default="pending"),
+    sqlalchemy.Column("attempts", sqlalchemy.Integer, nullable=False, server_default="0"),
+    # Unix time; also pushed forward while a worker holds the row
+    sqlalchemy.Column("next_attempt_at", sqlalchemy.Float, nullable=False),
+    sqlalchemy.Column("created_at", sqlalchemy.Float, nullable=False),
+    sqlalchemy.Column("last_error", sqlalchemy.String),
+    sqlalchemy.Index("ix_email_outbox_status_next_attempt_at", "status", "next_attempt_at"),
+)
+
+SQLITE_PRAGMAS = {
+    "journal_mode": config.SQLITE_JOURNAL_MODE,
+    "synchronous": config.SQLITE_SYNCHRONOUS,
+    "mmap_size": config.SQLITE_MMAP_SIZE,
+    "busy_timeout": config.SQLITE_BUSY_TIMEOUT_MS,
+}
+
+
+class TunedSQLiteConnection(sqlite3.Connection):
+    """sqlite3 connection that applies SQLITE_PRAGMAS as soon as it is opened.
+
+    Used as the connection factory by both aiosqlite and the sync engine, so
+    every connection either of them opens is set up the same way. With
+    SQLITE_IMMEDIATE_TRANSACTIONS, the plain BEGIN that databases issues for
+    database.transaction() becomes BEGIN IMMEDIATE.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        for name, value in SQLITE_PRAGMAS.items():
+            self.execute(f"PRAGMA {name} = {value}")
+
+    def execute(self, sql: str, *args):
+        if sql == "BEGIN" and config.SQLITE_IMMEDIATE_TRANSACTIONS:
+            sql = "BEGIN IMMEDIATE"
+        return super().execute(sql, *args)
+
+
+def sqlite_connect_args() -> dict:
+    return {
+        "factory": TunedSQLiteConnection,
+        "cached_statements": config.DATABASE_STATEMENT_CACHE_SIZE,
+    }
+
+
+def database_options(url: str) -> dict:
+    """Backend-specific options for databases.Database."""
+    dialect = DatabaseURL(url).dialect
+    if dialect == "sqlite":
+        return sqlite_connect_args()
+    if dialect == "postgresql":
+        return {
+            "min_size": config.DATABASE_POOL_MIN_SIZE,
+            "max_size": config.DATABASE_POOL_MAX_SIZE,
+            "timeout": config.DATABASE_ACQUIRE_TIMEOUT,
+            "statement_cache_size": config.DATABASE_STATEMENT_CACHE_SIZE,
+        }
+    if dialect == "mysql":
+        return {
+            "minsize": config.DATABASE_POOL_MIN_SIZE,
+            "maxsize": config.DATABASE_POOL_MAX_SIZE,
+            "connect_timeout": config.DATABASE_ACQUIRE_TIMEOUT,
+        }
+    return {}
+
+
+def engine_options(url: str) -> dict:
+    """Backend-specific options for the sync engine used by migrations and commands."""
+    if DatabaseURL(url).dialect == "sqlite":
+        return {"connect_args": {"check_same_thread": False, **sqlite_connect_args()}}
+    return {
+        "pool_size": config.DATABASE_POOL_MAX_SIZE,
+        "pool_timeout": config.DATABASE_ACQUIRE_TIMEOUT,
+        "pool_pre_ping": True,
+    }
+
+
+engine = sqlalchemy.create_engine(config.DATABASE_URL, **engine_options(config.DATABASE_URL))
+
+database = InstrumentedDatabase(
+    config.DATABASE_URL,
+    **database_options(config.DATABASE_URL),
+    force_rollback=config.DATABASE_ROLLBACK,
+    slow_query_ms=config.SLOW_QUERY_MS,
+    explain_slow_queries=config.SLOW_QUERY_EXPLAIN,
+    compiled_cache_size=config.DATABASE_COMPILED_CACHE_SIZE,
 )
 
-metadata.create_all(engine)
-database = databases.Database(
-    config.DATABASE_URL, force_rollback=config.DATABASE_ROLLBACK
+replicas = ReplicaSet(
+    database,
+    [
+        InstrumentedDatabase(
+            url,
+            **database_options(url),
+            slow_query_ms=config.SLOW_QUERY_MS,
+            explain_slow_queries=config.SLOW_QUERY_EXPLAIN,
+            compiled_cache_size=config.DATABASE_COMPILED_CACHE_SIZE,
+        )
+        for url in config.READ_REPLICA_URLS
+    ],
+    policy=config.READ_REPLICA_POLICY,
+    sticky_seconds=config.READ_YOUR_WRITES_SECONDS,
 )
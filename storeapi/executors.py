@@ -0,0 +1,64 @@
+import asyncio
+import concurrent.futures
+import time
+from typing import Any, Callable, Literal
+
+from storeapi.metrics import Histogram
+
+
+class ExecutorSaturatedError(Exception):
+    pass
+
+
+class BoundedExecutor:
+    """Runs blocking calls off the event loop with a cap on queued work.
+
+    Calls beyond queue_limit (running plus waiting) are rejected with
+    ExecutorSaturatedError instead of piling up behind the workers. With
+    workers=0 calls run inline on the event loop. latency records each
+    call's duration in milliseconds, time spent queued included.
+    """
+
+    def __init__(
+            self, workers: int, queue_limit: int, kind: Literal["thread", "process"] = "thread"
+    ) -> None:
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.kind = kind
+        self.pending = 0
+        self.rejected = 0
+        self.latency = Histogram()
+        self._executor: concurrent.futures.Executor | None = None
+
+    @property
+    def executor(self) -> concurrent.futures.Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="storeapi-worker"
+                )
+        return self._executor
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        started = time.perf_counter()
+        if self.workers <= 0:
+            try:
+                return fn(*args)
+            finally:
+                self.latency.observe((time.perf_counter() - started) * 1000)
+        if self.pending >= self.queue_limit:
+            self.rejected += 1
+            raise ExecutorSaturatedError(f"{self.pending} calls already queued")
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+            self.latency.observe((time.perf_counter() - started) * 1000)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
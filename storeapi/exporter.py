@@ -0,0 +1,218 @@
+"""The families served at /metrics, gathered from the modules that own the numbers."""
+import asyncio
+import contextlib
+import logging
+
+from storeapi import logging_conf
+from storeapi.config import config
+from storeapi.database import replicas
+from storeapi.instrumentation import OTHER_SHAPE
+from storeapi.metrics import (
+    Histogram,
+    MultiProcessStore,
+    RequestMetrics,
+    family,
+    histogram_family,
+    labels,
+    render,
+)
+from storeapi.routers.post import like_counter, response_cache
+from storeapi.security import password_executor, revoked_tokens, token_cache, user_cache
+from storeapi.sql_logging import sql_text_cache
+from storeapi.tasks import email_outbox
+
+logger = logging.getLogger(__name__)
+
+request_metrics = RequestMetrics()
+metrics_store = (
+    MultiProcessStore(config.METRICS_MULTIPROC_DIR, stale_after=3 * config.METRICS_WRITE_INTERVAL)
+    if config.METRICS_MULTIPROC_DIR
+    else None
+)
+metrics_writer: asyncio.Task | None = None
+
+
+def named_databases() -> dict:
+    databases = {"primary": replicas.primary}
+    databases.update(
+        (f"replica{index}", replica) for index, replica in enumerate(replicas.replicas, 1)
+    )
+    return databases
+
+
+def cache_families() -> list[dict]:
+    """Hits and misses per cache; the hit ratio is hits / (hits + misses)."""
+    caches = {
+        "user": user_cache,
+        "token": token_cache,
+        "response": response_cache.backend,
+        "sql_text": sql_text_cache,
+    }
+    for name, db in named_databases().items():
+        if db.compiled_cache is not None:
+            caches[f"compiled_sql:{name}"] = db.compiled_cache
+    return [
+        family(
+            "storeapi_cache_hits_total", "counter", "Cache lookups that found an entry.",
+            {labels(cache=name): cache.hits for name, cache in caches.items()},
+        ),
+        family(
+            "storeapi_cache_misses_total", "counter", "Cache lookups that found nothing.",
+            {labels(cache=name): cache.misses for name, cache in caches.items()},
+        ),
+        family(
+            "storeapi_cache_entries", "gauge", "Entries currently cached.",
+            {labels(cache=name): len(cache) for name, cache in caches.items()},
+        ),
+    ]
+
+
+def auth_families() -> list[dict]:
+    return [
+        histogram_family(
+            "storeapi_password_hash_duration_seconds",
+            "bcrypt hash and verify calls, time queued for a worker included.",
+            {"": password_executor.latency},
+        ),
+        family(
+            "storeapi_password_hash_pending", "gauge",
+            "bcrypt calls running or queued.", {"": password_executor.pending},
+        ),
+        family(
+            "storeapi_password_hash_rejected_total", "counter",
+            "bcrypt calls shed with 503 because the queue was full.",
+            {"": password_executor.rejected},
+        ),
+        family(
+            "storeapi_revoked_tokens", "gauge",
+            "Revoked tokens not yet expired.", {"": len(revoked_tokens)},
+        ),
+    ]
+
+
+def database_families() -> list[dict]:
+    databases = named_databases()
+    by_statement: dict[str, Histogram] = {}
+    for name, db in databases.items():
+        for stats in db.query_stats.values():
+            sql = str(stats.sql)
+            statement = "OTHER" if sql == OTHER_SHAPE else sql.split(None, 1)[0].upper()
+            histogram = by_statement.setdefault(
+                labels(database=name, statement=statement), Histogram()
+            )
+            histogram.add(stats.histogram)
+    return [
+        histogram_family(
+            "storeapi_db_query_duration_seconds",
+            "Database statements by database and kind (SELECT, INSERT, ...).",
+            by_statement,
+        ),
+        family(
+            "storeapi_db_slow_queries_total", "counter", "Statements over SLOW_QUERY_MS.",
+            {labels(database=name): db.slow_query_count for name, db in databases.items()},
+        ),
+        family(
+            "storeapi_db_statements_in_flight", "gauge", "Statements running right now.",
+            {labels(database=name): db.in_flight for name, db in databases.items()},
+        ),
+    ]
+
+
+def email_families() -> list[dict]:
+    return [
+        family(
+            "storeapi_emails_total", "counter",
+            "Outbox deliveries by outcome (sent, retried, dead).",
+            {
+                labels(outcome="sent"): email_outbox.sent,
+                labels(outcome="retried"): email_outbox.retried,
+                labels(outcome="dead"): email_outbox.dead,
+            },
+        ),
+        family(
+            "storeapi_email_requests_total", "counter",
+            "Requests made to Mailgun; each carries a batch of emails.",
+            {"": email_outbox.requests},
+        ),
+    ]
+
+
+def like_families() -> list[dict]:
+    return [
+        family(
+            "storeapi_buffered_likes_flushed_total", "counter",
+            "Buffered likes written to the like counter shards.",
+            {"": like_counter.flushed},
+        ),
+        family(
+            "storeapi_buffered_likes_unflushed", "gauge",
+            "Buffered likes counted in memory and not written yet.",
+            {"": like_counter.unflushed},
+        ),
+        family(
+            "storeapi_buffered_likes_folded_total", "counter",
+            "Flushed likes this worker folded from the shards into posts.likes.",
+            {"": like_counter.folded},
+        ),
+    ]
+
+
+def logging_families() -> list[dict]:
+    handler = logging_conf.queue_handler
+    return [
+        family(
+            "storeapi_log_records_dropped_total", "counter",
+            "Log records dropped because the log queue was full.",
+            {"": 0 if handler is None else handler.dropped},
+        ),
+    ]
+
+
+def process_families() -> list[dict]:
+    return [
+        *request_metrics.families(),
+        *auth_families(),
+        *database_families(),
+        *cache_families(),
+        *email_families(),
+        *like_families(),
+        *logging_families(),
+    ]
+
+
+def exposition() -> str:
+    """Metrics of this process, or of every worker when METRICS_MULTIPROC_DIR is set."""
+    families = process_families()
+    if metrics_store is not None:
+        families = metrics_store.collect(families)
+    return render(families)
+
+
+async def write_metrics_periodically(store: MultiProcessStore, interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            store.write(process_families())
+        except OSError:
+            logger.warning("Could not write metrics to %s", store.directory, exc_info=True)
+
+
+def start_metrics_writer() -> None:
+    """Keep this worker's snapshot fresh for scrapes served by the other workers."""
+    global metrics_writer
+    if metrics_store is not None and metrics_writer is None:
+        metrics_writer = asyncio.create_task(
+            write_metrics_periodically(metrics_store, config.METRICS_WRITE_INTERVAL)
+        )
+
+
+async def stop_metrics_writer() -> None:
+    global metrics_writer
+    if metrics_writer is None:
+        return
+    metrics_writer.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await metrics_writer
+    metrics_writer = None
+    # Final counts, so they outlive the process
+    metrics_store.write(process_families())
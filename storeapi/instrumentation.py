@@ -0,0 +1,266 @@
+"""Per-statement timing for the databases layer, with a slow-query log."""
+import logging
+import time
+from collections import deque
+from typing import Any
+
+import databases
+import sqlalchemy
+from asgi_correlation_id import correlation_id
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine.cursor import CursorResultMetaData
+from sqlalchemy.sql import ClauseElement
+
+from storeapi.metrics import Histogram
+from storeapi.sql_logging import LazySQL, log_query, sql_text, statement_shape
+from storeapi.statements import CachedSQLiteBackend, CompiledCache, compiled_cache_supported
+
+logger = logging.getLogger(__name__)
+
+# Statements that cannot be keyed by shape, and shapes beyond max_shapes
+OTHER_SHAPE = "<other>"
+
+EXPLAIN_PREFIXES = {"sqlite": "EXPLAIN QUERY PLAN ", "postgresql": "EXPLAIN "}
+
+# Named placeholders, so the compiled SQL can be run again as a text() query
+EXPLAIN_DIALECTS = {
+    "sqlite": sqlite.dialect(paramstyle="named"),
+    "postgresql": postgresql.dialect(paramstyle="named"),
+}
+
+
+class QueryStats:
+    __slots__ = ("sql", "histogram")
+
+    def __init__(self, sql: LazySQL | str) -> None:
+        # Rendered when a snapshot is taken, never on the query path
+        self.sql = sql
+        self.histogram = Histogram()
+
+
+class InstrumentedDatabase(databases.Database):
+    """databases.Database that times every statement.
+
+    Durations go into a latency histogram per statement shape and into the
+    debug query log. Statements slower than slow_query_ms are also logged
+    as warnings with the request's correlation id, kept in a short list of
+    recent slow queries and, if explain_slow_queries is set, explained.
+    On SQLite, up to compiled_cache_size compiled statements are reused.
+    """
+
+    def __init__(
+            self,
+            url: str,
+            *,
+            slow_query_ms: float | None = None,
+            explain_slow_queries: bool = False,
+            max_shapes: int = 500,
+            max_slow_queries: int = 100,
+            compiled_cache_size: int = 0,
+            **options: Any,
+    ) -> None:
+        super().__init__(url, **options)
+        self.compiled_cache: CompiledCache | None = None
+        if compiled_cache_size and self.url.dialect == "sqlite" and compiled_cache_supported():
+            self.compiled_cache = CompiledCache(compiled_cache_size)
+            # Replaces the plain backend databases chose; nothing has connected yet
+            self._backend = CachedSQLiteBackend(self.url, self.compiled_cache, **self.options)
+        self.slow_query_ms = slow_query_ms
+        self.explain_slow_queries = explain_slow_queries
+        self.max_shapes = max_shapes
+        self.query_stats: dict[Any, QueryStats] = {}
+        self.slow_queries: deque[dict] = deque(maxlen=max_slow_queries)
+        self.slow_query_count = 0
+        # Statements running right now; lets a ReplicaSet pick the least loaded replica
+        self.in_flight = 0
+
+    async def fetch_all(self, query, values=None):
+        started = time.perf_counter()
+        self.in_flight += 1
+        try:
+            rows = await super().fetch_all(query, values)
+        finally:
+            self.in_flight -= 1
+        await self.record(query, values, started, len(rows))
+        return rows
+
+    async def fetch_one(self, query, values=None):
+        started = time.perf_counter()
+        self.in_flight += 1
+        try:
+            row = await super().fetch_one(query, values)
+        finally:
+            self.in_flight -= 1
+        await self.record(query, values, started, 0 if row is None else 1)
+        return row
+
+    async def fetch_val(self, query, values=None, column=0):
+        started = time.perf_counter()
+        self.in_flight += 1
+        try:
+            value = await super().fetch_val(query, values, column=column)
+        finally:
+            self.in_flight -= 1
+        await self.record(query, values, started, None)
+        return value
+
+    async def execute(self, query, values=None):
+        started = time.perf_counter()
+        self.in_flight += 1
+        try:
+            result = await super().execute(query, values)
+        finally:
+            self.in_flight -= 1
+        await self.record(query, values, started, None)
+        return result
+
+    async def execute_many(self, query, values):
+        started = time.perf_counter()
+        self.in_flight += 1
+        try:
+            await super().execute_many(query, values)
+        finally:
+            self.in_flight -= 1
+        await self.record(query, None, started, len(values))
+
+    async def iterate(self, query, values=None):
+        started = time.perf_counter()
+        rows = 0
+        self.in_flight += 1
+        try:
+            async for row in super().iterate(query, values):
+                rows += 1
+                yield row
+        finally:
+            self.in_flight -= 1
+        # Includes the time the consumer spent between rows
+        await self.record(query, values, started, rows)
+
+    async def iterate_values(self, query: ClauseElement):
+        """Like iterate, but yields each row as a plain tuple of its values.
+
+        On SQLite the tuples come straight off the cursor, without the Row
+        and Record databases wraps around every row, as long as databases and
+        SQLAlchemy still have the private parts that takes.
+        """
+        started = time.perf_counter()
+        rows = 0
+        self.in_flight += 1
+        try:
+            async with self.connection() as connection:
+                if self.url.dialect == "sqlite" and sqlite_values_supported(connection):
+                    async with connection._query_lock:
+                        async for values in sqlite_values(connection._connection, query):
+                            rows += 1
+                            yield values
+                else:
+                    async for row in connection.iterate(query):
+                        rows += 1
+                        yield tuple(row._mapping.values())
+        finally:
+            self.in_flight -= 1
+        await self.record(query, None, started, rows)
+
+    async def record(
+            self, query: ClauseElement | str, values: dict | None, started: float, rows: int | None
+    ) -> None:
+        duration_ms = (time.perf_counter() - started) * 1000
+        self.observe(query, duration_ms)
+        log_query(query, duration_ms, rows)
+        if self.slow_query_ms is not None and duration_ms >= self.slow_query_ms:
+            await self.log_slow_query(query, values, duration_ms)
+
+    def observe(self, query: ClauseElement | str, duration_ms: float) -> None:
+        shape = statement_shape(query)
+        stats = self.query_stats.get(shape)
+        if stats is None:
+            if shape is None or len(self.query_stats) >= self.max_shapes:
+                shape = OTHER_SHAPE
+                stats = self.query_stats.get(shape)
+            if stats is None:
+                sql = OTHER_SHAPE if shape == OTHER_SHAPE else LazySQL(query)
+                stats = self.query_stats[shape] = QueryStats(sql)
+        stats.histogram.observe(duration_ms)
+
+    async def log_slow_query(
+            self, query: ClauseElement | str, values: dict | None, duration_ms: float
+    ) -> None:
+        self.slow_query_count += 1
+        request_id = correlation_id.get()
+        plan = await self.explain(query, values) if self.explain_slow_queries else None
+        self.slow_queries.append({
+            "sql": sql_text(query),
+            "duration_ms": round(duration_ms, 3),
+            "request_id": request_id,
+            "plan": plan,
+        })
+        logger.warning(
+            "Slow query (%.2fms): %s%s", duration_ms, LazySQL(query),
+            "" if plan is None else "\n" + "\n".join(plan),
+            extra={"duration_ms": round(duration_ms, 3), "request_id": request_id, "plan": plan},
+        )
+
+    async def explain(self, query: ClauseElement | str, values: dict | None) -> list[str] | None:
+        """The database's plan for a statement, one line per row, or None if unavailable."""
+        dialect = self.url.dialect
+        prefix = EXPLAIN_PREFIXES.get(dialect)
+        if prefix is None:
+            return None
+        if isinstance(query, str):
+            sql, params = query, values or {}
+        else:
+            compiled = query.compile(
+                dialect=EXPLAIN_DIALECTS[dialect], compile_kwargs={"render_postcompile": True}
+            )
+            sql, params = compiled.string, compiled.params
+        try:
+            # Straight to the base class, so the EXPLAIN itself is not recorded
+            rows = await super().fetch_all(sqlalchemy.text(prefix + sql).bindparams(**params))
+        except Exception:
+            logger.warning("Could not explain query: %s", sql, exc_info=True)
+            return None
+        # The plan text is the last column on both backends
+        return [str(tuple(row._mapping.values())[-1]) for row in rows]
+
+    def query_metrics(self) -> dict:
+        """Histograms per statement shape, slowest total first, and the recent slow queries."""
+        shapes = sorted(
+            self.query_stats.values(), key=lambda stats: stats.histogram.sum, reverse=True
+        )
+        return {
+            "queries": [
+                {"sql": str(stats.sql), **stats.histogram.snapshot()} for stats in shapes
+            ],
+            "slow_queries": list(self.slow_queries),
+        }
+
+    def reset_metrics(self) -> None:
+        self.query_stats.clear()
+        self.slow_queries.clear()
+        self.slow_query_count = 0
+
+
+def sqlite_values_supported(connection: databases.core.Connection) -> bool:
+    return (
+        hasattr(connection, "_query_lock")
+        and hasattr(connection._connection, "raw_connection")
+        and callable(getattr(connection._connection, "_compile", None))
+        and "_processors" in getattr(CursorResultMetaData, "__slots__", ())
+    )
+
+
+async def sqlite_values(connection, query: ClauseElement):
+    """The rows of query as tuples, on a databases SQLite backend connection."""
+    sql, args, _, context = connection._compile(query)
+    async with connection.raw_connection.execute(sql, args) as cursor:
+        # Only types SQLite cannot store natively (dates, booleans, ...) need converting
+        processors = CursorResultMetaData(context, cursor.description)._processors
+        if not any(processors):
+            async for values in cursor:
+                yield values
+            return
+        async for values in cursor:
+            yield tuple(
+                value if process is None else process(value)
+                for process, value in zip(processors, values)
+            )
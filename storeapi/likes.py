@@ -0,0 +1,207 @@
+"""Buffered like counts for posts that are liked faster than their row can be updated.
+
+With BUFFERED_LIKES, a like still inserts its row into likes, which is what
+keeps a user to one like per post, but the count is only bumped in memory.
+A LikeCounter adds the counts up per post and writes them to
+post_like_shards in one statement per flush, each flush to a randomly
+picked shard row of every post, so flushes from several workers rarely
+wait on one another. Every fold_interval seconds the shard rows are folded
+into posts.likes and deleted. Reads only ever look at posts.likes, which
+keeps the most_likes ordering and its keyset seek on ix_posts_likes_id;
+a like shows up there within a flush and a fold interval.
+"""
+import asyncio
+import contextlib
+import logging
+import random
+import time
+from collections import Counter
+from typing import Callable, Iterable
+
+import sqlalchemy
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+from storeapi.database import database, like_shard_table, post_table
+
+logger = logging.getLogger(__name__)
+
+# Rows per INSERT, well under SQLite's limit on bound parameters
+FLUSH_CHUNK_SIZE = 500
+
+UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+# MySQL has no DELETE ... RETURNING; folds there lock the shard rows with
+# SELECT ... FOR UPDATE and delete the rows they read
+DELETE_RETURNING_DIALECTS = {"sqlite", "postgresql"}
+
+
+def add_to_shards(rows: list[dict]):
+    """INSERT rows into post_like_shards, adding their count to rows already there."""
+    dialect = database.url.dialect
+    if dialect == "mysql":
+        query = mysql.insert(like_shard_table).values(rows)
+        return query.on_duplicate_key_update(count=like_shard_table.c.count + query.inserted.count)
+    query = UPSERT_INSERTS[dialect](like_shard_table).values(rows)
+    return query.on_conflict_do_update(
+        index_elements=[like_shard_table.c.post_id, like_shard_table.c.shard],
+        set_={"count": like_shard_table.c.count + query.excluded.count},
+    )
+
+
+def add_to_posts(counts: dict[int, int]):
+    """UPDATE posts.likes, adding counts[post_id] to each post in counts."""
+    return (
+        post_table.update()
+        .where(post_table.c.id.in_(list(counts)))
+        .values(likes=post_table.c.likes + sqlalchemy.case(counts, value=post_table.c.id))
+    )
+
+
+async def take_shard_rows() -> list:
+    """Delete the post_like_shards rows and return them, inside the caller's transaction."""
+    if database.url.dialect in DELETE_RETURNING_DIALECTS:
+        query = like_shard_table.delete().returning(like_shard_table.c.post_id, like_shard_table.c.count)
+        return await database.fetch_all(query)
+    query = sqlalchemy.select(
+        like_shard_table.c.post_id, like_shard_table.c.shard, like_shard_table.c.count
+    ).with_for_update()
+    rows = await database.fetch_all(query)
+    key = sqlalchemy.tuple_(like_shard_table.c.post_id, like_shard_table.c.shard)
+    for chunk in chunks(rows):
+        await database.execute(
+            like_shard_table.delete().where(key.in_([(row.post_id, row.shard) for row in chunk]))
+        )
+    return rows
+
+
+def chunks(items: list, size: int = FLUSH_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class LikeCounter:
+    """Adds up likes in memory, flushes them to post_like_shards and folds those into posts.likes.
+
+    A flush runs every flush_interval seconds, or as soon as max_unflushed
+    likes are waiting, and once more on stop(), so a crash loses at most
+    that many likes. A failed flush keeps its counts for the next one.
+    Flushed counts are safe in the shard rows; any worker's fold moves them
+    into posts.likes. on_fold is called with the ids of the posts whose
+    counts changed.
+    """
+
+    def __init__(
+            self,
+            shards: int,
+            flush_interval: float,
+            max_unflushed: int,
+            fold_interval: float,
+            on_fold: Callable[[list[int]], None] | None = None,
+            timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.shards = shards
+        self.flush_interval = flush_interval
+        self.max_unflushed = max_unflushed
+        self.fold_interval = fold_interval
+        self.on_fold = on_fold
+        self.timer = timer
+        self.folded_at = timer()
+        self.pending: Counter[int] = Counter()
+        self.unflushed = 0
+        self._flushing = asyncio.Lock()
+        self._full: asyncio.Event | None = None
+        self._flusher: asyncio.Task | None = None
+        self.flushes = 0
+        self.flushed = 0
+        self.folded = 0
+
+    def add(self, post_ids: Iterable[int]):
+        """Count one like for each of post_ids, already recorded in the likes table."""
+        for post_id in post_ids:
+            self.pending[post_id] += 1
+            self.unflushed += 1
+        if self.unflushed >= self.max_unflushed and self._full is not None:
+            self._full.set()
+
+    async def flush(self) -> int:
+        """Write every pending count. Returns how many likes were written."""
+        async with self._flushing:
+            pending, self.pending = self.pending, Counter()
+            unflushed, self.unflushed = self.unflushed, 0
+            if not pending:
+                return 0
+            shard = random.randrange(self.shards)
+            rows = [
+                {"post_id": post_id, "shard": shard, "count": count}
+                for post_id, count in pending.items()
+            ]
+            try:
+                async with database.transaction():
+                    for chunk in chunks(rows):
+                        await database.execute(add_to_shards(chunk))
+            except BaseException:
+                # Likes counted while this flush ran are already in self.pending
+                self.pending.update(pending)
+                self.unflushed += unflushed
+                raise
+            self.flushes += 1
+            self.flushed += unflushed
+        return unflushed
+
+    async def fold(self) -> int:
+        """Move every shard row, flushed by any worker, into posts.likes. Returns the likes moved."""
+        self.folded_at = self.timer()
+        counts: Counter[int] = Counter()
+        async with database.transaction():
+            # Only rows deleted here are counted, so a flush committing
+            # meanwhile is left whole for the next fold
+            for row in await take_shard_rows():
+                counts[row.post_id] += row["count"]
+            post_ids = list(counts)
+            for chunk in chunks(post_ids):
+                await database.execute(add_to_posts({post_id: counts[post_id] for post_id in chunk}))
+        folded = sum(counts.values())
+        self.folded += folded
+        if post_ids and self.on_fold is not None:
+            self.on_fold(post_ids)
+        return folded
+
+    def start(self):
+        if self._flusher is None:
+            # Bound to the loop the flusher runs on
+            self._flushing = asyncio.Lock()
+            self._full = asyncio.Event()
+            self._flusher = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stop the flusher, write what is still pending and fold it into posts.likes."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._flusher
+            self._flusher = None
+            self._full = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Lost %s likes that could not be flushed", self.unflushed)
+            return
+        try:
+            await self.fold()
+        except Exception:
+            logger.exception("Could not fold like counts; the next fold picks them up")
+
+    async def run(self):
+        while True:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Could not flush %s likes; retrying", self.unflushed)
+            if self.timer() - self.folded_at >= self.fold_interval:
+                try:
+                    await self.fold()
+                except Exception:
+                    logger.exception("Could not fold like counts; retrying")
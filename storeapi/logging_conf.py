@@ -1,5 +1,7 @@
 import logging
-from logging.config import dictConfig
+import logging.handlers
+import queue
+from logging.config import dictConfigClass
 
 from storeapi.config import DevConfig, config
 
@@ -22,13 +24,117 @@ class EmailObfuscationFilter(logging.Filter):
         return True
 
 
-handlers = ["default", "rotating_file","logtail"]
-if config.ENV_STATE == "prod":
-    handlers = ["default", "rotating_file", "logtail"]
+class DrainingQueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # The stock listener enqueues without blocking, which fails on a full
+        # queue; waiting for room lets stop() drain everything first.
+        self.queue.put(self._sentinel)
+
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to a listener thread that formats and writes them.
+
+    The queue is bounded. When it is full, records are dropped (and counted)
+    under the "drop" policy, or the logging call waits up to block_timeout
+    for space under "block". Records are queued without being formatted, so
+    message construction and every downstream handler run off the request
+    path; filters attached to this handler still run in the calling thread,
+    which is where the correlation id context lives.
+    """
+
+    def __init__(self, maxsize: int = 10_000, policy: str = "drop", block_timeout: float = 1.0) -> None:
+        super().__init__(queue.Queue(maxsize=maxsize))
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self.listener: DrainingQueueListener | None = None
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            if self.policy == "block":
+                self.queue.put(record, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self, handlers: list[logging.Handler]) -> None:
+        self.listener = DrainingQueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self) -> None:
+        """Write out everything queued, then flush the downstream handlers."""
+        if self.listener is None:
+            return
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.flush()
+        self.listener = None
+
+
+queue_handler: BackgroundQueueHandler | None = None
 
 
 def configure_logging() -> None:
-    dictConfig(
+    global queue_handler
+    stop_logging()
+
+    queued = config.LOG_QUEUE_SIZE > 0
+    log_level = config.LOG_LEVEL or ("DEBUG" if isinstance(config, DevConfig) else "INFO")
+    request_filters = ["correlation_id", "email_obfuscation"]
+    # Without the queue the output handlers run inline and need the filters themselves
+    output_filters = [] if queued else request_filters
+
+    output_handlers = ["default", "rotating_file"]
+    if config.LOGTAIL_API_KEY:
+        output_handlers.append("logtail")
+
+    handlers = {
+        "default": {
+            "class": "rich.logging.RichHandler",  # could use logging.StreamHandler instead
+            "level": log_level,
+            "formatter": "console",
+            "filters": output_filters,
+        },
+        "rotating_file": {
+            "class": "logging.handlers.RotatingFileHandler",
+            "level": log_level,
+            "formatter": "file",
+            "filters": output_filters,
+            "filename": "storeapi.log",
+            "maxBytes": 1024 * 1024,  # 1 MB
+            "backupCount": 2,
+            "encoding": "utf8",
+        },
+    }
+    if config.LOGTAIL_API_KEY:
+        handlers["logtail"] = {
+            # https://betterstack.com/docs/logs/python/
+            "class": "logtail.LogtailHandler",
+            "level": log_level,
+            "formatter": "console",
+            # Only our own records are shipped, as before queueing was added
+            "filters": [*output_filters, "storeapi_only"],
+            "source_token": config.LOGTAIL_API_KEY,  # gets passed to LogtailHandler constructor as kwargs
+            # The handler ships in batches of up to buffer_capacity every flush_interval seconds
+            "buffer_capacity": config.LOG_SHIP_BATCH_SIZE,
+            "flush_interval": config.LOG_SHIP_INTERVAL,
+        }
+    if queued:
+        handlers["queue"] = {
+            "()": BackgroundQueueHandler,
+            "maxsize": config.LOG_QUEUE_SIZE,
+            "policy": config.LOG_QUEUE_POLICY,
+            "filters": request_filters,
+        }
+
+    def logger_handlers(names: list[str]) -> list[str]:
+        return ["queue"] if queued else names
+
+    configurator = dictConfigClass(
         {
             "version": 1,
             "disable_existing_loggers": False,
@@ -42,6 +148,7 @@ def configure_logging() -> None:
                     "()": EmailObfuscationFilter,
                     "obfuscated_length": 2 if isinstance(config, DevConfig) else 0,
                 },
+                "storeapi_only": {"name": "storeapi"},
             },
             "formatters": {
                 "console": {
@@ -58,41 +165,30 @@ def configure_logging() -> None:
                               "%(correlation_id)s %(name)s %(lineno)d %(message)s",
                 },
             },
-            "handlers": {
-                "default": {
-                    "class": "rich.logging.RichHandler",  # could use logging.StreamHandler instead
-                    "level": "DEBUG",
-                    "formatter": "console",
-                    "filters": ["correlation_id", "email_obfuscation"],
-                },
-                "logtail": {
-                    # https://betterstack.com/docs/logs/python/
-                    "class": "logtail.LogtailHandler",
-                    "level": "DEBUG",
-                    "formatter": "console",
-                    "filters": ["correlation_id", "email_obfuscation"],
-                    "source_token": config.LOGTAIL_API_KEY,  # gets passed to LogtailHandler constructor as kwargs
-                },
-                "rotating_file": {
-                    "class": "logging.handlers.RotatingFileHandler",
-                    "level": "DEBUG",
-                    "formatter": "file",
-                    "filters": ["correlation_id", "email_obfuscation"],
-                    "filename": "storeapi.log",
-                    "maxBytes": 1024 * 1024,  # 1 MB
-                    "backupCount": 2,
-                    "encoding": "utf8",
-                },
-            },
+            "handlers": handlers,
             "loggers": {
-                "uvicorn": {"handlers": ["default", "rotating_file"], "level": "INFO"},
+                "uvicorn": {"handlers": logger_handlers(["default", "rotating_file"]), "level": "INFO"},
                 "storeapi": {
-                    "handlers": handlers,
-                    "level": "DEBUG" if isinstance(config, DevConfig) else "INFO",
+                    "handlers": logger_handlers(output_handlers),
+                    "level": log_level,
                     "propagate": False,
                 },
-                "databases": {"handlers": ["default"], "level": "WARNING"},
-                "aiosqlite": {"handlers": ["default"], "level": "WARNING"},
+                "databases": {"handlers": logger_handlers(["default"]), "level": "WARNING"},
+                "aiosqlite": {"handlers": logger_handlers(["default"]), "level": "WARNING"},
             },
         }
     )
+    configurator.configure()
+
+    if queued:
+        # dictConfig replaces each handler's config with the handler it built
+        queue_handler = configurator.config["handlers"]["queue"]
+        queue_handler.start([configurator.config["handlers"][name] for name in output_handlers])
+
+
+def stop_logging() -> None:
+    """Drain the logging queue and flush every handler; call on shutdown."""
+    global queue_handler
+    if queue_handler is not None:
+        queue_handler.stop()
+        queue_handler = None
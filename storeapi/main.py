@@ -5,10 +5,20 @@ from asgi_correlation_id import CorrelationIdMiddleware
 from fastapi import FastAPI, HTTPException
 from fastapi.exception_handlers import http_exception_handler
 
-from storeapi.database import database
-from storeapi.logging_conf import configure_logging
-from storeapi.routers.post import router as post_router
+from storeapi.config import config
+from storeapi.database import database, engine, replicas
+from storeapi.exporter import request_metrics, start_metrics_writer, stop_metrics_writer
+from storeapi.logging_conf import configure_logging, stop_logging
+from storeapi.metrics import MetricsMiddleware
+from storeapi.migrations import migrate
+from storeapi.replicas import ReadYourWritesMiddleware
+from storeapi.routers.internal import router as internal_router
+from storeapi.routers.post import like_counter, router as post_router
+from storeapi.routers.search import router as search_router
 from storeapi.routers.user import router as user_router
+from storeapi.search import search_index
+from storeapi.security import password_executor
+from storeapi.tasks import close_http_client, email_outbox
 
 logger = logging.getLogger(__name__)
 
@@ -16,19 +26,44 @@ logger = logging.getLogger(__name__)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     configure_logging()
+    if config.MIGRATE_ON_STARTUP:
+        migrate(engine)
     await database.connect()
+    await replicas.connect()
+    await search_index.load()
+    start_metrics_writer()
+    if config.BUFFERED_LIKES:
+        like_counter.start()
+    if config.MAILGUN_API_KEY:
+        email_outbox.start()
+    else:
+        logger.warning("MAILGUN_API_KEY is not set; emails stay queued in the outbox")
     yield
+    if config.BUFFERED_LIKES:
+        # Before the database goes away: the last buffered likes are written on stop
+        await like_counter.stop()
+    await email_outbox.stop()
+    await close_http_client()
+    await stop_metrics_writer()
+    await replicas.disconnect()
     await database.disconnect()
+    password_executor.shutdown()
+    stop_logging()
 
 
 app = FastAPI(lifespan=lifespan)
 app.add_middleware(CorrelationIdMiddleware)
+app.add_middleware(ReadYourWritesMiddleware)
+# Outermost, so its timings include the other middleware
+app.add_middleware(MetricsMiddleware, metrics=request_metrics)
 
 app.include_router(post_router)
+app.include_router(search_router)
 app.include_router(user_router)
+app.include_router(internal_router)
 
 
 @app.exception_handler(HTTPException)
 async def http_exception_handle_logging(request, exc):
-    logger.error(f"HTTPException: {exc.status_code} {exc.detail}")
+    logger.error("HTTPException: %s %s", exc.status_code, exc.detail)
     return await http_exception_handler(request, exc)
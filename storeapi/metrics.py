@@ -0,0 +1,295 @@
+"""Process-local metrics and their Prometheus text exposition.
+
+Metrics are gathered as families: plain dicts of the form
+{"name", "type", "help", "samples"} where samples maps a rendered label
+set to a number (or, for histograms, to bounds, per-bucket counts, sum and
+count). Families are JSON-serializable, so the snapshots of several worker
+processes can be written to disk and summed at scrape time.
+"""
+import bisect
+import copy
+import json
+import math
+import os
+import time
+from pathlib import Path
+from typing import Any
+
+# Upper bounds in milliseconds, shared by every latency histogram
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    """Fixed-bucket histogram.
+
+    observe() is a bisect and two additions on plain ints, so it needs no
+    lock under the GIL and is cheap enough for every request or query.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS_MS) -> None:
+        self.buckets = buckets
+        # One count per bucket plus the +Inf overflow
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, pct: float) -> float:
+        """Upper bound of the bucket holding the pct-th percentile (inf if it overflowed)."""
+        if not self.count:
+            return 0.0
+        rank = math.ceil(pct / 100 * self.count)
+        seen = 0
+        for bound, count in zip((*self.buckets, math.inf), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+    def add(self, other: "Histogram") -> None:
+        """Fold another histogram with the same buckets into this one."""
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+
+    def snapshot(self) -> dict:
+        def finite(value: float) -> float | None:
+            return None if value == math.inf else value
+
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": {
+                str(bound): count for bound, count in zip((*self.buckets, "+Inf"), self.counts)
+            },
+            "p50": finite(self.percentile(50)),
+            "p95": finite(self.percentile(95)),
+            "p99": finite(self.percentile(99)),
+        }
+
+
+
+def labels(**values: str) -> str:
+    """Render a label set, e.g. 'method="GET",route="/post"'."""
+    return ",".join(
+        '{}="{}"'.format(
+            name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        for name, value in values.items()
+    )
+
+
+def family(name: str, kind: str, help: str, samples: dict[str, Any]) -> dict:
+    return {"name": name, "type": kind, "help": help, "samples": samples}
+
+
+def histogram_family(
+        name: str, help: str, histograms: dict[str, Histogram], scale: float = 0.001
+) -> dict:
+    """A histogram family from millisecond Histograms, reported in seconds by default."""
+    return family(name, "histogram", help, {
+        label_set: {
+            "bounds": [bound * scale for bound in histogram.buckets],
+            "counts": list(histogram.counts),
+            "sum": histogram.sum * scale,
+            "count": histogram.count,
+        }
+        for label_set, histogram in histograms.items()
+    })
+
+
+def merge_families(snapshots: list[list[dict]]) -> list[dict]:
+    """Sum the samples of same-named families across snapshots."""
+    merged: dict[str, dict] = {}
+    for families in snapshots:
+        for source in families:
+            target = merged.get(source["name"])
+            if target is None:
+                merged[source["name"]] = copy.deepcopy(source)
+                continue
+            for label_set, value in source["samples"].items():
+                current = target["samples"].get(label_set)
+                if current is None:
+                    target["samples"][label_set] = copy.deepcopy(value)
+                elif source["type"] == "histogram":
+                    current["counts"] = [a + b for a, b in zip(current["counts"], value["counts"])]
+                    current["sum"] += value["sum"]
+                    current["count"] += value["count"]
+                else:
+                    target["samples"][label_set] = current + value
+    return list(merged.values())
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render(families: list[dict]) -> str:
+    """Prometheus text exposition format, version 0.0.4."""
+    lines = []
+    for source in families:
+        name = source["name"]
+        lines.append(f"# HELP {name} {source['help']}")
+        lines.append(f"# TYPE {name} {source['type']}")
+        for label_set, value in sorted(source["samples"].items()):
+            braces = "{" + label_set + "}" if label_set else ""
+            if source["type"] != "histogram":
+                lines.append(f"{name}{braces} {format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip((*value["bounds"], math.inf), value["counts"]):
+                cumulative += count
+                le = f'le="{format_value(bound)}"'
+                lines.append(f"{name}_bucket{{{label_set + ',' if label_set else ''}{le}}} {cumulative}")
+            lines.append(f"{name}_sum{braces} {format_value(value['sum'])}")
+            lines.append(f"{name}_count{braces} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+
+class MultiProcessStore:
+    """Per-process metric snapshots in a directory shared by all workers of a server.
+
+    Each process writes its own <pid>.json; collect() sums every file. A
+    file not rewritten within stale_after seconds belongs to a worker that
+    exited or hung: its counters still count, its gauges no longer do. The
+    directory should be emptied when the server starts.
+    """
+
+    def __init__(self, directory: str, stale_after: float) -> None:
+        self.directory = Path(directory)
+        self.stale_after = stale_after
+
+    @property
+    def path(self) -> Path:
+        # Looked up on every write, so forked workers do not share the parent's file
+        return self.directory / f"{os.getpid()}.json"
+
+    def write(self, families: list[dict]) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path
+        temporary = path.with_suffix(".tmp")
+        temporary.write_text(json.dumps(families))
+        os.replace(temporary, path)
+
+    def collect(self, families: list[dict]) -> list[dict]:
+        """Write this process's families, then merge those of every process."""
+        self.write(families)
+        own_path = self.path
+        now = time.time()
+        snapshots = []
+        for path in sorted(self.directory.glob("*.json")):
+            try:
+                modified = path.stat().st_mtime
+                snapshot = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            if path != own_path and now - modified > self.stale_after:
+                snapshot = [source for source in snapshot if source["type"] != "gauge"]
+            snapshots.append(snapshot)
+        return merge_families(snapshots)
+
+
+# Requests that matched no route share one series instead of one per path
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class RequestMetrics:
+    """Request counts, latencies and in-flight requests of this process, by route.
+
+    Only the event loop writes to these plain ints and dicts, so they need
+    no locks.
+    """
+
+    def __init__(self) -> None:
+        self.in_flight = 0
+        self.responses: dict[tuple[str, str, int], int] = {}
+        self.latency: dict[tuple[str, str], Histogram] = {}
+
+    def observe(self, method: str, route: str, status_code: int, duration_ms: float) -> None:
+        key = (method, route, status_code)
+        self.responses[key] = self.responses.get(key, 0) + 1
+        histogram = self.latency.get((method, route))
+        if histogram is None:
+            histogram = self.latency[(method, route)] = Histogram()
+        histogram.observe(duration_ms)
+
+    def families(self) -> list[dict]:
+        responses: dict[str, int] = {}
+        errors: dict[str, int] = {}
+        for (method, route, status_code), count in self.responses.items():
+            responses[labels(method=method, route=route, status=str(status_code))] = count
+            if status_code >= 500:
+                label_set = labels(method=method, route=route)
+                errors[label_set] = errors.get(label_set, 0) + count
+        return [
+            family(
+                "storeapi_http_requests_total", "counter",
+                "HTTP responses by route template and status code.", responses,
+            ),
+            family(
+                "storeapi_http_request_errors_total", "counter",
+                "HTTP 5xx responses, unhandled exceptions included.", errors,
+            ),
+            histogram_family(
+                "storeapi_http_request_duration_seconds",
+                "Time until the response body was fully sent.",
+                {
+                    labels(method=method, route=route): histogram
+                    for (method, route), histogram in self.latency.items()
+                },
+            ),
+            family(
+                "storeapi_http_requests_in_flight", "gauge",
+                "Requests currently being handled.", {"": self.in_flight},
+            ),
+        ]
+
+    def reset(self) -> None:
+        self.responses.clear()
+        self.latency.clear()
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware feeding RequestMetrics.
+
+    Requests are labelled with the matched route's path template, so
+    /post/{post_id} is a single series however many posts are read.
+    """
+
+    def __init__(self, app, metrics: RequestMetrics) -> None:
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Stays 500 if the app raises before starting a response
+        status_code = 500
+
+        async def send_with_status(message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        metrics = self.metrics
+        metrics.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.in_flight -= 1
+            route = getattr(scope.get("route"), "path", UNMATCHED_ROUTE)
+            metrics.observe(
+                scope["method"], route, status_code, (time.perf_counter() - started) * 1000
+            )
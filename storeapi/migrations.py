@@ -0,0 +1,243 @@
+"""Versioned schema migrations.
+
+The applied version is stored in the single-row schema_version table. A new
+database is created straight from metadata and stamped with the latest
+version; an existing one is brought forward one migration at a time, each in
+its own transaction, so an interrupted run can simply be restarted.
+Migrations must be idempotent: databases created before versioning was
+introduced start from version 0 whatever shape they are actually in.
+
+Every server process migrates on startup unless MIGRATE_ON_STARTUP is off,
+so migrate() holds a lock that processes sharing the database wait on: an
+advisory lock on PostgreSQL and MySQL, a lock file next to a SQLite
+database. The first process applies the migrations; the others find the
+schema up to date once they get the lock.
+"""
+import contextlib
+import logging
+import os
+from typing import Callable, Iterator
+
+import sqlalchemy
+from sqlalchemy.engine import Connection, Engine
+
+from storeapi.database import (
+    email_outbox_table,
+    like_shard_table,
+    like_table,
+    metadata,
+    post_table,
+)
+from storeapi.search import create_search_table, fill_search_table, search_backend, search_table
+
+logger = logging.getLogger(__name__)
+
+version_metadata = sqlalchemy.MetaData()
+
+schema_version_table = sqlalchemy.Table(
+    "schema_version",
+    version_metadata,
+    sqlalchemy.Column("version", sqlalchemy.Integer, nullable=False),
+)
+
+
+def column_names(connection: Connection, table: str) -> set[str]:
+    return {column["name"] for column in sqlalchemy.inspect(connection).get_columns(table)}
+
+
+def reconcile_likes_queries() -> list:
+    """UPDATEs setting posts.likes to the number of rows in likes, for the posts where they differ.
+
+    likes is read once per statement, whatever indexes it has yet: the
+    counts come from one GROUP BY joined in, and posts without likes are
+    found with an uncorrelated NOT IN.
+    """
+    counts = (
+        sqlalchemy.select(like_table.c.post_id, sqlalchemy.func.count().label("likes"))
+        .group_by(like_table.c.post_id)
+        .subquery()
+    )
+    liked = (
+        post_table.update()
+        .where(post_table.c.id == counts.c.post_id, post_table.c.likes != counts.c.likes)
+        .values(likes=counts.c.likes)
+    )
+    unliked = (
+        post_table.update()
+        .where(post_table.c.likes != 0, post_table.c.id.not_in(sqlalchemy.select(like_table.c.post_id)))
+        .values(likes=0)
+    )
+    return [liked, unliked]
+
+
+def reconcile_likes(connection: Connection):
+    for query in reconcile_likes_queries():
+        connection.execute(query)
+
+
+def add_post_likes_counter(connection: Connection):
+    if "likes" not in column_names(connection, "posts"):
+        connection.execute(
+            sqlalchemy.text("ALTER TABLE posts ADD COLUMN likes INTEGER NOT NULL DEFAULT 0")
+        )
+    reconcile_likes(connection)
+
+
+def add_secondary_indexes(connection: Connection):
+    # The unique index cannot be built while duplicates exist; keep the first
+    # like per (post_id, user_id) and fix up the counters afterwards.
+    first_likes = (
+        sqlalchemy.select(sqlalchemy.func.min(like_table.c.id))
+        .group_by(like_table.c.post_id, like_table.c.user_id)
+        .scalar_subquery()
+    )
+    duplicates = connection.execute(like_table.delete().where(like_table.c.id.not_in(first_likes)))
+    if duplicates.rowcount:
+        logger.info("Removed %s duplicate likes", duplicates.rowcount)
+        reconcile_likes(connection)
+
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def add_email_outbox(connection: Connection):
+    email_outbox_table.create(connection, checkfirst=True)
+
+
+def add_email_variables(connection: Connection):
+    if "variables" not in column_names(connection, "email_outbox"):
+        connection.execute(sqlalchemy.text("ALTER TABLE email_outbox ADD COLUMN variables TEXT"))
+
+
+def add_search_index(connection: Connection):
+    if search_backend(connection.dialect.name) != "fts5":
+        return
+    create_search_table(connection)
+    connection.execute(search_table.delete())
+    connection.execute(fill_search_table())
+
+
+def add_like_shards(connection: Connection):
+    like_shard_table.create(connection, checkfirst=True)
+
+
+# (version, description, upgrade); append only, never renumber.
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "add posts.likes counter", add_post_likes_counter),
+    (2, "add secondary indexes and unique likes", add_secondary_indexes),
+    (3, "add email outbox", add_email_outbox),
+    (4, "add email_outbox.variables", add_email_variables),
+    (5, "add full-text search index", add_search_index),
+    (6, "add sharded like counters", add_like_shards),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(connection: Connection) -> int | None:
+    return connection.execute(sqlalchemy.select(schema_version_table.c.version)).scalar()
+
+
+def set_version(connection: Connection, version: int):
+    connection.execute(schema_version_table.delete())
+    connection.execute(schema_version_table.insert().values(version=version))
+
+
+# Arbitrary, but fixed: the key every process takes the advisory lock on
+MIGRATION_LOCK_KEY = 731_845_002
+MIGRATION_LOCK_NAME = "storeapi_migrate"
+
+
+@contextlib.contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """Hold an exclusive lock on the file at path, waiting as long as it takes."""
+    # Appending, so opening never truncates a file another process holds
+    with open(path, "ab") as lock_file:
+        if os.name == "nt":
+            import msvcrt
+
+            lock_file.seek(0)
+            while True:
+                try:
+                    # Gives up with OSError after retrying for about 10 seconds
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def migration_lock(engine: Engine) -> Iterator[None]:
+    """Hold the lock that keeps processes from migrating the same database at once."""
+    dialect = engine.dialect.name
+    if dialect == "sqlite":
+        database = engine.url.database
+        if not database or database == ":memory:":
+            # Private to this process
+            yield
+            return
+        with file_lock(f"{database}.migrate.lock"):
+            yield
+        return
+
+    if dialect == "postgresql":
+        lock = sqlalchemy.text("SELECT pg_advisory_lock(:key)").bindparams(key=MIGRATION_LOCK_KEY)
+        unlock = sqlalchemy.text("SELECT pg_advisory_unlock(:key)").bindparams(key=MIGRATION_LOCK_KEY)
+    elif dialect == "mysql":
+        lock = sqlalchemy.text("SELECT GET_LOCK(:name, -1)").bindparams(name=MIGRATION_LOCK_NAME)
+        unlock = sqlalchemy.text("SELECT RELEASE_LOCK(:name)").bindparams(name=MIGRATION_LOCK_NAME)
+    else:
+        raise ValueError(f"No migration lock for {dialect}")
+    # Session-level locks, held on a connection of their own while migrations run on others
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(lock)
+        try:
+            yield
+        finally:
+            connection.execute(unlock)
+
+
+def migrate(engine: Engine) -> int:
+    """Bring the database schema up to LATEST_VERSION and return it."""
+    with migration_lock(engine):
+        return apply_migrations(engine)
+
+
+def apply_migrations(engine: Engine) -> int:
+    with engine.begin() as connection:
+        version_metadata.create_all(connection)
+        version = current_version(connection)
+        if version is None:
+            is_new = not sqlalchemy.inspect(connection).has_table(post_table.name)
+            # Creates only the tables that are missing; existing ones are left to MIGRATIONS
+            metadata.create_all(connection)
+            if is_new:
+                set_version(connection, LATEST_VERSION)
+                logger.info("Created schema at version %s", LATEST_VERSION)
+                return LATEST_VERSION
+            version = 0
+
+    for number, description, upgrade in MIGRATIONS:
+        if number <= version:
+            continue
+        logger.info("Applying migration %s: %s", number, description)
+        with engine.begin() as connection:
+            upgrade(connection)
+            set_version(connection, number)
+        version = number
+
+    return version
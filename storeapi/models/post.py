@@ -1,5 +1,9 @@
+from typing import Generic, TypeVar
+
 from pydantic import BaseModel
 
+T = TypeVar("T")
+
 
 class UserPostIn(BaseModel):
     body: str
@@ -45,3 +49,10 @@ class PostLikeIn(BaseModel):
 class PostLike(PostLikeIn):
     id: int
     user_id: int
+
+
+class BatchItemResult(BaseModel, Generic[T]):
+    """Outcome of one item of a batch request, in request order."""
+    status_code: int
+    detail: str | None = None
+    item: T | None = None
@@ -0,0 +1,15 @@
+from typing import Literal
+
+from pydantic import BaseModel
+
+
+class SearchHit(BaseModel):
+    kind: Literal["post", "comment"]
+    id: int
+    post_id: int
+    body: str
+    # BM25; higher is more relevant
+    score: float
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,30 @@
+import base64
+import binascii
+import json
+
+# Keys are compared against BIGINT columns, which hold signed 64-bit integers
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+
+def encode_cursor(data: dict) -> str:
+    """Encode a keyset position into an opaque, url-safe cursor."""
+    raw = json.dumps(data, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    """Decode a cursor produced by encode_cursor, raising ValueError if it is malformed."""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError("Malformed cursor") from e
+    if not isinstance(data, dict):
+        raise ValueError("Malformed cursor")
+    return data
+
+
+def is_int64(value) -> bool:
+    """Whether a decoded cursor value is an integer a BIGINT column can hold; bools are not."""
+    return type(value) is int and INT64_MIN <= value <= INT64_MAX
@@ -0,0 +1,125 @@
+import itertools
+import math
+import time
+from contextvars import ContextVar
+from typing import Callable, Literal
+
+from starlette.requests import HTTPConnection
+
+from storeapi.instrumentation import InstrumentedDatabase
+
+# Carries the time until which a client reads from the primary
+STICKY_COOKIE = "read_primary_until"
+
+
+class ReadState:
+    """What one request knows about its client's recent writes."""
+
+    __slots__ = ("cookie", "set_cookie")
+
+    def __init__(self, cookie: str | None = None) -> None:
+        self.cookie = cookie
+        # The Set-Cookie value pinning the client, once the request has written
+        self.set_cookie: str | None = None
+
+
+read_state: ContextVar[ReadState | None] = ContextVar("read_state", default=None)
+
+
+class ReplicaSet:
+    """Picks the database a read should go to.
+
+    Reads are spread over the replicas, round-robin or to the one with the
+    fewest statements in flight. A request that writes calls mark_written(),
+    which sends its client the STICKY_COOKIE; the rest of that request and
+    the client's requests for the next sticky_seconds read from the primary,
+    whichever worker serves them, so a client sees its own writes while the
+    replicas catch up. Other clients keep reading from the replicas. Clients
+    that drop cookies get no such guarantee. Without replicas every read
+    goes to the primary.
+    """
+
+    def __init__(
+            self,
+            primary: InstrumentedDatabase,
+            replicas: list[InstrumentedDatabase],
+            policy: Literal["round_robin", "least_loaded"] = "round_robin",
+            sticky_seconds: float = 5.0,
+            timer: Callable[[], float] = time.time,
+    ) -> None:
+        self.primary = primary
+        self.replicas = replicas
+        self.policy = policy
+        self.sticky_seconds = sticky_seconds
+        self.timer = timer
+        self._next_replica = itertools.cycle(range(len(replicas))) if replicas else None
+
+    def reader(self) -> InstrumentedDatabase:
+        if not self.replicas or self.pinned_to_primary():
+            return self.primary
+        if self.policy == "least_loaded":
+            return min(self.replicas, key=lambda replica: replica.in_flight)
+        return self.replicas[next(self._next_replica)]
+
+    def pinned_to_primary(self) -> bool:
+        state = read_state.get()
+        if state is None:
+            return False
+        if state.set_cookie is not None:
+            return True
+        try:
+            until = float(state.cookie)
+        except (TypeError, ValueError):
+            return False
+        now = self.timer()
+        # A cookie set further ahead than any write would set it is ignored
+        return now < until <= now + self.sticky_seconds
+
+    def mark_written(self) -> None:
+        """Pin the current request's client to the primary for sticky_seconds."""
+        state = read_state.get()
+        if not self.replicas or state is None:
+            return
+        until = self.timer() + self.sticky_seconds
+        state.set_cookie = (
+            f"{STICKY_COOKIE}={until:.3f}; Max-Age={math.ceil(self.sticky_seconds)}; "
+            "Path=/; HttpOnly; SameSite=Lax"
+        )
+
+    async def connect(self) -> None:
+        for replica in self.replicas:
+            await replica.connect()
+
+    async def disconnect(self) -> None:
+        for replica in self.replicas:
+            await replica.disconnect()
+
+
+class ReadYourWritesMiddleware:
+    """Pure ASGI middleware giving each request its ReadState.
+
+    The client's STICKY_COOKIE comes in with the request, and a new one goes
+    out with the response if the request marked a write.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        state = ReadState(HTTPConnection(scope).cookies.get(STICKY_COOKIE))
+
+        async def send_with_cookie(message) -> None:
+            if message["type"] == "http.response.start" and state.set_cookie is not None:
+                cookie = (b"set-cookie", state.set_cookie.encode("latin-1"))
+                message["headers"] = [*message.get("headers", []), cookie]
+            await send(message)
+
+        token = read_state.set(state)
+        try:
+            await self.app(scope, receive, send_with_cookie)
+        finally:
+            read_state.reset(token)
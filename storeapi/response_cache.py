@@ -0,0 +1,140 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Iterable
+
+from fastapi import Request, Response, status
+
+from storeapi.cache import CacheBackend
+
+
+class CachedResponse:
+    __slots__ = ("body", "etag", "headers")
+
+    def __init__(self, body: bytes, headers: dict[str, str] | None = None) -> None:
+        self.body = body
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self.headers = {**(headers or {}), "ETag": self.etag}
+
+    def matches(self, request: Request) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is None:
+            return False
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in candidates or self.etag in candidates
+
+    def to_response(self, request: Request) -> Response:
+        """The cached JSON body, or an empty 304 if the client already has it."""
+        if self.matches(request):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=self.headers)
+        return Response(content=self.body, media_type="application/json", headers=self.headers)
+
+
+class ResponseCache:
+    """Serialized responses keyed by endpoint and parameters, invalidated by tag.
+
+    Each entry is stored with the tags of the data it was built from, and a
+    write invalidates exactly the tags it touches. An entry whose build began
+    before one of its own tags was invalidated is not stored, so a read
+    racing a write cannot put stale data back, while writes to other data do
+    not hold it up.
+
+    The generation goes up with every invalidation, and the generation and
+    time each tag was last invalidated at are kept for the
+    max_invalidated_tags most recent ones. A build older than the oldest of
+    those is not stored, and neither is one asking for a min_tag_age that
+    the oldest forgotten invalidation is too recent for.
+    """
+
+    def __init__(
+            self,
+            backend: CacheBackend,
+            max_invalidated_tags: int = 10_000,
+            timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.backend = backend
+        self.max_invalidated_tags = max_invalidated_tags
+        self.timer = timer
+        self.generation = 0
+        # Tag memberships held in _keys_by_tag, counted as they change
+        self.tagged_keys = 0
+        self._keys_by_tag: dict[str, set[Hashable]] = {}
+        self._tags_by_key: dict[Hashable, tuple[str, ...]] = {}
+        # Tag -> (generation, time) of its last invalidation
+        self._invalidated: OrderedDict[str, tuple[int, float]] = OrderedDict()
+        self._forgotten_generation = 0
+        self._forgotten_at = float("-inf")
+        backend.on_evict = self._forget
+
+    def get(self, key: Hashable) -> CachedResponse | None:
+        return self.backend.get(key)
+
+    def invalidated_since(self, generation: int, tags: Iterable[str]) -> bool:
+        if generation < self._forgotten_generation:
+            return True
+        return any(self._invalidated.get(tag, (0,))[0] > generation for tag in tags)
+
+    def invalidated_within(self, seconds: float, tags: Iterable[str]) -> bool:
+        since = self.timer() - seconds
+        if self._forgotten_at > since:
+            return True
+        return any(self._invalidated.get(tag, (0, since))[1] > since for tag in tags)
+
+    def set(
+            self,
+            key: Hashable,
+            body: bytes,
+            tags: Iterable[str],
+            headers: dict[str, str] | None = None,
+            generation: int | None = None,
+            min_tag_age: float = 0.0,
+    ) -> CachedResponse:
+        """Build a CachedResponse and store it unless its tags were invalidated too recently.
+
+        That is, since generation, or less than min_tag_age seconds ago.
+        """
+        entry = CachedResponse(body, headers)
+        tags = tuple(dict.fromkeys(tags))
+        if generation is not None and self.invalidated_since(generation, tags):
+            return entry
+        if min_tag_age and self.invalidated_within(min_tag_age, tags):
+            return entry
+
+        self._forget(key)
+        self._tags_by_key[key] = tags
+        for tag in tags:
+            self._keys_by_tag.setdefault(tag, set()).add(key)
+        self.tagged_keys += len(tags)
+        self.backend.set(key, entry)
+        return entry
+
+    def invalidate(self, *tags: str) -> None:
+        self.generation += 1
+        for tag in tags:
+            self._invalidated[tag] = (self.generation, self.timer())
+            self._invalidated.move_to_end(tag)
+            for key in list(self._keys_by_tag.get(tag, ())):
+                self._forget(key)
+                self.backend.delete(key)
+        while len(self._invalidated) > self.max_invalidated_tags:
+            _, (generation, invalidated_at) = self._invalidated.popitem(last=False)
+            self._forgotten_generation = generation
+            self._forgotten_at = invalidated_at
+
+    def clear(self) -> None:
+        # Invalidation times stay: clearing is not a write, replicas lag just the same
+        self.generation += 1
+        self._forgotten_generation = self.generation
+        self._keys_by_tag.clear()
+        self._tags_by_key.clear()
+        self.tagged_keys = 0
+        self.backend.clear()
+
+    def _forget(self, key: Hashable) -> None:
+        """Drop key from the tags it was stored with."""
+        for tag in self._tags_by_key.pop(key, ()):
+            keys = self._keys_by_tag[tag]
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_tag[tag]
+            self.tagged_keys -= 1
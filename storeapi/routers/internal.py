@@ -0,0 +1,43 @@
+import secrets
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import PlainTextResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from storeapi.config import config
+from storeapi.database import database
+from storeapi.exporter import exposition
+
+internal_bearer = HTTPBearer(auto_error=False)
+
+
+def require_internal_access(
+        credentials: Annotated[HTTPAuthorizationCredentials | None, Depends(internal_bearer)],
+):
+    if not config.INTERNAL_ROUTES_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    token = config.INTERNAL_ROUTES_TOKEN
+    if token and (
+            credentials is None
+            or not secrets.compare_digest(credentials.credentials.encode(), token.encode())
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+# Operational endpoints; left out of the public OpenAPI schema
+router = APIRouter(include_in_schema=False, dependencies=[Depends(require_internal_access)])
+
+
+@router.get("/metrics")
+async def metrics():
+    return PlainTextResponse(exposition(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@router.get("/internal/metrics/queries")
+async def query_metrics():
+    return database.query_metrics()
@@ -1,12 +1,22 @@
+import functools
 import logging
+from collections import defaultdict
 from enum import Enum
-from typing import Annotated
+from typing import Annotated, AsyncIterator
 
 import sqlalchemy
-from fastapi import APIRouter, HTTPException, Depends
-from storeapi.database import comment_table, post_table, like_table, database
+from fastapi import APIRouter, Body, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, TypeAdapter
+
+from storeapi.cache import LRUCache
+from storeapi.config import config
+from storeapi.database import comment_table, post_table, like_table, database, replicas
+from storeapi.instrumentation import InstrumentedDatabase
+from storeapi.likes import LikeCounter
 
 from storeapi.models.post import (
+    BatchItemResult,
     Comment,
     CommentIn,
     UserPost,
@@ -16,17 +26,75 @@ from storeapi.models.post import (
     PostLikeIn, UserPostWithLikes,
 )
 from storeapi.models.user import User
+from storeapi.pagination import decode_cursor, encode_cursor, is_int64
+from storeapi.response_cache import CachedResponse, ResponseCache
+from storeapi.rows import Columns, fetch_columns, model_columns
+from storeapi.search import comment_document, post_document, search_index
+from storeapi.serialization import dumps, join_lists, ndjson_lines
 from storeapi.security import get_current_user
 
 router = APIRouter()
 
 logger = logging.getLogger(__name__)
 
-select_post_likes_count_query = (
-    sqlalchemy
-    .select(post_table, sqlalchemy.func.count(like_table.c.id).label("likes"))
-    .select_from(post_table.outerjoin(like_table))
-    .group_by(post_table.c.id)
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MAX_BATCH_SIZE = 1000
+# Comments embedded per post by GET /post?include=comments
+DEFAULT_COMMENT_LIMIT = 3
+MAX_COMMENT_LIMIT = 50
+
+response_cache = ResponseCache(
+    LRUCache(maxsize=config.RESPONSE_CACHE_SIZE, ttl=config.RESPONSE_CACHE_TTL)
+)
+
+# Response cache tags. Listing pages are tagged with every post they show,
+# except most_likes pages, which any like can reorder.
+POST_LIST_TAG = "post-list"
+MOST_LIKED_LIST_TAG = "post-list:most_likes"
+
+
+def listed_post_tag(post_id: int) -> str:
+    return f"post-list:{post_id}"
+
+
+def post_tag(post_id: int) -> str:
+    return f"post:{post_id}"
+
+
+def invalidate(*tags: str):
+    """Drop the cached responses behind tags and pin the writing client's reads to the primary."""
+    response_cache.invalidate(*tags)
+    replicas.mark_written()
+
+
+def cached_response(cache_key: tuple) -> CachedResponse | None:
+    """The cached response, unless the client has just written and must read the primary."""
+    if replicas.pinned_to_primary():
+        return None
+    return response_cache.get(cache_key)
+
+
+def min_tag_age(db: InstrumentedDatabase) -> float:
+    """A replica may not show writes yet; what it served is only cached once its tags have settled."""
+    return 0.0 if db is replicas.primary else config.READ_YOUR_WRITES_SECONDS
+
+
+def invalidate_likes(post_ids):
+    invalidate(
+        MOST_LIKED_LIST_TAG,
+        *(post_tag(post_id) for post_id in post_ids),
+        *(listed_post_tag(post_id) for post_id in post_ids),
+    )
+
+
+# Folded likes change the counts shown, so they invalidate like a like does
+like_counter = LikeCounter(
+    shards=config.BUFFERED_LIKES_SHARDS,
+    flush_interval=config.BUFFERED_LIKES_FLUSH_INTERVAL,
+    max_unflushed=config.BUFFERED_LIKES_MAX_UNFLUSHED,
+    fold_interval=config.BUFFERED_LIKES_FOLD_INTERVAL,
+    on_fold=invalidate_likes,
 )
 
 
@@ -38,12 +106,6 @@ async def root():
     return info
 
 
-async def find_post(post_id: int):
-    query = post_table.select().where(post_table.c.id == post_id)
-    logger.debug(query)
-    return await database.fetch_one(query)
-
-
 @router.post("/post", response_model=UserPost, status_code=201)
 async def create_post(
         post: UserPostIn,
@@ -51,8 +113,9 @@ async def create_post(
 ):
     data = {**post.model_dump(), "user_id": current_user.id}
     query = post_table.insert().values(data)
-    logger.debug(query)
     last_record_id = await database.execute(query)
+    await search_index.add([post_document(last_record_id, post.body)])
+    invalidate(POST_LIST_TAG)
     new_post = {**data, "id": last_record_id}
     return new_post
 
@@ -63,58 +126,292 @@ class PostSorting(str, Enum):
     most_likes = "most_likes"
 
 
-@router.get("/post", response_model=list[UserPostWithLikes])
-async def get_all_posts(sorting: PostSorting = PostSorting.new):
-    query = select_post_likes_count_query
+def decode_post_cursor(cursor: str, sorting: PostSorting) -> dict:
+    try:
+        key = decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from e
+
+    fields = ("likes", "id") if sorting == PostSorting.most_likes else ("id",)
+    if key.get("sort") != sorting.value or not all(
+            is_int64(key.get(field)) for field in fields
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return key
+
+
+def encode_post_cursor(post: dict, sorting: PostSorting) -> str:
+    key = {"sort": sorting.value, "id": post["id"]}
+    if sorting == PostSorting.most_likes:
+        key["likes"] = post["likes"]
+    return encode_cursor(key)
+
+
+class ResponseFormat(str, Enum):
+    json = "json"
+    ndjson = "ndjson"
+
+
+class PostInclude(str, Enum):
+    comments = "comments"
+
+
+@functools.cache
+def list_adapter(model: type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(list[model])
+
+
+async def model_lines(
+        db: InstrumentedDatabase, query, model: type[BaseModel]
+) -> AsyncIterator[str | bytes]:
+    fields = tuple(model.model_fields)
+    if config.FAST_JSON_RESPONSES:
+        async for line in ndjson_lines(fields, db.iterate_values(query)):
+            yield line
+        return
+    async for values in db.iterate_values(query):
+        yield model.model_validate(dict(zip(fields, values))).model_dump_json() + "\n"
+
+
+def ndjson_response(db: InstrumentedDatabase, query, model: type[BaseModel]) -> StreamingResponse:
+    """Stream the rows of query as newline-delimited JSON, one row in memory at a time.
+
+    query selects the fields of model, in field order.
+    """
+    return StreamingResponse(model_lines(db, query, model), media_type="application/x-ndjson")
+
+
+def dump_row(row: dict, model: type[BaseModel]) -> bytes:
+    if config.FAST_JSON_RESPONSES:
+        return dumps(row)
+    return model.model_validate(row).model_dump_json().encode()
+
+
+def dump_rows(rows: Columns, model: type[BaseModel]) -> bytes:
+    """rows as a JSON list of model, holding one chunk of them as dicts or models at a time."""
+    if config.FAST_JSON_RESPONSES:
+        return join_lists(dumps(chunk) for chunk in rows.chunks())
+    adapter = list_adapter(model)
+    return join_lists(adapter.dump_json(adapter.validate_python(chunk)) for chunk in rows.chunks())
+
+
+def dump_posts(posts: Columns) -> bytes:
+    return dump_rows(posts, UserPostWithLikes)
+
+
+def dump_post_with_comments(post: dict, comments: Columns) -> bytes:
+    """The UserPostWithComments JSON, without building a model for every comment at once."""
+    return b"".join([
+        b'{"post":', dump_row(post, UserPostWithLikes),
+        b',"comments":', dump_rows(comments, Comment), b"}",
+    ])
+
+
+def dump_posts_with_comments(posts: Columns, comments: Columns) -> bytes:
+    """A list of UserPostWithComments, each post with its comments among comments."""
+    by_post = defaultdict(list)
+    for chunk in comments.chunks():
+        for comment in chunk:
+            by_post[comment["post_id"]].append(comment)
+    items = [
+        {"post": post, "comments": by_post[post["id"]]}
+        for chunk in posts.chunks() for post in chunk
+    ]
+    if config.FAST_JSON_RESPONSES:
+        return dumps(items)
+    adapter = list_adapter(UserPostWithComments)
+    return adapter.dump_json(adapter.validate_python(items))
+
+
+def select_post_fields():
+    """Selects the fields of UserPostWithLikes from posts, in order."""
+    return sqlalchemy.select(*model_columns(post_table, UserPostWithLikes))
+
+
+def select_posts(sorting: PostSorting, key: dict | None):
+    query = select_post_fields()
 
     if sorting == PostSorting.new:
+        if key:
+            query = query.where(post_table.c.id < key["id"])
         query = query.order_by(post_table.c.id.desc())
     if sorting == PostSorting.old:
+        if key:
+            query = query.where(post_table.c.id > key["id"])
         query = query.order_by(post_table.c.id.asc())
     if sorting == PostSorting.most_likes:
-        query = query.order_by(sqlalchemy.desc("likes"))
+        if key:
+            query = query.where(
+                sqlalchemy.tuple_(post_table.c.likes, post_table.c.id)
+                < sqlalchemy.tuple_(key["likes"], key["id"])
+            )
+        query = query.order_by(post_table.c.likes.desc(), post_table.c.id.desc())
+    return query
+
+
+def select_embedded_comments(post_ids: list[int], comment_limit: int):
+    """The first comment_limit comments of each post, in one query for the whole page."""
+    position = sqlalchemy.func.row_number().over(
+        partition_by=comment_table.c.post_id, order_by=comment_table.c.id
+    )
+    ranked = (
+        sqlalchemy.select(*model_columns(comment_table, Comment), position.label("position"))
+        .where(comment_table.c.post_id.in_(post_ids))
+        .subquery()
+    )
+    return (
+        sqlalchemy.select(*(ranked.c[field] for field in Comment.model_fields))
+        .where(ranked.c.position <= comment_limit)
+        .order_by(ranked.c.post_id, ranked.c.id)
+    )
+
+
+@router.get("/post", response_model=list[UserPostWithLikes] | list[UserPostWithComments])
+async def get_all_posts(
+        request: Request,
+        sorting: PostSorting = PostSorting.new,
+        limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+        cursor: str | None = None,
+        format: ResponseFormat = ResponseFormat.json,
+        include: PostInclude | None = None,
+        comment_limit: Annotated[int, Query(ge=1, le=MAX_COMMENT_LIMIT)] = DEFAULT_COMMENT_LIMIT,
+):
+    """Return one page of posts, keyset-paginated on the sort key.
+
+    The cursor for the next page, if any, is sent in the X-Next-Cursor header.
+    With format=ndjson every post from the cursor onwards is streamed instead,
+    ignoring limit. With include=comments each post comes with its oldest
+    comment_limit comments, shaped like GET /post/{id}, fetched for the whole
+    page in one query.
+    """
+    if include == PostInclude.comments and format == ResponseFormat.ndjson:
+        raise HTTPException(status_code=400, detail="include=comments is not supported with ndjson")
+    key = decode_post_cursor(cursor, sorting) if cursor else None
+    query = select_posts(sorting, key)
+    db = replicas.reader()
+    if format == ResponseFormat.ndjson:
+        return ndjson_response(db, query, UserPostWithLikes)
 
-    logger.debug(query)
-    return await database.fetch_all(query)
+    cache_key = (
+        POST_LIST_TAG, sorting.value, limit, cursor, include, comment_limit if include else None
+    )
+    cached = cached_response(cache_key)
+    if cached is None:
+        generation = response_cache.generation
+        # Fetch one extra row to learn whether another page follows.
+        query = query.limit(limit + 1)
+        posts = await fetch_columns(db, query, UserPostWithLikes)
+        headers = {}
+        if len(posts) > limit:
+            posts.truncate(limit)
+            headers["X-Next-Cursor"] = encode_post_cursor(posts.row(limit - 1), sorting)
+
+        if sorting == PostSorting.most_likes:
+            tags = [POST_LIST_TAG, MOST_LIKED_LIST_TAG]
+        else:
+            tags = [POST_LIST_TAG, *(listed_post_tag(post_id) for post_id in posts.column("id"))]
+        if include == PostInclude.comments:
+            post_ids = list(posts.column("id"))
+            comments = Columns.for_model(Comment)
+            if post_ids:
+                query = select_embedded_comments(post_ids, comment_limit)
+                comments = await fetch_columns(db, query, Comment)
+            tags.extend(post_tag(post_id) for post_id in post_ids)
+            body = dump_posts_with_comments(posts, comments)
+        else:
+            body = dump_posts(posts)
+        cached = response_cache.set(
+            cache_key, body, tags, headers, generation, min_tag_age=min_tag_age(db)
+        )
+    return cached.to_response(request)
 
 
-# ---
 @router.post("/comment", response_model=Comment, status_code=201)
 async def create_comment(
         comment: CommentIn,
         current_user: Annotated[User, Depends(get_current_user)]
 ):
-    post = await find_post(comment.post_id)
-    if not post:
-        raise HTTPException(status_code=404, detail="post not found!")
     data = {**comment.model_dump(), "user_id": current_user.id}
-    query = comment_table.insert().values(data)
-    logger.debug(query)
-    last_record_id = await database.execute(query)
+    # INSERT ... SELECT ... WHERE EXISTS checks the post in the same statement
+    post_exists = sqlalchemy.exists().where(post_table.c.id == comment.post_id)
+    query = (
+        comment_table.insert()
+        .from_select(
+            ["body", "post_id", "user_id"],
+            sqlalchemy.select(
+                sqlalchemy.literal(comment.body),
+                sqlalchemy.literal(comment.post_id),
+                sqlalchemy.literal(current_user.id),
+            ).where(post_exists),
+        )
+        .returning(comment_table.c.id)
+    )
+    last_record_id = await database.fetch_val(query)
+    if last_record_id is None:
+        raise HTTPException(status_code=404, detail="post not found!")
+    await search_index.add([comment_document(last_record_id, comment.post_id, comment.body)])
+    invalidate(post_tag(comment.post_id))
     new_comment = {**data, "id": last_record_id}
     return new_comment
 
 
+def select_post_comments(post_id: int):
+    return sqlalchemy.select(*model_columns(comment_table, Comment)).where(
+        comment_table.c.post_id == post_id
+    )
+
+
 @router.get("/post/{post_id}/comment", response_model=list[Comment])
-async def get_post_comments(post_id: int):
-    post = await find_post(post_id)
-    if not post:
-        raise HTTPException(status_code=404, detail="post not found!")
+async def get_post_comments(post_id: int, format: ResponseFormat = ResponseFormat.json):
+    db = replicas.reader()
+    if format == ResponseFormat.ndjson:
+        # The 404 has to be decided before the stream starts
+        query = sqlalchemy.select(post_table.c.id).where(post_table.c.id == post_id)
+        if await db.fetch_one(query) is None:
+            raise HTTPException(status_code=404, detail="post not found!")
+        return ndjson_response(
+            db, select_post_comments(post_id).order_by(comment_table.c.id), Comment
+        )
 
-    query = comment_table.select().where(comment_table.c.post_id == post_id)
-    logger.debug(query)
-    return await database.fetch_all(query)
+    # Outer join from posts so a missing post (no rows) and a post without
+    # comments (one row of NULLs) are told apart in a single query.
+    query = (
+        sqlalchemy.select(
+            comment_table.c.id.label("comment_id"), *model_columns(comment_table, Comment)
+        )
+        .select_from(post_table.outerjoin(comment_table))
+        .where(post_table.c.id == post_id)
+        .order_by(comment_table.c.id)
+    )
+    found = False
+    comments = Columns.for_model(Comment)
+    async for values in db.iterate_values(query):
+        found = True
+        if values[0] is not None:
+            comments.append(values[1:])
+    if not found:
+        raise HTTPException(status_code=404, detail="post not found!")
+    return Response(dump_rows(comments, Comment), media_type="application/json")
 
 
 @router.get("/post/{post_id}", response_model=UserPostWithComments)
-async def get_post_with_comments(post_id: int):
-    query = select_post_likes_count_query.where(post_table.c.id == post_id)
-    logger.debug(query)
-    post = await database.fetch_one(query)
-    if not post:
-        raise HTTPException(status_code=404, detail="post not found!")
+async def get_post_with_comments(post_id: int, request: Request):
+    cache_key = (post_tag(post_id),)
+    cached = cached_response(cache_key)
+    if cached is None:
+        generation = response_cache.generation
+        db = replicas.reader()
+        query = select_post_fields().where(post_table.c.id == post_id)
+        post = await fetch_columns(db, query, UserPostWithLikes)
+        if not post:
+            raise HTTPException(status_code=404, detail="post not found!")
 
-    return {"post": post, "comments": await get_post_comments(post_id)}
+        comments = await fetch_columns(db, select_post_comments(post_id), Comment)
+        body = dump_post_with_comments(post.row(0), comments)
+        cached = response_cache.set(
+            cache_key, body, [post_tag(post_id)], generation=generation, min_tag_age=min_tag_age(db)
+        )
+    return cached.to_response(request)
 
 
 @router.post("/like", response_model=PostLike, status_code=201)
@@ -122,13 +419,142 @@ async def like_post(
         like: PostLikeIn,
         current_user: Annotated[User, Depends(get_current_user)]
 ):
-    post = await find_post(like.post_id)
-    if not post:
-        raise HTTPException(status_code=404, detail="post not found!")
-
     data = {**like.model_dump(), "user_id": current_user.id}
-    query = like_table.insert().values(data)
-    logger.debug(query)
-    last_record_id = await database.execute(query)
+    already_liked = sqlalchemy.exists().where(
+        like_table.c.post_id == like.post_id, like_table.c.user_id == current_user.id
+    )
+    new_like = sqlalchemy.select(
+        sqlalchemy.literal(like.post_id), sqlalchemy.literal(current_user.id)
+    ).where(~already_liked)
+    if config.BUFFERED_LIKES:
+        # With no counter to bump, the insert checks for the post itself
+        new_like = new_like.where(sqlalchemy.exists().where(post_table.c.id == like.post_id))
+    query = (
+        like_table.insert()
+        .from_select(["post_id", "user_id"], new_like)
+        .returning(like_table.c.id)
+    )
+    if config.BUFFERED_LIKES:
+        last_record_id = await database.fetch_val(query)
+        if last_record_id is None:
+            if not await find_existing_post_ids({like.post_id}):
+                raise HTTPException(status_code=404, detail="post not found!")
+            raise HTTPException(status_code=409, detail="post already liked!")
+        like_counter.add([like.post_id])
+        return {**data, "id": last_record_id}
+
+    # Bumping the counter first doubles as the existence check for the post
+    counter_query = (
+        post_table.update()
+        .where(post_table.c.id == like.post_id)
+        .values(likes=post_table.c.likes + 1)
+        .returning(post_table.c.id)
+    )
+    async with database.transaction():
+        if await database.fetch_val(counter_query) is None:
+            raise HTTPException(status_code=404, detail="post not found!")
+        last_record_id = await database.fetch_val(query)
+        if last_record_id is None:
+            # Leaving the block with an exception rolls the counter back
+            raise HTTPException(status_code=409, detail="post already liked!")
+    invalidate_likes([like.post_id])
     new_like_post = {**data, "id": last_record_id}
     return new_like_post
+
+
+# --- batch endpoints: one transaction and a fixed number of queries per request
+async def find_existing_post_ids(post_ids: set[int]) -> set[int]:
+    query = sqlalchemy.select(post_table.c.id).where(post_table.c.id.in_(post_ids))
+    return {row.id for row in await database.fetch_all(query)}
+
+
+async def insert_many(table: sqlalchemy.Table, rows: list[dict]) -> list[int]:
+    """Insert rows with a single multi-row INSERT and return their ids in order.
+
+    Ids are assigned in VALUES order within one statement, so sorting the
+    returned ids lines them up with rows.
+    """
+    query = table.insert().values(rows).returning(table.c.id)
+    return sorted(row.id for row in await database.fetch_all(query))
+
+
+@router.post("/post/batch", response_model=list[BatchItemResult[UserPost]])
+async def create_posts_batch(
+        posts: Annotated[list[UserPostIn], Body(min_length=1, max_length=MAX_BATCH_SIZE)],
+        current_user: Annotated[User, Depends(get_current_user)]
+):
+    rows = [{**post.model_dump(), "user_id": current_user.id} for post in posts]
+    async with database.transaction():
+        ids = await insert_many(post_table, rows)
+    await search_index.add([post_document(id, row["body"]) for row, id in zip(rows, ids)])
+    invalidate(POST_LIST_TAG)
+    return [{"status_code": 201, "item": {**row, "id": id}} for row, id in zip(rows, ids)]
+
+
+@router.post("/comment/batch", response_model=list[BatchItemResult[Comment]])
+async def create_comments_batch(
+        comments: Annotated[list[CommentIn], Body(min_length=1, max_length=MAX_BATCH_SIZE)],
+        current_user: Annotated[User, Depends(get_current_user)]
+):
+    results: list[dict] = [{"status_code": 404, "detail": "post not found!"}] * len(comments)
+    async with database.transaction():
+        existing = await find_existing_post_ids({comment.post_id for comment in comments})
+        accepted = [
+            (index, {**comment.model_dump(), "user_id": current_user.id})
+            for index, comment in enumerate(comments)
+            if comment.post_id in existing
+        ]
+        if accepted:
+            ids = await insert_many(comment_table, [row for _, row in accepted])
+            for (index, row), id in zip(accepted, ids):
+                results[index] = {"status_code": 201, "item": {**row, "id": id}}
+    await search_index.add([
+        comment_document(result["item"]["id"], result["item"]["post_id"], result["item"]["body"])
+        for result in results if result["status_code"] == 201
+    ])
+    invalidate(*(post_tag(row["post_id"]) for _, row in accepted))
+    return results
+
+
+@router.post("/like/batch", response_model=list[BatchItemResult[PostLike]])
+async def like_posts_batch(
+        likes: Annotated[list[PostLikeIn], Body(min_length=1, max_length=MAX_BATCH_SIZE)],
+        current_user: Annotated[User, Depends(get_current_user)]
+):
+    results: list[dict] = [{"status_code": 404, "detail": "post not found!"}] * len(likes)
+    post_ids = {like.post_id for like in likes}
+    async with database.transaction():
+        existing = await find_existing_post_ids(post_ids)
+        query = sqlalchemy.select(like_table.c.post_id).where(
+            like_table.c.user_id == current_user.id, like_table.c.post_id.in_(post_ids)
+        )
+        liked = {row.post_id for row in await database.fetch_all(query)}
+
+        accepted: dict[int, int] = {}
+        for index, like in enumerate(likes):
+            if like.post_id in liked or like.post_id in accepted:
+                results[index] = {"status_code": 409, "detail": "post already liked!"}
+            elif like.post_id in existing:
+                accepted[like.post_id] = index
+
+        if accepted:
+            rows = [{"post_id": post_id, "user_id": current_user.id} for post_id in accepted]
+            query = like_table.insert().values(rows).returning(like_table.c.id, like_table.c.post_id)
+            for row in await database.fetch_all(query):
+                results[accepted[row.post_id]] = {
+                    "status_code": 201,
+                    "item": {"id": row.id, "post_id": row.post_id, "user_id": current_user.id},
+                }
+            if not config.BUFFERED_LIKES:
+                # A user likes each post at most once, so every counter moves by exactly one
+                counter_query = (
+                    post_table.update()
+                    .where(post_table.c.id.in_(accepted))
+                    .values(likes=post_table.c.likes + 1)
+                )
+                await database.execute(counter_query)
+    if config.BUFFERED_LIKES:
+        like_counter.add(accepted)
+    else:
+        invalidate_likes(accepted)
+    return results
@@ -0,0 +1,51 @@
+import logging
+from typing import Annotated
+
+from fastapi import APIRouter, HTTPException, Query, Response
+
+from storeapi.database import replicas
+from storeapi.models.search import SearchHit
+from storeapi.pagination import decode_cursor, encode_cursor, is_int64
+from storeapi.routers.post import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from storeapi.search import query_terms, search_index
+
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+MAX_QUERY_LENGTH = 200
+
+
+def decode_search_cursor(cursor: str, q: str) -> int:
+    try:
+        key = decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from e
+    offset = key.get("offset")
+    if key.get("q") != q or not is_int64(offset) or offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return offset
+
+
+@router.get("/search", response_model=list[SearchHit])
+async def search(
+        response: Response,
+        q: Annotated[str, Query(min_length=1, max_length=MAX_QUERY_LENGTH)],
+        limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+        cursor: str | None = None,
+):
+    """Posts and comments containing every word of q, most relevant first.
+
+    The cursor for the next page, if any, is sent in the X-Next-Cursor header.
+    """
+    offset = decode_search_cursor(cursor, q) if cursor else 0
+    terms = query_terms(q)
+    if not terms:
+        return []
+    db = replicas.reader()
+    # Fetch one extra hit to learn whether another page follows.
+    hits = await search_index.search(db, terms, limit + 1, offset)
+    if len(hits) > limit:
+        hits = hits[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor({"q": q, "offset": offset + limit})
+    return hits
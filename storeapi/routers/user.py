@@ -6,8 +6,9 @@ from fastapi.security import OAuth2PasswordRequestForm
 
 from storeapi.database import user_table, database
 from storeapi.models.user import UserIn
-from storeapi.security import get_user, get_password_hash, authenticate_user, create_access_token, \
-    get_subject_for_token_type, create_confirmation_token
+from storeapi.security import get_user, hash_password, authenticate_user, create_access_token, \
+    get_subject_for_token_type, create_confirmation_token, invalidate_user
+from storeapi.tasks import email_outbox, queue_user_registration_email
 
 router = APIRouter()
 
@@ -16,23 +17,29 @@ logger = logging.getLogger(__name__)
 
 @router.post("/register", status_code=status.HTTP_201_CREATED)
 async def register(user: UserIn, request: Request):
-    if await get_user(user.email):
+    if await get_user(user.email, primary=True):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="A user with that email already exists"
         )
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await hash_password(user.password)
     query = user_table.insert().values(
         email=user.email,
         password=hashed_password
     )
-    logger.debug(query)
-    await database.execute(query)
+    confirmation_url = request.url_for(
+        "confirm_email", token=create_confirmation_token(user.email)
+    )
+    # The email is queued in the same transaction, so it goes out if and
+    # only if the user was created; sending happens in the background.
+    async with database.transaction():
+        await database.execute(query)
+        await queue_user_registration_email(user.email, str(confirmation_url))
+    email_outbox.notify()
+    invalidate_user(user.email)
     return {
         "detail": "User created. Please confirm your email.",
-        "confirmation_url": request.url_for(
-            "confirm_email", token=create_confirmation_token(user.email)
-        ),
+        "confirmation_url": confirmation_url,
     }
 
 
@@ -50,7 +57,6 @@ async def confirm_email(token: str):
         user_table.update().where(user_table.c.email == email).values(confirmed=True)
     )
 
-    logger.debug(query)
-
     await database.execute(query)
+    invalidate_user(email)
     return {"detail": "User confirmed"}
@@ -0,0 +1,75 @@
+"""Compact rows for listings that can run to a whole table.
+
+databases wraps every row in a SQLAlchemy Row and a Record, and pydantic
+builds a model on top of each. Listings instead select the columns of their
+model in field order, read rows as plain tuples and keep them column by
+column in a Columns, integer columns packed into arrays of 8-byte ints. Rows
+become dicts, and models if they are validated, a chunk at a time on the way
+out.
+"""
+from array import array
+from typing import Iterator, Sequence
+
+import sqlalchemy
+from pydantic import BaseModel
+
+from storeapi.instrumentation import InstrumentedDatabase
+
+CHUNK_SIZE = 1000
+
+
+def model_columns(table: sqlalchemy.Table, model: type[BaseModel]) -> list[sqlalchemy.Column]:
+    """The columns of table behind the fields of model, in field order."""
+    return [table.c[field] for field in model.model_fields]
+
+
+class Columns:
+    """Rows of one result, stored column by column."""
+
+    __slots__ = ("fields", "columns")
+
+    def __init__(self, fields: Sequence[str], integers: Sequence[str] = ()) -> None:
+        self.fields = tuple(fields)
+        self.columns: list = [array("q") if field in integers else [] for field in self.fields]
+
+    @classmethod
+    def for_model(cls, model: type[BaseModel]) -> "Columns":
+        integers = [name for name, field in model.model_fields.items() if field.annotation is int]
+        return cls(model.model_fields, integers)
+
+    def __len__(self) -> int:
+        return len(self.columns[0])
+
+    def append(self, values: Sequence) -> None:
+        for index, value in enumerate(values):
+            column = self.columns[index]
+            try:
+                column.append(value)
+            except TypeError:
+                # A NULL in an integer column; that column is a list from here on
+                self.columns[index] = [*column, value]
+
+    def column(self, field: str) -> Sequence:
+        return self.columns[self.fields.index(field)]
+
+    def row(self, index: int) -> dict:
+        return dict(zip(self.fields, (column[index] for column in self.columns)))
+
+    def truncate(self, length: int) -> None:
+        for column in self.columns:
+            del column[length:]
+
+    def chunks(self, size: int = CHUNK_SIZE) -> Iterator[list[dict]]:
+        """The rows as dicts of field to value, at most size of them at a time."""
+        fields = self.fields
+        for start in range(0, len(self), size):
+            values = zip(*(column[start:start + size] for column in self.columns))
+            yield [dict(zip(fields, row)) for row in values]
+
+
+async def fetch_columns(db: InstrumentedDatabase, query, model: type[BaseModel]) -> Columns:
+    """The rows of query, which selects the fields of model in order."""
+    rows = Columns.for_model(model)
+    async for values in db.iterate_values(query):
+        rows.append(values)
+    return rows
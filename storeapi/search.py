@@ -0,0 +1,324 @@
+"""Full-text search over posts and comments.
+
+On SQLite builds with FTS5 the index is the search_index virtual table,
+filled by AFTER INSERT triggers on posts and comments, so a post and its
+index entry are written by the same statement. Anywhere
+else a pure-Python inverted index is loaded from the database at startup and
+indexes the writes this process makes straight away. Documents written by
+other processes are picked up by a search once the index is more than
+SEARCH_REFRESH_INTERVAL seconds behind, which reads the posts and comments
+past the highest ids loaded so far. Both rank with BM25 using the constants
+FTS5 uses, so the two agree on scores.
+"""
+import heapq
+import logging
+import math
+import re
+import sqlite3
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Callable, Literal, NamedTuple
+
+import sqlalchemy
+from databases import Database, DatabaseURL
+
+from storeapi.config import config
+from storeapi.database import comment_table, database, metadata, post_table
+
+logger = logging.getLogger(__name__)
+
+# FTS5's bm25() defaults
+K1 = 1.2
+B = 0.75
+
+# Ids a catch-up reads again below the highest loaded, for rows whose
+# transactions committed after a later id's did
+CATCH_UP_OVERLAP = 1000
+
+# Not part of `metadata`: create_all cannot create a virtual table, so the
+# after_create hook below does it instead.
+search_metadata = sqlalchemy.MetaData()
+
+search_table = sqlalchemy.Table(
+    "search_index",
+    search_metadata,
+    sqlalchemy.Column("body", sqlalchemy.Text),
+    sqlalchemy.Column("kind", sqlalchemy.String),
+    sqlalchemy.Column("doc_id", sqlalchemy.Integer),
+    sqlalchemy.Column("post_id", sqlalchemy.Integer),
+)
+
+CREATE_SEARCH_TABLE = [
+    sqlalchemy.DDL(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_index"
+        " USING fts5(body, kind UNINDEXED, doc_id UNINDEXED, post_id UNINDEXED)"
+    ),
+    # Posts and comments are never edited or deleted, so inserts are all there is to follow
+    sqlalchemy.DDL(
+        "CREATE TRIGGER IF NOT EXISTS posts_search_insert AFTER INSERT ON posts BEGIN"
+        " INSERT INTO search_index (body, kind, doc_id, post_id)"
+        " VALUES (new.body, 'post', new.id, new.id); END"
+    ),
+    sqlalchemy.DDL(
+        "CREATE TRIGGER IF NOT EXISTS comments_search_insert AFTER INSERT ON comments BEGIN"
+        " INSERT INTO search_index (body, kind, doc_id, post_id)"
+        " VALUES (new.body, 'comment', new.id, new.post_id); END"
+    ),
+]
+
+# Matches FTS5's default unicode61 tokenizer: case and diacritics folded,
+# anything that is not a letter or digit separates tokens.
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+
+
+class Document(NamedTuple):
+    kind: Literal["post", "comment"]
+    doc_id: int
+    post_id: int
+    body: str
+
+
+class Hit(NamedTuple):
+    kind: Literal["post", "comment"]
+    id: int
+    post_id: int
+    body: str
+    score: float
+
+
+def post_document(post_id: int, body: str) -> Document:
+    return Document("post", post_id, post_id, body)
+
+
+def comment_document(comment_id: int, post_id: int, body: str) -> Document:
+    return Document("comment", comment_id, post_id, body)
+
+
+def tokenize(text: str) -> list[str]:
+    folded = unicodedata.normalize("NFKD", text.casefold())
+    folded = "".join(char for char in folded if not unicodedata.combining(char))
+    return TOKEN_PATTERN.findall(folded)
+
+
+def query_terms(query: str) -> list[str]:
+    """The distinct terms of a search; every one of them must match."""
+    return list(dict.fromkeys(tokenize(query)))
+
+
+def idf(documents: int, matching: int) -> float:
+    # As in FTS5, common terms still count for a little
+    return max(math.log((documents - matching + 0.5) / (matching + 0.5)), 1e-6)
+
+
+def select_post_documents():
+    return sqlalchemy.select(
+        sqlalchemy.literal("post").label("kind"),
+        post_table.c.id.label("doc_id"),
+        post_table.c.id.label("post_id"),
+        post_table.c.body,
+    )
+
+
+def select_comment_documents():
+    return sqlalchemy.select(
+        sqlalchemy.literal("comment").label("kind"),
+        comment_table.c.id.label("doc_id"),
+        comment_table.c.post_id,
+        comment_table.c.body,
+    )
+
+
+def all_documents():
+    """Every post and comment, as (kind, doc_id, post_id, body) rows."""
+    return sqlalchemy.union_all(select_post_documents(), select_comment_documents())
+
+
+def documents_after(post_id: int, comment_id: int):
+    """The posts and comments with ids above post_id and comment_id, as all_documents() rows."""
+    return sqlalchemy.union_all(
+        select_post_documents().where(post_table.c.id > post_id),
+        select_comment_documents().where(comment_table.c.id > comment_id),
+    )
+
+
+def fill_search_table():
+    return search_table.insert().from_select(["kind", "doc_id", "post_id", "body"], all_documents())
+
+
+def sqlite_has_fts5() -> bool:
+    connection = sqlite3.connect(":memory:")
+    try:
+        connection.execute("CREATE VIRTUAL TABLE probe USING fts5(body)")
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        connection.close()
+    return True
+
+
+def search_backend(dialect: str) -> Literal["fts5", "memory"]:
+    if config.SEARCH_BACKEND == "memory":
+        return "memory"
+    if dialect == "sqlite" and sqlite_has_fts5():
+        return "fts5"
+    if config.SEARCH_BACKEND == "fts5":
+        raise RuntimeError("SEARCH_BACKEND is fts5, but the database does not support FTS5")
+    return "memory"
+
+
+class FTS5Index:
+    backend = "fts5"
+
+    async def load(self):
+        pass
+
+    async def add(self, documents: list[Document]):
+        # The triggers have already indexed them
+        pass
+
+    async def search(self, db: Database, terms: list[str], limit: int, offset: int) -> list[Hit]:
+        match = " ".join(f'"{term}"' for term in terms)
+        table = sqlalchemy.literal_column(search_table.name)
+        rank = sqlalchemy.func.bm25(table)
+        query = (
+            sqlalchemy.select(
+                search_table.c.kind,
+                search_table.c.doc_id.label("id"),
+                search_table.c.post_id,
+                search_table.c.body,
+                (-rank).label("score"),
+            )
+            .where(table.op("MATCH")(match))
+            .order_by(rank, search_table.c.kind, search_table.c.doc_id)
+            .limit(limit)
+            .offset(offset)
+        )
+        return [Hit(**row._mapping) for row in await db.fetch_all(query)]
+
+    async def rebuild(self) -> int:
+        async with database.transaction():
+            await database.execute(search_table.delete())
+            await database.execute(fill_search_table())
+            count = sqlalchemy.select(sqlalchemy.func.count()).select_from(search_table)
+            return await database.fetch_val(count)
+
+
+class MemoryIndex:
+    """BM25 over posts and comments held in this process.
+
+    With a refresh_interval, a search first catches up with the documents
+    other processes wrote if the last catch-up is older than that; without
+    one, only the documents loaded at startup and this process's own writes
+    are found, which is only right for a single server process.
+    """
+
+    backend = "memory"
+
+    def __init__(
+            self, refresh_interval: float | None = None, timer: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.refresh_interval = refresh_interval
+        self.timer = timer
+        self.clear()
+
+    def clear(self):
+        # Term -> {(kind, doc_id): occurrences}
+        self.postings: dict[str, dict[tuple[str, int], int]] = defaultdict(dict)
+        # (kind, doc_id) -> (document, length in tokens)
+        self.documents: dict[tuple[str, int], tuple[Document, int]] = {}
+        self.total_length = 0
+        # Highest ids read from the database; this process's own writes do
+        # not count, as other processes may hold lower ids not loaded yet
+        self.loaded_ids = {"post": 0, "comment": 0}
+        self.refreshed_at: float | None = None
+
+    async def load(self):
+        await self.rebuild()
+
+    async def add(self, documents: list[Document]):
+        """Index documents once they are committed."""
+        for document in documents:
+            self.index(document)
+
+    def index(self, document: Document):
+        key = (document.kind, document.doc_id)
+        if key in self.documents:
+            return
+        tokens = tokenize(document.body or "")
+        for term, count in Counter(tokens).items():
+            self.postings[term][key] = count
+        self.documents[key] = (document, len(tokens))
+        self.total_length += len(tokens)
+
+    async def search(self, db: Database, terms: list[str], limit: int, offset: int) -> list[Hit]:
+        if self.refresh_interval is not None and (
+                self.refreshed_at is None or self.timer() - self.refreshed_at >= self.refresh_interval
+        ):
+            await self.catch_up()
+        postings = [self.postings.get(term) for term in terms]
+        if not postings or not all(postings):
+            return []
+        documents = len(self.documents)
+        average_length = self.total_length / documents
+        weights = [idf(documents, len(matches)) for matches in postings]
+        smallest = min(postings, key=len)
+        ranked = []
+        for key in smallest:
+            if not all(key in matches for matches in postings):
+                continue
+            length = self.documents[key][1]
+            norm = K1 * (1 - B + B * length / average_length)
+            score = sum(
+                weight * matches[key] * (K1 + 1) / (matches[key] + norm)
+                for weight, matches in zip(weights, postings)
+            )
+            ranked.append((-score, *key))
+        page = heapq.nsmallest(offset + limit, ranked)[offset:]
+        hits = []
+        for negated_score, kind, doc_id in page:
+            document = self.documents[kind, doc_id][0]
+            hits.append(Hit(kind, doc_id, document.post_id, document.body, -negated_score))
+        return hits
+
+    async def rebuild(self) -> int:
+        self.clear()
+        await self.load_documents(all_documents())
+        self.refreshed_at = self.timer()
+        logger.info("Loaded %s documents into the search index", len(self.documents))
+        return len(self.documents)
+
+    async def catch_up(self) -> int:
+        """Index the posts and comments written since the last load. Returns how many were new."""
+        # Set first, so searches running meanwhile do not start catch-ups of their own
+        self.refreshed_at = self.timer()
+        query = documents_after(
+            max(self.loaded_ids["post"] - CATCH_UP_OVERLAP, 0),
+            max(self.loaded_ids["comment"] - CATCH_UP_OVERLAP, 0),
+        )
+        before = len(self.documents)
+        await self.load_documents(query)
+        return len(self.documents) - before
+
+    async def load_documents(self, query):
+        async for row in database.iterate(query):
+            self.index(Document(row.kind, row.doc_id, row.post_id, row.body))
+            self.loaded_ids[row.kind] = max(self.loaded_ids[row.kind], row.doc_id)
+
+
+def create_search_table(connection: sqlalchemy.Connection):
+    for statement in CREATE_SEARCH_TABLE:
+        connection.execute(statement)
+
+
+def on_metadata_create(target, connection: sqlalchemy.Connection, **kw):
+    if search_backend(connection.dialect.name) == "fts5":
+        create_search_table(connection)
+
+
+sqlalchemy.event.listen(metadata, "after_create", on_metadata_create)
+
+search_index: FTS5Index | MemoryIndex = (
+    FTS5Index() if search_backend(DatabaseURL(config.DATABASE_URL).dialect) == "fts5"
+    else MemoryIndex(refresh_interval=config.SEARCH_REFRESH_INTERVAL)
+)
@@ -1,5 +1,7 @@
 import datetime
+import hashlib
 import logging
+import time
 from typing import Annotated, Literal
 
 from fastapi import HTTPException, status, Depends
@@ -8,7 +10,10 @@ from jose import jwt, ExpiredSignatureError, JWTError
 
 from passlib.context import CryptContext
 
-from storeapi.database import user_table, database
+from storeapi.cache import CacheBackend, LRUCache
+from storeapi.config import config
+from storeapi.database import user_table, database, replicas
+from storeapi.executors import BoundedExecutor, ExecutorSaturatedError
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +21,17 @@ SECRET_KEY = "9b73f2a1bdd7ae163444473d29a6885ffa22ab26117068f72a5a56a74d12d1fc"
 ALGORITHM = "HS256"
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 pwd_context = CryptContext(schemes=["bcrypt"])
+# Authenticated users by email (the access token subject)
+user_cache: CacheBackend = LRUCache(maxsize=config.USER_CACHE_SIZE, ttl=config.USER_CACHE_TTL)
+# Verified token payloads by token digest, each kept only until its own "exp"
+token_cache: CacheBackend = LRUCache(maxsize=config.TOKEN_CACHE_SIZE, ttl=0)
+# Revoked token digests mapped to the time they would have expired anyway
+revoked_tokens: dict[str, float] = {}
+password_executor = BoundedExecutor(
+    workers=config.PASSWORD_HASH_WORKERS,
+    queue_limit=config.PASSWORD_HASH_QUEUE_LIMIT,
+    kind=config.PASSWORD_HASH_EXECUTOR,
+)
 
 def create_unauthorized_exception(detail: str) -> HTTPException:
     return HTTPException(
@@ -61,29 +77,70 @@ def verify_password_hash(plain: str, hashed: str):
     return pwd_context.verify(plain, hashed)
 
 
+async def run_password_task(fn, *args):
+    """Run a bcrypt call on password_executor, shedding load with 503 when it is full."""
+    try:
+        return await password_executor.run(fn, *args)
+    except ExecutorSaturatedError as e:
+        logger.warning("Password hashing queue is full, rejecting request")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry",
+            headers={"Retry-After": "1"},
+        ) from e
+
+
+async def hash_password(password: str) -> str:
+    return await run_password_task(get_password_hash, password)
+
+
+async def verify_password(plain: str, hashed: str) -> bool:
+    return await run_password_task(verify_password_hash, plain, hashed)
+
+
 async def authenticate_user(email: str, password: str):
     logger.debug("Authenticating user", extra={"email": email})
     user = await get_user(email)
+    if (not user or not user.confirmed) and replicas.replicas:
+        # The replica may not show the registration or confirmation yet, and
+        # logging in is often done from another client than the one that wrote them
+        user = await get_user(email, primary=True)
     if not user:
         raise create_unauthorized_exception("Could not validate credentials")
-    if not verify_password_hash(password, user.password):
+    if not await verify_password(password, user.password):
         raise create_unauthorized_exception("Could not validate credentials")
     if not user.confirmed:
         raise create_unauthorized_exception("User has not confirmed email")
     return user
 
 
-async def get_user(email: str):
+async def get_user(email: str, primary: bool = False):
+    """Look a user up on a read replica, or on the primary if asked or recently written."""
+    db = database if primary else replicas.reader()
     query = user_table.select().where(user_table.c.email == email)
-    logger.debug(query)
-    result = await database.fetch_one(query)
+    result = await db.fetch_one(query)
     if result:
         return result
 
 
-def get_subject_for_token_type(
-        token: str, type: Literal["access", "confirmation"]
-) -> str:
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def decode_token(token: str) -> dict:
+    """Verify a token and return its payload.
+
+    Verified payloads are cached by token digest until the token expires, so
+    a token reused across requests is only verified once.
+    """
+    digest = token_digest(token)
+    if digest in revoked_tokens:
+        raise create_unauthorized_exception("Token has been revoked")
+
+    payload = token_cache.get(digest)
+    if payload is not None:
+        return payload
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except ExpiredSignatureError as e:
@@ -91,6 +148,35 @@ def get_subject_for_token_type(
     except JWTError as e:
         raise create_unauthorized_exception("Invalid token") from e
 
+    expires_in = payload.get("exp", 0) - time.time()
+    if expires_in > 0:
+        token_cache.set(digest, payload, ttl=expires_in)
+    return payload
+
+
+def revoke_token(token: str):
+    """Reject a token from now on, even if it is still cached or unexpired."""
+    try:
+        expires_at = jwt.get_unverified_claims(token).get("exp")
+    except JWTError:
+        return
+    now = time.time()
+    if expires_at is None:
+        expires_at = now + confirm_token_expire_minutes() * 60
+
+    digest = token_digest(token)
+    token_cache.delete(digest)
+    revoked_tokens[digest] = expires_at
+    for revoked, revoked_until in list(revoked_tokens.items()):
+        if revoked_until <= now:
+            del revoked_tokens[revoked]
+
+
+def get_subject_for_token_type(
+        token: str, type: Literal["access", "confirmation"]
+) -> str:
+    payload = decode_token(token)
+
     email = payload.get("sub")
     if email is None:
         raise create_unauthorized_exception("Token is missing 'sub' field")
@@ -104,9 +190,18 @@ def get_subject_for_token_type(
     return email
 
 
+def invalidate_user(email: str):
+    """Drop a cached user and pin the writing client to the primary; call whenever its row is written."""
+    user_cache.delete(email)
+    replicas.mark_written()
+
+
 async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
     email = get_subject_for_token_type(token, "access")
-    user = await get_user(email=email)
+    user = user_cache.get(email)
     if user is None:
-        raise create_unauthorized_exception("Could not validate credentials")
+        user = await get_user(email=email)
+        if user is None:
+            raise create_unauthorized_exception("Could not validate credentials")
+        user_cache.set(email, user)
     return user
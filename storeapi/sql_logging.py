@@ -0,0 +1,60 @@
+"""Query logging that costs next to nothing unless a record is actually emitted."""
+import logging
+import math
+from typing import Any
+
+from sqlalchemy.sql import ClauseElement
+
+from storeapi.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# SQL text by statement shape; bound values are not part of the shape
+sql_text_cache = LRUCache(maxsize=512, ttl=math.inf)
+
+
+def statement_shape(query: ClauseElement | str) -> Any:
+    """A hashable key shared by every statement that compiles to the same SQL, or None."""
+    if isinstance(query, str):
+        return query
+    cache_key = query._generate_cache_key()
+    if cache_key is None:
+        return None
+    try:
+        hash(cache_key.key)
+    except TypeError:
+        return None
+    return cache_key.key
+
+
+def sql_text(query: ClauseElement | str) -> str:
+    if isinstance(query, str):
+        return query
+    shape = statement_shape(query)
+    if shape is None:
+        return str(query)
+    text = sql_text_cache.get(shape)
+    if text is None:
+        text = str(query)
+        sql_text_cache.set(shape, text)
+    return text
+
+
+class LazySQL:
+    """Renders a statement's SQL only when a log record is formatted."""
+    __slots__ = ("query",)
+
+    def __init__(self, query: ClauseElement | str) -> None:
+        self.query = query
+
+    def __str__(self) -> str:
+        return sql_text(self.query)
+
+
+def log_query(query: ClauseElement | str, duration_ms: float, rows: int | None):
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    logger.debug(
+        "(%.2fms, %s rows) %s", duration_ms, "?" if rows is None else rows, LazySQL(query),
+        extra={"duration_ms": round(duration_ms, 3), "rows": rows},
+    )
@@ -0,0 +1,129 @@
+"""Compile each statement shape once per dialect instead of on every execution.
+
+databases compiles every statement it is handed from scratch. Statements
+built by the same code differ only in their bound values, so SQLAlchemy gives
+them the same cache key, and the compiled form of the first can serve all the
+others with the new values bound in. That is the compiled cache SQLAlchemy's
+own Engine keeps; CachedSQLiteBackend brings it to the databases SQLite
+backend. The other backends compile as before.
+
+Doing so takes private SQLAlchemy and databases APIs, which requirements.txt
+pins the versions of. compiled_cache_supported() tries them once, so a
+release without them falls back to compiling every statement instead of
+failing every query.
+"""
+import functools
+import logging
+from typing import Any
+
+import sqlalchemy
+from databases.backends.sqlite import CompilationContext, SQLiteBackend, SQLiteConnection
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.engine.interfaces import Dialect
+from sqlalchemy.sql import ClauseElement
+from sqlalchemy.sql.ddl import DDLElement
+from sqlalchemy.util import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class CompiledCache:
+    """Compiled statements by dialect and cache key."""
+
+    def __init__(self, maxsize: int) -> None:
+        self.compiled = LRUCache(maxsize)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.compiled)
+
+    def clear(self) -> None:
+        self.compiled.clear()
+
+    def compile(self, query: ClauseElement, dialect: Dialect) -> tuple[Any, str, list]:
+        """The compiled statement, its SQL and its positional arguments.
+
+        Mirrors what the Engine does per execution: bind this statement's
+        values into the cached compiled form, then expand IN lists, whose
+        length is not part of the cache key.
+        """
+        compiled, extracted, collected, cache_hit = query._compile_w_cache(
+            dialect, compiled_cache=self.compiled, column_keys=[]
+        )
+        if cache_hit == dialect.CACHE_HIT:
+            self.hits += 1
+        else:
+            self.misses += 1
+        params = compiled.construct_params(
+            extracted_parameters=extracted, escape_names=False, _collected_params=collected
+        )
+        processors = compiled._bind_processors
+        if compiled.literal_execute_params or compiled.post_compile_params:
+            expanded = compiled._process_parameters_for_postcompile(params)
+            sql, positions = expanded.statement, expanded.positiontup
+            params = expanded.parameters
+            processors = {**processors, **expanded.processors}
+        else:
+            sql, positions = compiled.string, compiled.positiontup
+        args = [
+            processors[key](params[key]) if key in processors else params[key]
+            for key in positions
+        ]
+        return compiled, sql, args
+
+
+def compilation_context(compiled, dialect: Dialect) -> CompilationContext:
+    """The context databases' SQLite backend builds its results with, as its _compile makes it."""
+    execution_context = dialect.execution_ctx_cls()
+    execution_context.dialect = dialect
+    execution_context.result_column_struct = (
+        compiled._result_columns,
+        compiled._ordered_columns,
+        compiled._textual_ordered_columns,
+        compiled._ad_hoc_textual,
+        compiled._loose_column_name_matching,
+    )
+    return CompilationContext(execution_context)
+
+
+@functools.cache
+def compiled_cache_supported() -> bool:
+    """Whether the installed SQLAlchemy and databases have what CachedSQLiteBackend uses."""
+    probe = sqlalchemy.select(sqlalchemy.literal(1).label("one")).where(
+        sqlalchemy.literal_column("1").in_([1, 2])
+    )
+    dialect = sqlite.dialect(paramstyle="qmark")
+    try:
+        if not callable(getattr(SQLiteConnection, "_compile", None)):
+            raise AttributeError("SQLiteConnection._compile")
+        compiled, sql, args = CompiledCache(1).compile(probe, dialect)
+        compilation_context(compiled, dialect)
+    except Exception:
+        logger.warning(
+            "This SQLAlchemy or databases release lacks what the compiled statement cache uses;"
+            " compiling every statement instead", exc_info=True,
+        )
+        return False
+    return args == [1, 1, 2]
+
+
+class CachedSQLiteConnection(SQLiteConnection):
+    def __init__(self, pool, dialect: Dialect, compiled_cache: CompiledCache) -> None:
+        super().__init__(pool, dialect)
+        self.compiled_cache = compiled_cache
+
+    def _compile(self, query: ClauseElement):
+        if isinstance(query, DDLElement):
+            return super()._compile(query)
+        compiled, sql, args = self.compiled_cache.compile(query, self._dialect)
+        return sql, args, compiled._result_columns, compilation_context(compiled, self._dialect)
+
+
+class CachedSQLiteBackend(SQLiteBackend):
+    def __init__(self, database_url, compiled_cache: CompiledCache, **options: Any) -> None:
+        super().__init__(database_url, **options)
+        self.compiled_cache = compiled_cache
+
+    def connection(self) -> CachedSQLiteConnection:
+        return CachedSQLiteConnection(self._pool, self._dialect, self.compiled_cache)
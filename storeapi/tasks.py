@@ -1,48 +1,402 @@
+import asyncio
+import contextlib
+import json
 import logging
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable
 
 import httpx
+import sqlalchemy
 
 from storeapi.config import config
+from storeapi.database import database, email_outbox_table
 
 logger = logging.getLogger(__name__)
 
+# Shared by every send so connections to Mailgun are kept alive and reused
+http_client: httpx.AsyncClient | None = None
+
 
 class APIResponseError(Exception):
-    pass
+    def __init__(self, message: str, status_code: int | None = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global http_client
+    if http_client is None:
+        http_client = httpx.AsyncClient(
+            base_url=config.MAILGUN_BASE_URL,
+            timeout=config.MAILGUN_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=config.MAIL_WORKERS,
+                max_keepalive_connections=config.MAIL_WORKERS,
+            ),
+        )
+    return http_client
+
+
+async def close_http_client():
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
 
 
 async def send_simple_message(to: str, subject: str, body: str):
-    logger.debug(f"Sending email to '{to[:3]}' with subject '{subject[:20]}'")
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"https://api.mailgun.net/v3/{config.MAILGUN_DOMAIN}/messages",
-                auth=("api", config.MAILGUN_API_KEY),
-                data={
-                    "from": f"Koske <mailgun@{config.MAILGUN_DOMAIN}>",
-                    "to": [to],
-                    "subject": subject,
-                    "text": body,
-                },
-            )
-            response.raise_for_status()
+    return await send_batch_message({to: {}}, subject, body)
+
+
+async def send_batch_message(recipient_variables: dict[str, dict], subject: str, body: str):
+    """Send one email per recipient in a single request.
+
+    %recipient.<name>% in the subject and body is replaced with that
+    recipient's variables. Sending recipient-variables also makes Mailgun
+    address each email to its recipient alone rather than to the whole list.
+    """
+    logger.debug(
+        "Sending email to %s recipients with subject '%s'", len(recipient_variables), subject[:20]
+    )
+    try:
+        response = await get_http_client().post(
+            f"/v3/{config.MAILGUN_DOMAIN}/messages",
+            auth=("api", config.MAILGUN_API_KEY),
+            data={
+                "from": f"Koske <mailgun@{config.MAILGUN_DOMAIN}>",
+                "to": list(recipient_variables),
+                "subject": subject,
+                "text": body,
+                "recipient-variables": json.dumps(recipient_variables),
+            },
+        )
+        response.raise_for_status()
+
+        logger.debug(response.content)
+
+        return response
+    except httpx.HTTPStatusError as err:
+        raise APIResponseError(
+            f"API request failed with status code {err.response.status_code}",
+            status_code=err.response.status_code,
+        ) from err
 
-            logger.debug(response.content)
 
-            return response
-        except httpx.HTTPStatusError as err:
-            raise APIResponseError(
-                f"API request failed with status code {err.response.status_code}"
-            ) from err
+async def enqueue_email(to: str, subject: str, body: str, variables: dict | None = None) -> int:
+    """Add an email to the outbox and return its id.
+
+    Emails with the same subject and body are sent in batches, so keep
+    per-recipient details out of them and in `variables`, referenced as
+    %recipient.<name>%. Call it inside the transaction that makes the email
+    necessary, and call email_outbox.notify() once that transaction has
+    committed.
+    """
+    now = time.time()
+    query = (
+        email_outbox_table.insert()
+        .values(
+            recipient=to,
+            subject=subject,
+            body=body,
+            variables=json.dumps(variables) if variables else None,
+            next_attempt_at=now,
+            created_at=now,
+        )
+        .returning(email_outbox_table.c.id)
+    )
+    return await database.fetch_val(query)
 
 
-async def send_user_registration_email(email: str, confirmation_url: str):
-    return await send_simple_message(
+async def queue_user_registration_email(email: str, confirmation_url: str):
+    return await enqueue_email(
         email,
         "Successfully signed up",
         (
-            f"Hi {email}! You have successfully signed up to the Stores REST API."
+            "Hi %recipient.email%! You have successfully signed up to the Stores REST API."
             " Please confirm your email by clicking on the"
-            f" following link: {confirmation_url}"
+            " following link: %recipient.confirmation_url%"
         ),
+        variables={"email": email, "confirmation_url": confirmation_url},
+    )
+
+
+# Mailgun's answers to a message it will not take: a bad address or
+# parameter, or a message too large. One email of a batch is enough to cause
+# them, so they are the ones worth splitting a batch over.
+REJECTED_STATUSES = frozenset({400, 413})
+# Answers about the account rather than the message: a bad API key or an
+# unknown domain. Every email fails alike until someone fixes the settings.
+CONFIGURATION_ERROR_STATUSES = frozenset({401, 403, 404})
+
+
+def error_status(error: Exception) -> int | None:
+    return error.status_code if isinstance(error, APIResponseError) else None
+
+
+def is_permanent(error: Exception) -> bool:
+    """Whether retrying cannot help: Mailgun rejected the message or its recipients."""
+    return error_status(error) in REJECTED_STATUSES
+
+
+class EmailOutbox:
+    """Delivers the email_outbox table in the background.
+
+    Claiming a row pushes its next_attempt_at forward by lease_seconds, so a
+    row whose worker died is handed out again once the lease runs out, by
+    this process or another one sharing the database. Delivery is therefore
+    at least once. Failures are retried with exponential backoff; after
+    max_attempts, or on a rejection that retrying cannot fix, the row is
+    marked dead and left for dead_letters() and requeue_dead_letters().
+
+    Claimed emails with the same subject and body are sent as one request
+    of up to batch_size recipients, and a notify() waits batch_window
+    seconds so that emails queued in the same burst share a batch. Mailgun
+    rejects a batch as a whole, so a rejected batch is split in half and
+    each half resent until the emails at fault are isolated. Any other
+    failure, an account error included, fails the batch as a whole and is
+    retried.
+    """
+
+    def __init__(
+            self,
+            workers: int,
+            max_attempts: int,
+            base_delay: float,
+            max_delay: float,
+            poll_interval: float,
+            lease_seconds: float,
+            batch_size: int = 1,
+            batch_window: float = 0.0,
+            send: Callable[[dict[str, dict], str, str], Awaitable] | None = None,
+            timer: Callable[[], float] = time.time,
+    ) -> None:
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.send = send or send_batch_message
+        self.timer = timer
+        self._sending = asyncio.Semaphore(workers)
+        self._wakeup: asyncio.Event | None = None
+        self._notified = False
+        self._dispatcher: asyncio.Task | None = None
+        self._deliveries: set[asyncio.Task] = set()
+        self.sent = 0
+        self.retried = 0
+        self.dead = 0
+        self.requests = 0
+
+    def notify(self):
+        """Look for work within batch_window rather than at the next poll."""
+        if self._wakeup is not None:
+            self._notified = True
+            self._wakeup.set()
+
+    async def claim(self, limit: int) -> list:
+        now = self.timer()
+        is_due = (email_outbox_table.c.status == "pending") & (
+            email_outbox_table.c.next_attempt_at <= now
+        )
+        due = (
+            sqlalchemy.select(email_outbox_table.c.id)
+            .where(is_due)
+            .order_by(email_outbox_table.c.next_attempt_at, email_outbox_table.c.id)
+            .limit(limit)
+            .scalar_subquery()
+        )
+        query = (
+            email_outbox_table.update()
+            # is_due again, in case another process claimed a row first
+            .where(email_outbox_table.c.id.in_(due), is_due)
+            .values(
+                attempts=email_outbox_table.c.attempts + 1,
+                next_attempt_at=now + self.lease_seconds,
+            )
+            .returning(
+                email_outbox_table.c.id,
+                email_outbox_table.c.recipient,
+                email_outbox_table.c.subject,
+                email_outbox_table.c.body,
+                email_outbox_table.c.variables,
+                email_outbox_table.c.attempts,
+            )
+        )
+        return await database.fetch_all(query)
+
+    def batches(self, jobs: list) -> list[list]:
+        """Split jobs into batches sharing a subject and body, each recipient at most once."""
+        groups = defaultdict(list)
+        for job in jobs:
+            groups[job.subject, job.body].append(job)
+        batches = []
+        for group in groups.values():
+            batch, recipients = [], set()
+            for job in group:
+                # Recipient variables are keyed by address, so a repeat starts a new batch
+                if len(batch) == self.batch_size or job.recipient in recipients:
+                    batches.append(batch)
+                    batch, recipients = [], set()
+                batch.append(job)
+                recipients.add(job.recipient)
+            batches.append(batch)
+        return batches
+
+    async def deliver(self, batch: list):
+        recipient_variables = {job.recipient: json.loads(job.variables or "{}") for job in batch}
+        try:
+            async with self._sending:
+                self.requests += 1
+                await self.send(recipient_variables, batch[0].subject, batch[0].body)
+        except Exception as e:
+            if len(batch) > 1 and is_permanent(e):
+                half = len(batch) // 2
+                await asyncio.gather(self.deliver(batch[:half]), self.deliver(batch[half:]))
+            else:
+                await self.failed(batch, e)
+        else:
+            await database.execute(
+                email_outbox_table.delete().where(
+                    email_outbox_table.c.id.in_([job.id for job in batch])
+                )
+            )
+            self.sent += len(batch)
+
+    async def failed(self, batch: list, error: Exception):
+        last_error = str(error)[:500] or type(error).__name__
+        if error_status(error) in CONFIGURATION_ERROR_STATUSES:
+            logger.error(
+                "Mailgun refused the request for %s emails; check MAILGUN_API_KEY and MAILGUN_DOMAIN: %s",
+                len(batch), error,
+            )
+        # Jobs claimed together can be on different attempts
+        ids_by_attempts = defaultdict(list)
+        for job in batch:
+            ids_by_attempts[job.attempts].append(job.id)
+        for attempts, ids in ids_by_attempts.items():
+            values = {"last_error": last_error}
+            if is_permanent(error) or attempts >= self.max_attempts:
+                logger.error(
+                    "Giving up on emails %s after %s attempts: %s", ids, attempts, error
+                )
+                values["status"] = "dead"
+                self.dead += len(ids)
+            else:
+                delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+                logger.warning(
+                    "%s emails failed (attempt %s), retrying in %.0fs: %s",
+                    len(ids), attempts, delay, error,
+                )
+                values["next_attempt_at"] = self.timer() + delay
+                self.retried += len(ids)
+            await database.execute(
+                email_outbox_table.update()
+                .where(email_outbox_table.c.id.in_(ids))
+                .values(values)
+            )
+
+    async def run_once(self) -> int:
+        """Deliver up to `workers` batches of due emails, waiting for all of them.
+
+        Returns how many emails were claimed.
+        """
+        jobs = await self.claim(self.workers * self.batch_size)
+        await asyncio.gather(*(self.deliver(batch) for batch in self.batches(jobs)))
+        return len(jobs)
+
+    def start(self):
+        if self._dispatcher is None:
+            # Fresh primitives, bound to the loop the dispatcher runs on
+            self._sending = asyncio.Semaphore(self.workers)
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self.dispatch())
+
+    async def stop(self, timeout: float = 10.0):
+        """Stop claiming and give running deliveries up to timeout seconds to finish.
+
+        Deliveries still running after that are cancelled; their leases run
+        out and they are retried later.
+        """
+        if self._dispatcher is None:
+            return
+        self._dispatcher.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._dispatcher
+        self._dispatcher = None
+        if self._deliveries:
+            _, pending = await asyncio.wait(self._deliveries, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def dispatch(self):
+        """Keep up to `workers` batches in flight, claiming more as slots free up."""
+        while True:
+            self._wakeup.clear()
+            free = self.workers - len(self._deliveries)
+            if free > 0:
+                limit = free * self.batch_size
+                try:
+                    jobs = await self.claim(limit)
+                except Exception:
+                    logger.exception("Could not claim emails from the outbox")
+                    jobs = []
+                # A claim can hold more batches than free slots when subjects
+                # differ; the sending semaphore still bounds the requests.
+                for batch in self.batches(jobs) if jobs else []:
+                    task = asyncio.create_task(self.deliver(batch))
+                    self._deliveries.add(task)
+                    task.add_done_callback(self.delivery_done)
+                if len(jobs) == limit:
+                    # There may be more; claim again as soon as a slot frees up
+                    continue
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            if self._notified:
+                self._notified = False
+                await asyncio.sleep(self.batch_window)
+
+    def delivery_done(self, task: asyncio.Task):
+        self._deliveries.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Email delivery failed", exc_info=task.exception())
+        # A slot is free; no need to wait for a batch to fill
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+
+async def dead_letters(limit: int = 100) -> list:
+    query = (
+        email_outbox_table.select()
+        .where(email_outbox_table.c.status == "dead")
+        .order_by(email_outbox_table.c.id)
+        .limit(limit)
+    )
+    return await database.fetch_all(query)
+
+
+async def requeue_dead_letters() -> int:
+    """Give every dead email a fresh set of attempts. Returns how many were requeued."""
+    query = (
+        email_outbox_table.update()
+        .where(email_outbox_table.c.status == "dead")
+        .values(status="pending", attempts=0, next_attempt_at=time.time())
+        .returning(email_outbox_table.c.id)
     )
+    return len(await database.fetch_all(query))
+
+
+email_outbox = EmailOutbox(
+    workers=config.MAIL_WORKERS,
+    max_attempts=config.MAIL_MAX_ATTEMPTS,
+    base_delay=config.MAIL_RETRY_BASE_DELAY,
+    max_delay=config.MAIL_RETRY_MAX_DELAY,
+    poll_interval=config.MAIL_POLL_INTERVAL,
+    lease_seconds=config.MAIL_LEASE_SECONDS,
+    batch_size=config.MAIL_BATCH_SIZE,
+    batch_window=config.MAIL_BATCH_WINDOW,
+)
@@ -1,14 +1,24 @@
 import os
-from typing import AsyncGenerator, Generator
-from unittest.mock import Mock, AsyncMock
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import AsyncGenerator, Callable, Generator
+from urllib.parse import parse_qs
 
 import pytest
+from databases.backends.sqlite import SQLiteConnection
 from fastapi.testclient import TestClient
-from httpx import AsyncClient, Request, Response
+from httpx import AsyncClient
 
 os.environ["ENV_STATE"] = "test"
-from storeapi.database import database, user_table  # noqa: E402
+from storeapi import instrumentation  # noqa: E402
+from storeapi.config import config  # noqa: E402
+from storeapi.database import database, engine, user_table  # noqa: E402
 from storeapi.main import app  # noqa: E402
+from storeapi.migrations import migrate  # noqa: E402
+from storeapi.routers.post import response_cache  # noqa: E402
+from storeapi.search import MemoryIndex, search_index  # noqa: E402
+from storeapi.security import revoked_tokens, token_cache, user_cache  # noqa: E402
+from storeapi.tasks import close_http_client  # noqa: E402
 
 
 @pytest.fixture(scope="session")
@@ -16,6 +26,26 @@ def anyio_backend():
     return "asyncio"
 
 
+@pytest.fixture(scope="session", autouse=True)
+def migrated_db():
+    migrate(engine)
+
+
+class FakeTimer:
+    """A clock for the timer parameters, moved on by setting `now`."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture()
+def fake_timer() -> FakeTimer:
+    return FakeTimer()
+
+
 @pytest.fixture()
 def client() -> Generator:
     yield TestClient(app)
@@ -28,6 +58,29 @@ async def db() -> AsyncGenerator:
     await database.disconnect()
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Cached rows would outlive the rolled back database between tests."""
+    user_cache.clear()
+    token_cache.clear()
+    revoked_tokens.clear()
+    response_cache.clear()
+    if isinstance(search_index, MemoryIndex):
+        search_index.clear()
+
+
+@pytest.fixture()
+def count_queries(mocker) -> Callable[[], int]:
+    """Returns a function giving the number of statements sent to the database so far."""
+    spies = [
+        mocker.spy(SQLiteConnection, name)
+        for name in ("fetch_all", "fetch_one", "execute", "execute_many", "iterate")
+    ]
+    # InstrumentedDatabase.iterate_values reads the cursor itself
+    spies.append(mocker.spy(instrumentation, "sqlite_values"))
+    return lambda: sum(spy.call_count for spy in spies)
+
+
 @pytest.fixture()
 async def async_client(client) -> AsyncGenerator:
     async with AsyncClient(app=app, base_url=client.base_url) as ac:
@@ -64,17 +117,70 @@ async def logged_in_token(async_client: AsyncClient, confirmed_user: dict) -> st
     return response.json()["access_token"]
 
 
-@pytest.fixture(autouse=True)
-def mock_httpx_client(mocker):
-    """
-    Fixture to mock the HTTPX client so that we never make any
-    real HTTP requests (especially important when registering users).
+class StubMailgun(ThreadingHTTPServer):
+    """Local stand-in for the Mailgun API.
+
+    Records every request and answers with the next status in `statuses`
+    (200 once they run out).
     """
-    mocked_client = mocker.patch("storeapi.tasks.httpx.AsyncClient")
 
-    mocked_async_client = Mock()
-    response = Response(status_code=200, content="", request=Request("POST", "//"))
-    mocked_async_client.post = AsyncMock(return_value=response)
-    mocked_client.return_value.__aenter__.return_value = mocked_async_client
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), StubMailgunHandler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        self.requests: list[dict] = []
+        self.statuses: list[int] = []
+        self.connections = 0
+
+    def reset(self) -> None:
+        self.requests.clear()
+        self.statuses.clear()
+        self.connections = 0
+
+
+class StubMailgunHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: StubMailgun
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.connections += 1
+
+    def do_POST(self) -> None:
+        length = int(self.headers["Content-Length"])
+        self.server.requests.append({
+            "path": self.path,
+            "authorization": self.headers["Authorization"],
+            "form": parse_qs(self.rfile.read(length).decode()),
+        })
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        body = b'{"id": "<stub@mailgun>", "message": "Queued. Thank you."}'
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
 
-    return mocked_async_client
+
+@pytest.fixture(scope="session")
+def mailgun_server() -> Generator[StubMailgun, None, None]:
+    server = StubMailgun()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+async def mailgun(mailgun_server: StubMailgun, monkeypatch) -> AsyncGenerator[StubMailgun, None]:
+    """Point every Mailgun call at the local stub, so tests never send real email."""
+    monkeypatch.setattr(config, "MAILGUN_BASE_URL", mailgun_server.url)
+    monkeypatch.setattr(config, "MAILGUN_DOMAIN", "test.example.com")
+    monkeypatch.setattr(config, "MAILGUN_API_KEY", "test-key")
+    mailgun_server.reset()
+    yield mailgun_server
+    # The shared client belongs to this test's event loop
+    await close_http_client()
@@ -0,0 +1,84 @@
+import pytest
+from httpx import AsyncClient
+
+from storeapi.config import config
+from storeapi.database import database
+
+
+@pytest.fixture(autouse=True)
+def internal_routes(monkeypatch):
+    monkeypatch.setattr(config, "INTERNAL_ROUTES_ENABLED", True)
+    monkeypatch.setattr(config, "INTERNAL_ROUTES_TOKEN", None)
+
+
+@pytest.mark.anyio
+async def test_query_metrics(async_client: AsyncClient):
+    database.reset_metrics()
+    await async_client.get("/post")
+
+    response = await async_client.get("/internal/metrics/queries")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["slow_queries"] == []
+    [listing] = [entry for entry in body["queries"] if entry["sql"].startswith("SELECT posts.body, posts.id")]
+    assert listing["count"] == 1
+    assert set(listing) >= {"count", "sum", "buckets", "p50", "p95", "p99"}
+
+
+@pytest.mark.anyio
+async def test_internal_routes_not_in_schema(async_client: AsyncClient):
+    response = await async_client.get("/openapi.json")
+
+    assert not any(path.startswith("/internal") for path in response.json()["paths"])
+
+
+@pytest.mark.anyio
+async def test_metrics_exposition(async_client: AsyncClient):
+    await async_client.get("/post")
+    await async_client.get("/post/999")
+
+    response = await async_client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert 'storeapi_http_requests_total{method="GET",route="/post/{post_id}",status="404"}' in text
+    assert 'storeapi_http_request_duration_seconds_count{method="GET",route="/post"}' in text
+    assert "storeapi_http_requests_in_flight 1" in text
+    assert 'storeapi_db_query_duration_seconds_count{database="primary",statement="SELECT"}' in text
+    assert 'storeapi_cache_hits_total{cache="response"}' in text
+    assert "storeapi_password_hash_rejected_total 0" in text
+
+
+@pytest.mark.anyio
+async def test_unmatched_routes_share_a_series(async_client: AsyncClient):
+    await async_client.get("/no/such/path/1")
+    await async_client.get("/no/such/path/2")
+
+    response = await async_client.get("/metrics")
+
+    assert 'route="<unmatched>",status="404"' in response.text
+    assert "/no/such/path" not in response.text
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("path", ["/metrics", "/internal/metrics/queries"])
+async def test_internal_routes_off_by_default(async_client: AsyncClient, monkeypatch, path: str):
+    monkeypatch.setattr(config, "INTERNAL_ROUTES_ENABLED", False)
+
+    response = await async_client.get(path)
+
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("path", ["/metrics", "/internal/metrics/queries"])
+async def test_internal_routes_token(async_client: AsyncClient, monkeypatch, path: str):
+    monkeypatch.setattr(config, "INTERNAL_ROUTES_TOKEN", "s3cret")
+
+    assert (await async_client.get(path)).status_code == 401
+    response = await async_client.get(path, headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == 401
+    response = await async_client.get(path, headers={"Authorization": "Bearer s3cret"})
+    assert response.status_code == 200
@@ -1,7 +1,14 @@
+import json
+
 import pytest
 from httpx import AsyncClient
 from fastapi import status
 
+from storeapi.config import config
+from storeapi.database import database
+from storeapi.pagination import encode_cursor
+from storeapi.routers.post import PostSorting, like_counter, response_cache, select_posts
+
 
 async def create_post(body: str, asyn_client: AsyncClient, logged_in_token: str) -> dict:
     response = await asyn_client.post(
@@ -179,3 +186,484 @@ async def test_like_post(async_client: AsyncClient, created_post: dict, register
                "post_id": post_id,
                "user_id": registered_user["id"]
            }.items() <= response.json().items()
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "sorting,pages",
+    [
+        ("new", [[3, 2], [1]]),
+        ("old", [[1, 2], [3]]),
+        ("most_likes", [[2, 3], [1]]),
+    ]
+)
+async def test_get_all_posts_paginated(async_client: AsyncClient, logged_in_token: str, sorting: str,
+                                       pages: list[list[int]]):
+    for body in ("Demo 1", "Demo 2", "Demo 3"):
+        await create_post(body, async_client, logged_in_token)
+    await like_post(2, async_client, logged_in_token)
+
+    params = {"sorting": sorting, "limit": 2}
+    res = await async_client.get("/post", params=params)
+    assert [p["id"] for p in res.json()] == pages[0]
+
+    cursor = res.headers["X-Next-Cursor"]
+    res = await async_client.get("/post", params={**params, "cursor": cursor})
+    assert [p["id"] for p in res.json()] == pages[1]
+    assert "X-Next-Cursor" not in res.headers
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_invalid_cursor(async_client: AsyncClient):
+    res = await async_client.get("/post", params={"cursor": "not-a-cursor"})
+    assert res.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_cursor_wrong_sorting(async_client: AsyncClient, logged_in_token: str):
+    await create_post("Demo 1", async_client, logged_in_token)
+    await create_post("Demo 2", async_client, logged_in_token)
+    res = await async_client.get("/post", params={"sorting": "new", "limit": 1})
+
+    cursor = res.headers["X-Next-Cursor"]
+    res = await async_client.get("/post", params={"sorting": "most_likes", "cursor": cursor})
+    assert res.status_code == 400
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("sorting, key", [
+    ("new", {"id": True}),
+    ("new", {"id": 10 ** 30}),
+    ("old", {"id": -10 ** 30}),
+    ("most_likes", {"likes": False, "id": 1}),
+    ("most_likes", {"likes": 1, "id": 2 ** 63}),
+])
+async def test_get_all_posts_cursor_not_int64(async_client: AsyncClient, sorting: str, key: dict):
+    cursor = encode_cursor({"sort": sorting, **key})
+    res = await async_client.get("/post", params={"sorting": sorting, "cursor": cursor})
+    assert res.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_limit_too_large(async_client: AsyncClient):
+    res = await async_client.get("/post", params={"limit": 1000})
+    assert res.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.anyio
+async def test_like_post_twice(async_client: AsyncClient, created_post: dict, logged_in_token: str):
+    await like_post(created_post["id"], async_client, logged_in_token)
+    response = await async_client.post(
+        "/like",
+        json={"post_id": created_post["id"]},
+        headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    assert response.status_code == 409
+    res = await async_client.get(f"/post/{created_post['id']}")
+    assert res.json()["post"]["likes"] == 1
+
+
+@pytest.mark.anyio
+async def test_create_posts_batch(async_client: AsyncClient, confirmed_user: dict, logged_in_token: str):
+    response = await async_client.post(
+        "/post/batch",
+        json=[{"body": "Demo 1"}, {"body": "Demo 2"}],
+        headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    assert response.status_code == 200
+    assert [r["item"] for r in response.json()] == [
+        {"id": 1, "body": "Demo 1", "user_id": confirmed_user["id"]},
+        {"id": 2, "body": "Demo 2", "user_id": confirmed_user["id"]},
+    ]
+
+
+@pytest.mark.anyio
+async def test_create_posts_batch_empty(async_client: AsyncClient, logged_in_token: str):
+    response = await async_client.post(
+        "/post/batch", json=[], headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+    assert response.status_code == 422
+
+
+@pytest.mark.anyio
+async def test_create_comments_batch(async_client: AsyncClient, created_post: dict, logged_in_token: str):
+    response = await async_client.post(
+        "/comment/batch",
+        json=[
+            {"body": "Comment 1", "post_id": created_post["id"]},
+            {"body": "Comment 2", "post_id": -1},
+            {"body": "Comment 3", "post_id": created_post["id"]},
+        ],
+        headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    results = response.json()
+    assert [r["status_code"] for r in results] == [201, 404, 201]
+    assert [results[0]["item"]["body"], results[2]["item"]["body"]] == ["Comment 1", "Comment 3"]
+
+    res = await async_client.get(f"/post/{created_post['id']}/comment")
+    assert res.json() == [results[0]["item"], results[2]["item"]]
+
+
+@pytest.mark.anyio
+async def test_like_posts_batch(async_client: AsyncClient, logged_in_token: str):
+    first = await create_post("Demo 1", async_client, logged_in_token)
+    second = await create_post("Demo 2", async_client, logged_in_token)
+    await like_post(first["id"], async_client, logged_in_token)
+
+    response = await async_client.post(
+        "/like/batch",
+        json=[{"post_id": first["id"]}, {"post_id": second["id"]}, {"post_id": second["id"]}, {"post_id": -1}],
+        headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    assert [r["status_code"] for r in response.json()] == [409, 201, 409, 404]
+    res = await async_client.get("/post", params={"sorting": "old"})
+    assert [p["likes"] for p in res.json()] == [1, 1]
+
+
+@pytest.mark.anyio
+async def test_create_comment_no_post(async_client: AsyncClient, logged_in_token: str):
+    response = await async_client.post(
+        "/comment",
+        json={"body": "The Comment", "post_id": -1},
+        headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_like_post_no_post(async_client: AsyncClient, logged_in_token: str):
+    response = await async_client.post(
+        "/like",
+        json={"post_id": -1},
+        headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_get_all_post_comments_no_comments(async_client: AsyncClient, created_post: dict):
+    res = await async_client.get(f"/post/{created_post['id']}/comment")
+
+    assert res.status_code == 200
+    assert res.json() == []
+
+
+# Query counts assume the current user is already cached, which the
+# created_post fixture's authenticated request takes care of.
+@pytest.mark.anyio
+async def test_get_all_posts_query_count(async_client: AsyncClient, created_post: dict, count_queries):
+    before = count_queries()
+    await async_client.get("/post")
+    assert count_queries() - before == 1
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_with_comments_query_count(async_client: AsyncClient, created_comment: dict,
+                                                       count_queries):
+    before = count_queries()
+    await async_client.get("/post", params={"include": "comments"})
+    assert count_queries() - before == 2
+
+
+@pytest.mark.anyio
+async def test_get_post_comments_query_count(async_client: AsyncClient, created_comment: dict, count_queries):
+    before = count_queries()
+    await async_client.get(f"/post/{created_comment['post_id']}/comment")
+    assert count_queries() - before == 1
+
+
+@pytest.mark.anyio
+async def test_get_post_with_comments_query_count(async_client: AsyncClient, created_comment: dict,
+                                                  count_queries):
+    before = count_queries()
+    await async_client.get(f"/post/{created_comment['post_id']}")
+    assert count_queries() - before == 2
+
+
+@pytest.mark.anyio
+async def test_create_comment_query_count(async_client: AsyncClient, created_post: dict, logged_in_token: str,
+                                          count_queries):
+    before = count_queries()
+    await create_comment("The Comment", created_post["id"], async_client, logged_in_token)
+    assert count_queries() - before == 1
+
+
+@pytest.mark.anyio
+async def test_like_post_query_count(async_client: AsyncClient, created_post: dict, logged_in_token: str,
+                                     count_queries):
+    before = count_queries()
+    await like_post(created_post["id"], async_client, logged_in_token)
+    assert count_queries() - before == 2
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_ndjson(async_client: AsyncClient, logged_in_token: str):
+    for index in range(25):
+        await create_post(f"Demo {index}", async_client, logged_in_token)
+
+    res = await async_client.get("/post", params={"sorting": "old", "format": "ndjson"})
+
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "application/x-ndjson"
+    posts = [json.loads(line) for line in res.text.splitlines()]
+    assert [p["id"] for p in posts] == list(range(1, 26))
+    assert posts[0] == {"id": 1, "body": "Demo 0", "user_id": posts[0]["user_id"], "likes": 0}
+
+
+@pytest.mark.anyio
+async def test_get_post_comments_ndjson(async_client: AsyncClient, created_post: dict, created_comment: dict):
+    res = await async_client.get(f"/post/{created_post['id']}/comment", params={"format": "ndjson"})
+
+    assert res.status_code == 200
+    assert [json.loads(line) for line in res.text.splitlines()] == [created_comment]
+
+
+@pytest.mark.anyio
+async def test_get_post_comments_ndjson_no_post(async_client: AsyncClient):
+    res = await async_client.get("/post/-1/comment", params={"format": "ndjson"})
+    assert res.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_cached(async_client: AsyncClient, created_post: dict, count_queries):
+    await async_client.get("/post")
+    before = count_queries()
+    res = await async_client.get("/post")
+
+    assert count_queries() == before
+    assert res.json() == [{**created_post, "likes": 0}]
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_not_modified(async_client: AsyncClient, created_post: dict):
+    res = await async_client.get("/post")
+    etag = res.headers["ETag"]
+
+    res = await async_client.get("/post", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.content == b""
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("sorting", ["new", "most_likes"])
+async def test_get_all_posts_cache_invalidated_by_writes(async_client: AsyncClient, created_post: dict,
+                                                         logged_in_token: str, sorting: str):
+    params = {"sorting": sorting}
+    await async_client.get("/post", params=params)
+
+    await like_post(created_post["id"], async_client, logged_in_token)
+    res = await async_client.get("/post", params=params)
+    assert [p["likes"] for p in res.json()] == [1]
+
+    await create_post("Demo 2", async_client, logged_in_token)
+    res = await async_client.get("/post", params=params)
+    assert len(res.json()) == 2
+
+
+@pytest.mark.anyio
+async def test_get_post_with_comments_cache_invalidated_by_comment(async_client: AsyncClient, created_post: dict,
+                                                                   logged_in_token: str):
+    res = await async_client.get(f"/post/{created_post['id']}")
+    etag = res.headers["ETag"]
+
+    comment = await create_comment("The Comment", created_post["id"], async_client, logged_in_token)
+    res = await async_client.get(f"/post/{created_post['id']}", headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.json()["comments"] == [comment]
+
+
+@pytest.mark.anyio
+async def test_comment_keeps_post_list_cached(async_client: AsyncClient, created_post: dict,
+                                              logged_in_token: str, count_queries):
+    await async_client.get("/post")
+    await create_comment("The Comment", created_post["id"], async_client, logged_in_token)
+
+    before = count_queries()
+    await async_client.get("/post")
+    assert count_queries() == before
+
+
+@pytest.mark.anyio
+async def test_fast_json_responses_are_byte_identical(
+        async_client: AsyncClient, logged_in_token: str, monkeypatch
+):
+    post = await create_post('Fast "json" é 😀', async_client, logged_in_token)
+    for body in ("First\ncomment", "Second </script>"):
+        await create_comment(body, post["id"], async_client, logged_in_token)
+    await like_post(post["id"], async_client, logged_in_token)
+    urls = [
+        "/post",
+        "/post?sorting=most_likes",
+        "/post?format=ndjson",
+        "/post?include=comments",
+        f"/post/{post['id']}",
+        f"/post/{post['id']}/comment",
+        f"/post/{post['id']}/comment?format=ndjson",
+    ]
+
+    async def responses() -> list[tuple]:
+        response_cache.clear()
+        results = []
+        for url in urls:
+            response = await async_client.get(url)
+            results.append((response.status_code, response.headers["content-type"], response.content))
+        return results
+
+    expected = await responses()
+    monkeypatch.setattr(config, "FAST_JSON_RESPONSES", True)
+    assert await responses() == expected
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_include_comments(async_client: AsyncClient, logged_in_token: str):
+    first = await create_post("First", async_client, logged_in_token)
+    second = await create_post("Second", async_client, logged_in_token)
+    comments = [
+        await create_comment(f"Comment {index}", first["id"], async_client, logged_in_token)
+        for index in range(3)
+    ]
+
+    res = await async_client.get("/post", params={"include": "comments", "comment_limit": 2})
+
+    assert res.status_code == 200
+    assert res.json() == [
+        {"post": {**second, "likes": 0}, "comments": []},
+        {"post": {**first, "likes": 0}, "comments": comments[:2]},
+    ]
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_include_comments_only_for_the_page(
+        async_client: AsyncClient, logged_in_token: str
+):
+    first = await create_post("First", async_client, logged_in_token)
+    second = await create_post("Second", async_client, logged_in_token)
+    await create_comment("On the first", first["id"], async_client, logged_in_token)
+    comment = await create_comment("On the second", second["id"], async_client, logged_in_token)
+
+    res = await async_client.get("/post", params={"include": "comments", "limit": 1})
+
+    assert res.json() == [{"post": {**second, "likes": 0}, "comments": [comment]}]
+    assert "X-Next-Cursor" in res.headers
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_include_comments_sees_new_comments(
+        async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    await async_client.get("/post", params={"include": "comments"})
+    comment = await create_comment("The Comment", created_post["id"], async_client, logged_in_token)
+
+    res = await async_client.get("/post", params={"include": "comments"})
+
+    assert res.json()[0]["comments"] == [comment]
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_include_comments_not_with_ndjson(async_client: AsyncClient):
+    res = await async_client.get("/post", params={"include": "comments", "format": "ndjson"})
+
+    assert res.status_code == 400
+
+
+@pytest.fixture()
+def buffered_likes(monkeypatch):
+    monkeypatch.setattr(config, "BUFFERED_LIKES", True)
+    yield
+    like_counter.pending.clear()
+    like_counter.unflushed = 0
+
+
+@pytest.mark.anyio
+async def test_buffered_like_counted_after_fold(async_client: AsyncClient, created_post: dict,
+                                                logged_in_token: str, buffered_likes):
+    response = await async_client.post(
+        "/like",
+        json={"post_id": created_post["id"]},
+        headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+    assert response.status_code == 201
+    res = await async_client.get(f"/post/{created_post['id']}")
+    assert res.json()["post"]["likes"] == 0
+
+    assert await like_counter.flush() == 1
+    res = await async_client.get(f"/post/{created_post['id']}")
+    assert res.json()["post"]["likes"] == 0
+
+    assert await like_counter.fold() == 1
+
+    res = await async_client.get(f"/post/{created_post['id']}")
+    assert res.json()["post"]["likes"] == 1
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("post_id, status_code", [(None, 409), (-1, 404)])
+async def test_buffered_like_rejected(async_client: AsyncClient, created_post: dict, logged_in_token: str,
+                                      buffered_likes, post_id: int | None, status_code: int):
+    await like_post(created_post["id"], async_client, logged_in_token)
+    response = await async_client.post(
+        "/like",
+        json={"post_id": post_id or created_post["id"]},
+        headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    assert response.status_code == status_code
+    assert like_counter.unflushed == 1
+
+
+@pytest.mark.anyio
+async def test_buffered_like_query_count(async_client: AsyncClient, created_post: dict, logged_in_token: str,
+                                         buffered_likes, count_queries):
+    before = count_queries()
+    await like_post(created_post["id"], async_client, logged_in_token)
+    assert count_queries() - before == 1
+
+
+@pytest.mark.anyio
+async def test_buffered_like_posts_batch(async_client: AsyncClient, logged_in_token: str, buffered_likes):
+    first = await create_post("Demo 1", async_client, logged_in_token)
+    second = await create_post("Demo 2", async_client, logged_in_token)
+    await like_post(first["id"], async_client, logged_in_token)
+
+    response = await async_client.post(
+        "/like/batch",
+        json=[{"post_id": first["id"]}, {"post_id": second["id"]}, {"post_id": -1}],
+        headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+    await like_counter.flush()
+    await like_counter.fold()
+
+    assert [r["status_code"] for r in response.json()] == [409, 201, 404]
+    res = await async_client.get("/post", params={"sorting": "old"})
+    assert [p["likes"] for p in res.json()] == [1, 1]
+
+
+@pytest.mark.anyio
+async def test_buffered_likes_most_likes_paginated(async_client: AsyncClient, logged_in_token: str,
+                                                   buffered_likes):
+    for body in ("Demo 1", "Demo 2", "Demo 3"):
+        await create_post(body, async_client, logged_in_token)
+    await like_post(2, async_client, logged_in_token)
+    await like_counter.flush()
+    await like_counter.fold()
+
+    params = {"sorting": "most_likes", "limit": 2}
+    res = await async_client.get("/post", params=params)
+    assert [(p["id"], p["likes"]) for p in res.json()] == [(2, 1), (3, 0)]
+
+    res = await async_client.get("/post", params={**params, "cursor": res.headers["X-Next-Cursor"]})
+    assert [p["id"] for p in res.json()] == [1]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("key", [None, {"likes": 1, "id": 2}])
+async def test_buffered_likes_most_likes_uses_index(buffered_likes, key: dict | None):
+    plan = await database.explain(select_posts(PostSorting.most_likes, key).limit(10), None)
+
+    assert any("ix_posts_likes_id" in line for line in plan)
+    assert not any("TEMP B-TREE" in line for line in plan)
+    assert not any("SUBQUERY" in line for line in plan)
@@ -0,0 +1,123 @@
+import pytest
+import sqlalchemy
+from httpx import AsyncClient
+
+from storeapi.database import database, metadata, post_table, user_table
+from storeapi.instrumentation import InstrumentedDatabase
+from storeapi.main import app
+from storeapi.replicas import STICKY_COOKIE, ReplicaSet
+from storeapi.routers.post import response_cache
+from storeapi.security import create_confirmation_token, get_password_hash
+
+
+@pytest.fixture()
+async def replica(tmp_path, monkeypatch) -> InstrumentedDatabase:
+    """A replica holding one post the primary does not have, routed to by every read."""
+    url = f"sqlite:///{tmp_path}/replica.db"
+    engine = sqlalchemy.create_engine(url)
+    metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(user_table.insert().values(id=1, email="replica@test.com"))
+        connection.execute(post_table.insert().values(id=1, body="On the replica", user_id=1))
+    engine.dispose()
+
+    replica = InstrumentedDatabase(url)
+    await replica.connect()
+    replicas = ReplicaSet(database, [replica])
+    monkeypatch.setattr("storeapi.routers.post.replicas", replicas)
+    monkeypatch.setattr("storeapi.security.replicas", replicas)
+    yield replica
+    await replica.disconnect()
+
+
+@pytest.mark.anyio
+async def test_reads_go_to_replica(async_client: AsyncClient, replica):
+    response = await async_client.get("/post")
+    assert [post["body"] for post in response.json()] == ["On the replica"]
+
+    response = await async_client.get("/post/1")
+    assert response.json()["post"]["body"] == "On the replica"
+
+    response = await async_client.get("/post/1/comment")
+    assert response.json() == []
+
+
+@pytest.mark.anyio
+async def test_reads_after_write_go_to_primary(
+        async_client: AsyncClient, replica, logged_in_token: str
+):
+    await async_client.post(
+        "/post", json={"body": "On the primary"},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+
+    assert STICKY_COOKIE in async_client.cookies
+
+    response = await async_client.get("/post")
+    assert [post["body"] for post in response.json()] == ["On the primary"]
+
+
+@pytest.mark.anyio
+async def test_other_clients_read_replica_after_write(
+        async_client: AsyncClient, replica, logged_in_token: str
+):
+    await async_client.post(
+        "/post", json={"body": "On the primary"},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+
+    # A client of its own, without the cookie the write set
+    async with AsyncClient(app=app, base_url=async_client.base_url) as other:
+        response = await other.get("/post")
+    assert [post["body"] for post in response.json()] == ["On the replica"]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("path, body", [
+    ("/post", lambda response: [post["body"] for post in response.json()]),
+    ("/post/1", lambda response: [response.json()["post"]["body"]]),
+])
+async def test_writer_not_served_replica_page_cached_by_other_client(
+        async_client: AsyncClient, replica, logged_in_token: str, path: str, body
+):
+    headers = {"Authorization": f"Bearer {logged_in_token}"}
+    await async_client.post("/post", json={"body": "On the primary"}, headers=headers)
+    await async_client.post("/comment", json={"body": "Comment", "post_id": 1}, headers=headers)
+    async with AsyncClient(app=app, base_url=async_client.base_url) as other:
+        assert body(await other.get(path)) == ["On the replica"]
+        # Not cached: the replica may not have caught up with the write yet
+        assert body(await other.get(path)) == ["On the replica"]
+        assert response_cache.get(("post-list", "new", 20, None, None, None)) is None
+        assert response_cache.get(("post:1",)) is None
+
+    assert body(await async_client.get(path)) == ["On the primary"]
+
+
+@pytest.mark.anyio
+async def test_login_after_confirm_reads_primary(async_client: AsyncClient, replica):
+    # Written straight to the primary, so nothing pins this user to it yet
+    await database.execute(
+        user_table.insert().values(email="new@test.com", password=get_password_hash("12345"))
+    )
+    login = {"username": "new@test.com", "password": "12345"}
+
+    response = await async_client.post("/token", data=login)
+    assert response.status_code == 401
+
+    await async_client.get(f"/confirm/{create_confirmation_token('new@test.com')}")
+
+    response = await async_client.post("/token", data=login)
+    assert response.status_code == 200
+
+
+@pytest.mark.anyio
+async def test_login_from_other_client_after_confirm_reads_primary(async_client: AsyncClient, replica):
+    await database.execute(
+        user_table.insert().values(email="new@test.com", password=get_password_hash("12345"))
+    )
+    await async_client.get(f"/confirm/{create_confirmation_token('new@test.com')}")
+
+    # Not the client that opened the confirmation link, so without its cookie
+    async with AsyncClient(app=app, base_url=async_client.base_url) as other:
+        response = await other.post("/token", data={"username": "new@test.com", "password": "12345"})
+    assert response.status_code == 200
@@ -0,0 +1,126 @@
+import pytest
+from httpx import AsyncClient
+
+from storeapi.pagination import encode_cursor
+from storeapi.routers import post as post_router
+from storeapi.routers import search as search_router
+from storeapi.search import MemoryIndex, search_index
+from storeapi.tests.routers.test_post import create_comment, create_post
+
+
+@pytest.fixture(params=["fts5", "memory"])
+def index(request, monkeypatch):
+    """Runs a test against each search backend."""
+    if request.param == "memory":
+        memory_index = MemoryIndex()
+        monkeypatch.setattr(post_router, "search_index", memory_index)
+        monkeypatch.setattr(search_router, "search_index", memory_index)
+        return memory_index
+    if search_index.backend != "fts5":
+        pytest.skip("SQLite was built without FTS5")
+    return search_index
+
+
+async def search(async_client: AsyncClient, q: str, **params):
+    return await async_client.get("/search", params={"q": q, **params})
+
+
+@pytest.mark.anyio
+async def test_search_finds_posts_and_comments(async_client: AsyncClient, index, logged_in_token: str):
+    post = await create_post("Fresh sourdough bread", async_client, logged_in_token)
+    await create_post("Cheap flights", async_client, logged_in_token)
+    comment = await create_comment("More BREAD please", post["id"], async_client, logged_in_token)
+
+    response = await search(async_client, "bread")
+
+    assert response.status_code == 200
+    hits = {(hit["kind"], hit["id"]): hit for hit in response.json()}
+    assert set(hits) == {("post", post["id"]), ("comment", comment["id"])}
+    assert hits["comment", comment["id"]]["post_id"] == post["id"]
+    assert hits["comment", comment["id"]]["body"] == "More BREAD please"
+
+
+@pytest.mark.anyio
+async def test_search_requires_every_term(async_client: AsyncClient, index, logged_in_token: str):
+    both = await create_post("red apple", async_client, logged_in_token)
+    await create_post("red car", async_client, logged_in_token)
+
+    response = await search(async_client, "Apple, red!")
+
+    assert [hit["id"] for hit in response.json()] == [both["id"]]
+
+
+@pytest.mark.anyio
+async def test_search_ranks_by_relevance(async_client: AsyncClient, index, logged_in_token: str):
+    await create_post("a long post that mentions cats once among many other words", async_client,
+                      logged_in_token)
+    best = await create_post("cats cats cats", async_client, logged_in_token)
+    await create_post("dogs", async_client, logged_in_token)
+
+    hits = (await search(async_client, "cats")).json()
+
+    assert hits[0]["id"] == best["id"]
+    assert hits[0]["score"] > hits[1]["score"]
+
+
+@pytest.mark.anyio
+async def test_search_paginates(async_client: AsyncClient, index, logged_in_token: str):
+    for i in range(5):
+        await create_post(f"pagination test {i}", async_client, logged_in_token)
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = await search(async_client, "pagination", **params)
+        seen += [hit["id"] for hit in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert len(seen) == 5
+    assert len(set(seen)) == 5
+
+
+@pytest.mark.anyio
+async def test_search_batch_endpoints(async_client: AsyncClient, index, logged_in_token: str):
+    headers = {"Authorization": f"Bearer {logged_in_token}"}
+    response = await async_client.post(
+        "/post/batch", json=[{"body": "batched alpha"}, {"body": "batched beta"}], headers=headers
+    )
+    post_id = response.json()[0]["item"]["id"]
+    await async_client.post(
+        "/comment/batch", json=[{"body": "batched gamma", "post_id": post_id}], headers=headers
+    )
+
+    hits = (await search(async_client, "batched")).json()
+
+    assert sorted(hit["kind"] for hit in hits) == ["comment", "post", "post"]
+
+
+@pytest.mark.anyio
+async def test_search_without_terms(async_client: AsyncClient):
+    response = await search(async_client, "!!!")
+
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+@pytest.mark.anyio
+async def test_search_cursor_must_match_query(async_client: AsyncClient, index, logged_in_token: str):
+    for i in range(3):
+        await create_post(f"cursor test {i}", async_client, logged_in_token)
+    cursor = (await search(async_client, "cursor", limit=1)).headers["X-Next-Cursor"]
+
+    assert (await search(async_client, "test", cursor=cursor)).status_code == 400
+    assert (await search(async_client, "cursor", cursor="not-a-cursor")).status_code == 400
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("offset", [True, 10 ** 30, -1, 1.5])
+async def test_search_cursor_offset_not_int64(async_client: AsyncClient, index, logged_in_token: str,
+                                              offset):
+    await create_post("cursor test", async_client, logged_in_token)
+    cursor = encode_cursor({"q": "cursor", "offset": offset})
+
+    assert (await search(async_client, "cursor", cursor=cursor)).status_code == 400
@@ -1,7 +1,12 @@
+import json
+
 import pytest
 from fastapi import status, Request
 from httpx import AsyncClient
 
+from storeapi import security
+from storeapi.database import database, email_outbox_table
+
 
 async def register_user(async_client: AsyncClient, email: str, password: str):
     return await async_client.post(
@@ -17,6 +22,19 @@ async def test_register(async_client: AsyncClient):
     assert response.status_code == status.HTTP_201_CREATED
 
 
+@pytest.mark.anyio
+async def test_register_queues_confirmation_email(async_client: AsyncClient, mailgun):
+    await register_user(async_client, "maun@test.com", "12345")
+
+    [email] = await database.fetch_all(email_outbox_table.select())
+    assert email.recipient == "maun@test.com"
+    assert email.status == "pending"
+    assert "%recipient.confirmation_url%" in email.body
+    assert "/confirm/" in json.loads(email.variables)["confirmation_url"]
+    # Delivery happens in the background, not during the request
+    assert mailgun.requests == []
+
+
 @pytest.mark.anyio
 async def test_register_exits(async_client: AsyncClient, registered_user: dict):
     response = await register_user(async_client, registered_user["email"], registered_user["password"])
@@ -76,3 +94,28 @@ async def test_login_user(async_client: AsyncClient, confirmed_user: dict):
         },
     )
     assert response.status_code == 200
+
+
+@pytest.mark.anyio
+async def test_confirm_user_invalidates_cached_user(async_client: AsyncClient, mocker):
+    spy = mocker.spy(Request, "url_for")
+    await register_user(async_client, "maun@test.com", "12345")
+    security.user_cache.set("maun@test.com", {"confirmed": False})
+
+    await async_client.get(str(spy.spy_return))
+
+    assert security.user_cache.get("maun@test.com") is None
+
+
+@pytest.mark.anyio
+async def test_login_user_hash_pool_saturated(async_client: AsyncClient, confirmed_user: dict, mocker):
+    mocker.patch.object(security.password_executor, "queue_limit", 0)
+    response = await async_client.post(
+        "/token",
+        data={
+            "username": confirmed_user["email"],
+            "password": confirmed_user["password"],
+        },
+    )
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == "1"
@@ -0,0 +1,66 @@
+from storeapi.cache import LRUCache
+from storeapi.tests.conftest import FakeTimer
+
+
+def test_lru_cache_get_set():
+    cache = LRUCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_ratio": 0.5}
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_lru_cache_expires_entries(fake_timer: FakeTimer):
+    cache = LRUCache(maxsize=2, ttl=10, timer=fake_timer)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=20)
+    fake_timer.now = 15
+
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert len(cache) == 1
+
+
+def test_lru_cache_delete_and_clear():
+    cache = LRUCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.delete("a")
+    cache.delete("missing")
+
+    assert cache.get("a") is None
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_lru_cache_disabled():
+    cache = LRUCache(maxsize=0, ttl=10)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+
+def test_lru_cache_reports_evictions(fake_timer: FakeTimer):
+    evicted = []
+    cache = LRUCache(maxsize=2, ttl=10, timer=fake_timer)
+    cache.on_evict = evicted.append
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=20)
+    cache.set("c", 3)
+    fake_timer.now = 15
+    cache.get("c")
+    cache.delete("b")
+
+    assert evicted == ["a", "c"]
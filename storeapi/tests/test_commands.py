@@ -0,0 +1,64 @@
+import pytest
+from httpx import AsyncClient
+
+from storeapi import commands
+from storeapi.database import database, like_shard_table, post_table
+from storeapi.search import search_index
+from storeapi.tests.routers.test_post import create_comment, create_post, like_post
+
+
+async def get_likes(post_id: int) -> int:
+    query = post_table.select().where(post_table.c.id == post_id)
+    post = await database.fetch_one(query)
+    return post.likes
+
+
+@pytest.mark.anyio
+async def test_like_post_increments_counter(async_client: AsyncClient, logged_in_token: str):
+    post = await create_post("The Post", async_client, logged_in_token)
+    await like_post(post["id"], async_client, logged_in_token)
+
+    assert await get_likes(post["id"]) == 1
+
+
+@pytest.mark.anyio
+async def test_reconcile_post_likes(async_client: AsyncClient, logged_in_token: str):
+    first = await create_post("Demo 1", async_client, logged_in_token)
+    second = await create_post("Demo 2", async_client, logged_in_token)
+    await like_post(first["id"], async_client, logged_in_token)
+    await database.execute(
+        post_table.update().where(post_table.c.id == first["id"]).values(likes=7)
+    )
+
+    assert await commands.reconcile_post_likes() == 1
+    assert await get_likes(first["id"]) == 1
+    assert await get_likes(second["id"]) == 0
+
+
+@pytest.mark.anyio
+async def test_reconcile_post_likes_folds_shards(async_client: AsyncClient, logged_in_token: str):
+    post = await create_post("The Post", async_client, logged_in_token)
+    await like_post(post["id"], async_client, logged_in_token)
+    await database.execute(like_shard_table.insert().values(post_id=post["id"], shard=0, count=1))
+
+    assert await commands.reconcile_post_likes() == 0
+    assert await get_likes(post["id"]) == 1
+    assert await database.fetch_all(like_shard_table.select()) == []
+
+
+@pytest.mark.anyio
+async def test_reconcile_post_likes_nothing_to_do(async_client: AsyncClient, logged_in_token: str):
+    post = await create_post("The Post", async_client, logged_in_token)
+    await like_post(post["id"], async_client, logged_in_token)
+
+    assert await commands.reconcile_post_likes() == 0
+
+
+@pytest.mark.anyio
+async def test_rebuild_search_index(async_client: AsyncClient, logged_in_token: str):
+    post = await create_post("Searchable", async_client, logged_in_token)
+    await create_comment("Also searchable", post["id"], async_client, logged_in_token)
+
+    assert await commands.rebuild_search_index() == 2
+    hits = await search_index.search(database, ["searchable"], limit=10, offset=0)
+    assert sorted(hit.kind for hit in hits) == ["comment", "post"]
@@ -0,0 +1,67 @@
+import sqlite3
+
+import pytest
+
+from storeapi import database as database_module
+from storeapi.database import (
+    TunedSQLiteConnection,
+    database,
+    database_options,
+    engine,
+    engine_options,
+)
+
+
+@pytest.mark.anyio
+async def test_pragmas_applied_to_async_connections():
+    assert await database.fetch_val("PRAGMA journal_mode") == "wal"
+    assert await database.fetch_val("PRAGMA synchronous") == 1
+    assert await database.fetch_val("PRAGMA busy_timeout") == 5000
+
+
+def test_pragmas_applied_to_engine_connections():
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+
+
+def test_begin_is_immediate(tmp_path):
+    path = str(tmp_path / "locks.db")
+    first = sqlite3.connect(path, isolation_level=None, factory=TunedSQLiteConnection)
+    second = sqlite3.connect(path, isolation_level=None, factory=TunedSQLiteConnection)
+    second.execute("PRAGMA busy_timeout = 0")
+
+    first.execute("BEGIN")
+    # The write lock is taken up front, so a second writer cannot even begin
+    with pytest.raises(sqlite3.OperationalError, match="locked"):
+        second.execute("BEGIN")
+    first.execute("ROLLBACK")
+
+
+def test_begin_deferred_when_disabled(tmp_path, monkeypatch):
+    monkeypatch.setattr(database_module.config, "SQLITE_IMMEDIATE_TRANSACTIONS", False)
+    path = str(tmp_path / "locks.db")
+    first = sqlite3.connect(path, isolation_level=None, factory=TunedSQLiteConnection)
+    second = sqlite3.connect(path, isolation_level=None, factory=TunedSQLiteConnection)
+
+    first.execute("BEGIN")
+    second.execute("BEGIN")
+    first.execute("ROLLBACK")
+    second.execute("ROLLBACK")
+
+
+def test_sqlite_options():
+    assert database_options("sqlite:///test.db")["factory"] is TunedSQLiteConnection
+    connect_args = engine_options("sqlite:///test.db")["connect_args"]
+    assert connect_args["check_same_thread"] is False
+    assert connect_args["factory"] is TunedSQLiteConnection
+
+
+def test_postgres_options():
+    options = database_options("postgresql://user@localhost/storeapi")
+    assert options == {
+        "min_size": 1,
+        "max_size": 10,
+        "timeout": 30.0,
+        "statement_cache_size": 256,
+    }
+    assert engine_options("postgresql://user@localhost/storeapi")["pool_size"] == 10
@@ -0,0 +1,42 @@
+import asyncio
+import threading
+
+import pytest
+
+from storeapi.executors import BoundedExecutor, ExecutorSaturatedError
+
+
+@pytest.fixture()
+def executor():
+    executor = BoundedExecutor(workers=1, queue_limit=1)
+    yield executor
+    executor.shutdown()
+
+
+@pytest.mark.anyio
+async def test_run_uses_worker_thread(executor: BoundedExecutor):
+    name = await executor.run(lambda: threading.current_thread().name)
+    assert name.startswith("storeapi-worker")
+    assert executor.pending == 0
+    assert executor.latency.count == 1
+
+
+@pytest.mark.anyio
+async def test_run_inline_without_workers():
+    executor = BoundedExecutor(workers=0, queue_limit=1)
+    name = await executor.run(lambda: threading.current_thread().name)
+    assert name == threading.current_thread().name
+
+
+@pytest.mark.anyio
+async def test_run_rejects_when_saturated(executor: BoundedExecutor):
+    release = threading.Event()
+    blocked = asyncio.ensure_future(executor.run(release.wait))
+    await asyncio.sleep(0)
+
+    with pytest.raises(ExecutorSaturatedError):
+        await executor.run(lambda: None)
+    assert executor.rejected == 1
+
+    release.set()
+    assert await blocked is True
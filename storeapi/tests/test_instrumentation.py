@@ -0,0 +1,126 @@
+import logging
+
+import pytest
+import sqlalchemy
+from asgi_correlation_id import correlation_id
+
+from storeapi import instrumentation
+from storeapi.database import database, post_table, user_table
+from storeapi.instrumentation import OTHER_SHAPE
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    database.reset_metrics()
+    yield
+    database.reset_metrics()
+
+
+@pytest.fixture()
+def slow_queries(monkeypatch):
+    """Treat every statement as slow."""
+    monkeypatch.setattr(database, "slow_query_ms", 0.0)
+
+
+def query_stats(sql_prefix: str) -> list[dict]:
+    return [
+        stats for stats in database.query_metrics()["queries"]
+        if stats["sql"].startswith(sql_prefix)
+    ]
+
+
+@pytest.mark.anyio
+async def test_queries_grouped_by_shape():
+    await database.fetch_one(post_table.select().where(post_table.c.id == 1))
+    await database.fetch_one(post_table.select().where(post_table.c.id == 2))
+    await database.fetch_all(post_table.select())
+
+    stats = query_stats("SELECT posts.id")
+    assert sorted(entry["count"] for entry in stats) == [1, 2]
+    assert all(entry["sum"] >= 0 for entry in stats)
+
+
+@pytest.mark.anyio
+async def test_shapes_beyond_limit_are_pooled(monkeypatch):
+    monkeypatch.setattr(database, "max_shapes", 1)
+
+    await database.fetch_all(post_table.select())
+    await database.fetch_all("SELECT 1")
+    await database.fetch_all("SELECT 2")
+
+    metrics = database.query_metrics()["queries"]
+    assert len(metrics) == 2
+    assert {entry["sql"]: entry["count"] for entry in metrics}[OTHER_SHAPE] == 2
+
+
+@pytest.mark.anyio
+async def test_fast_queries_not_logged_as_slow(caplog):
+    caplog.set_level(logging.WARNING, logger="storeapi.instrumentation")
+
+    await database.fetch_all(post_table.select())
+
+    assert database.query_metrics()["slow_queries"] == []
+    assert caplog.records == []
+
+
+@pytest.mark.anyio
+async def test_slow_query_logged_with_request_id(caplog, slow_queries):
+    caplog.set_level(logging.WARNING, logger="storeapi.instrumentation")
+    token = correlation_id.set("request-123")
+    try:
+        await database.fetch_all(post_table.select().where(post_table.c.id == 1))
+    finally:
+        correlation_id.reset(token)
+
+    [slow] = database.query_metrics()["slow_queries"]
+    assert slow["sql"].startswith("SELECT posts.id")
+    assert slow["request_id"] == "request-123"
+    assert slow["plan"] is None
+    assert caplog.records[-1].request_id == "request-123"
+    assert "Slow query" in caplog.records[-1].getMessage()
+
+
+@pytest.mark.anyio
+async def test_slow_query_explained(monkeypatch, slow_queries):
+    monkeypatch.setattr(database, "explain_slow_queries", True)
+
+    await database.fetch_all(post_table.select().where(post_table.c.id.in_([1, 2])))
+
+    [slow] = database.query_metrics()["slow_queries"]
+    assert any("posts" in line for line in slow["plan"])
+    # The EXPLAIN statement itself is not recorded
+    assert query_stats("EXPLAIN") == []
+
+
+@pytest.mark.anyio
+async def test_explain_failure_is_not_raised():
+    assert await database.explain("SELECT * FROM no_such_table", None) is None
+
+
+@pytest.mark.anyio
+async def test_iterate_values_yields_tuples(registered_user: dict):
+    await database.execute(post_table.insert().values(body="The Post", user_id=registered_user["id"]))
+    query = sqlalchemy.select(post_table.c.body, post_table.c.likes)
+
+    rows = [values async for values in database.iterate_values(query)]
+
+    assert rows == [("The Post", 0)]
+    assert type(rows[0]) is tuple
+    assert query_stats("SELECT posts.body, posts.likes")[0]["count"] == 1
+
+
+@pytest.mark.anyio
+async def test_iterate_values_converts_types(registered_user: dict):
+    await database.execute(user_table.update().values(confirmed=True))
+    query = sqlalchemy.select(user_table.c.confirmed).where(user_table.c.id == registered_user["id"])
+
+    assert [values async for values in database.iterate_values(query)] == [(True,)]
+
+
+@pytest.mark.anyio
+async def test_iterate_values_without_private_apis(registered_user: dict, monkeypatch):
+    monkeypatch.setattr(instrumentation, "sqlite_values_supported", lambda connection: False)
+    await database.execute(post_table.insert().values(body="The Post", user_id=registered_user["id"]))
+    query = sqlalchemy.select(post_table.c.body, post_table.c.likes)
+
+    assert [values async for values in database.iterate_values(query)] == [("The Post", 0)]
@@ -0,0 +1,194 @@
+import asyncio
+
+import pytest
+import sqlalchemy
+
+from storeapi import likes
+from storeapi.database import database, like_shard_table, post_table
+from storeapi.likes import LikeCounter
+from storeapi.tests.conftest import FakeTimer
+
+
+@pytest.fixture()
+async def post_ids(registered_user: dict) -> list[int]:
+    query = post_table.insert().values(
+        [{"body": f"Post {index}", "user_id": registered_user["id"]} for index in range(2)]
+    ).returning(post_table.c.id)
+    return sorted(row.id for row in await database.fetch_all(query))
+
+
+async def likes_of(post_id: int) -> int:
+    query = sqlalchemy.select(post_table.c.likes).where(post_table.c.id == post_id)
+    return await database.fetch_val(query)
+
+
+async def shard_likes_of(post_id: int) -> int:
+    query = sqlalchemy.select(sqlalchemy.func.coalesce(sqlalchemy.func.sum(like_shard_table.c.count), 0)).where(
+        like_shard_table.c.post_id == post_id
+    )
+    return await database.fetch_val(query)
+
+
+@pytest.mark.anyio
+async def test_flush_adds_to_shards(post_ids: list[int]):
+    counter = LikeCounter(shards=4, flush_interval=60, max_unflushed=100, fold_interval=60)
+    first, second = post_ids
+
+    counter.add([first, first, second])
+    assert await shard_likes_of(first) == 0
+    assert await counter.flush() == 3
+    counter.add([first])
+    assert await counter.flush() == 1
+
+    assert await shard_likes_of(first) == 3
+    assert await shard_likes_of(second) == 1
+    assert await likes_of(first) == 0
+    assert counter.unflushed == 0
+    assert counter.flushed == 4
+
+
+@pytest.mark.anyio
+async def test_fold_moves_shards_into_posts(post_ids: list[int]):
+    folded = []
+    counter = LikeCounter(shards=4, flush_interval=60, max_unflushed=100, fold_interval=60,
+                          on_fold=folded.extend)
+    first, second = post_ids
+    await database.execute(post_table.update().where(post_table.c.id == first).values(likes=5))
+    for _ in range(3):
+        counter.add([first, second])
+        await counter.flush()
+
+    assert await counter.fold() == 6
+
+    assert await likes_of(first) == 8
+    assert await likes_of(second) == 3
+    assert await database.fetch_all(like_shard_table.select()) == []
+    assert sorted(folded) == [first, second]
+    assert counter.folded == 6
+
+
+@pytest.mark.anyio
+async def test_fold_without_delete_returning(post_ids: list[int], monkeypatch):
+    monkeypatch.setattr(likes, "DELETE_RETURNING_DIALECTS", set())
+    counter = LikeCounter(shards=4, flush_interval=60, max_unflushed=100, fold_interval=60)
+    first, second = post_ids
+    for _ in range(3):
+        counter.add([first, second, second])
+        await counter.flush()
+
+    assert await counter.fold() == 9
+
+    assert await likes_of(first) == 3
+    assert await likes_of(second) == 6
+    assert await database.fetch_all(like_shard_table.select()) == []
+
+
+@pytest.mark.anyio
+async def test_fold_with_nothing_flushed(post_ids: list[int]):
+    folded = []
+    counter = LikeCounter(shards=4, flush_interval=60, max_unflushed=100, fold_interval=60,
+                          on_fold=folded.extend)
+
+    assert await counter.fold() == 0
+    assert folded == []
+
+
+@pytest.mark.anyio
+async def test_shards_spread_rows(post_ids: list[int]):
+    counter = LikeCounter(shards=4, flush_interval=60, max_unflushed=100, fold_interval=60)
+    for _ in range(20):
+        counter.add([post_ids[0]])
+        await counter.flush()
+
+    count = sqlalchemy.select(sqlalchemy.func.count()).select_from(like_shard_table)
+    assert 1 < await database.fetch_val(count) <= 4
+    assert await shard_likes_of(post_ids[0]) == 20
+
+
+@pytest.mark.anyio
+async def test_flush_with_nothing_pending():
+    counter = LikeCounter(shards=4, flush_interval=60, max_unflushed=100, fold_interval=60)
+
+    assert await counter.flush() == 0
+    assert counter.flushes == 0
+
+
+@pytest.mark.anyio
+async def test_failed_flush_keeps_counts(post_ids: list[int], mocker):
+    counter = LikeCounter(shards=4, flush_interval=60, max_unflushed=100, fold_interval=60)
+    counter.add([post_ids[0], post_ids[1]])
+    mocker.patch.object(database, "execute", side_effect=RuntimeError("database is gone"))
+
+    with pytest.raises(RuntimeError):
+        await counter.flush()
+
+    assert counter.unflushed == 2
+    assert counter.pending == {post_ids[0]: 1, post_ids[1]: 1}
+
+
+@pytest.mark.anyio
+async def test_flushes_when_max_unflushed_reached(post_ids: list[int]):
+    counter = LikeCounter(shards=4, flush_interval=60, max_unflushed=3, fold_interval=60)
+    counter.start()
+    try:
+        counter.add([post_ids[0]] * 2)
+        await asyncio.sleep(0.05)
+        assert counter.flushes == 0
+
+        counter.add([post_ids[0]])
+        for _ in range(100):
+            if counter.flushes:
+                break
+            await asyncio.sleep(0.01)
+        assert await shard_likes_of(post_ids[0]) == 3
+    finally:
+        await counter.stop()
+
+
+@pytest.mark.anyio
+async def test_flushes_on_interval(post_ids: list[int]):
+    counter = LikeCounter(shards=4, flush_interval=0.01, max_unflushed=100, fold_interval=60)
+    counter.start()
+    try:
+        counter.add([post_ids[0]])
+        for _ in range(100):
+            if counter.flushes:
+                break
+            await asyncio.sleep(0.01)
+        assert counter.flushed == 1
+    finally:
+        await counter.stop()
+
+
+@pytest.mark.anyio
+async def test_folds_on_interval(post_ids: list[int], fake_timer: FakeTimer):
+    counter = LikeCounter(shards=4, flush_interval=0.01, max_unflushed=100, fold_interval=10,
+                          timer=fake_timer)
+    counter.start()
+    try:
+        counter.add([post_ids[0]])
+        for _ in range(100):
+            if counter.flushes:
+                break
+            await asyncio.sleep(0.01)
+        assert await likes_of(post_ids[0]) == 0
+
+        fake_timer.now = 10
+        for _ in range(100):
+            if counter.folded:
+                break
+            await asyncio.sleep(0.01)
+        assert await likes_of(post_ids[0]) == 1
+    finally:
+        await counter.stop()
+
+
+@pytest.mark.anyio
+async def test_stop_flushes_and_folds_pending(post_ids: list[int]):
+    counter = LikeCounter(shards=4, flush_interval=60, max_unflushed=100, fold_interval=60)
+    counter.start()
+    counter.add([post_ids[1]])
+
+    await counter.stop()
+
+    assert await likes_of(post_ids[1]) == 1
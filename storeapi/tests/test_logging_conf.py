@@ -0,0 +1,93 @@
+import logging
+import threading
+
+import pytest
+
+from storeapi import logging_conf
+
+
+class CollectingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.threads = set()
+
+    def emit(self, record: logging.LogRecord):
+        self.records.append(self.format(record))
+        self.threads.add(threading.current_thread().name)
+
+
+def make_record(message: str = "hello %s", args=("world",)) -> logging.LogRecord:
+    return logging.LogRecord("storeapi.test", logging.INFO, __file__, 1, message, args, None)
+
+
+def test_background_queue_handler_writes_in_listener_thread():
+    handler = logging_conf.BackgroundQueueHandler(maxsize=10)
+    target = CollectingHandler()
+    handler.start([target])
+
+    handler.handle(make_record())
+    handler.stop()
+
+    assert target.records == ["hello world"]
+    assert threading.current_thread().name not in target.threads
+
+
+def test_background_queue_handler_drops_when_full():
+    handler = logging_conf.BackgroundQueueHandler(maxsize=1)
+
+    handler.handle(make_record())
+    handler.handle(make_record())
+
+    assert handler.dropped == 1
+
+
+def test_background_queue_handler_block_policy_times_out():
+    handler = logging_conf.BackgroundQueueHandler(maxsize=1, policy="block", block_timeout=0.01)
+
+    handler.handle(make_record())
+    handler.handle(make_record())
+
+    assert handler.dropped == 1
+
+
+def test_background_queue_handler_stop_drains_full_queue():
+    handler = logging_conf.BackgroundQueueHandler(maxsize=2)
+    target = CollectingHandler()
+    handler.handle(make_record("one", ()))
+    handler.handle(make_record("two", ()))
+    handler.start([target])
+
+    handler.stop()
+
+    assert target.records == ["one", "two"]
+
+
+@pytest.fixture()
+def restore_logging(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    yield
+    logging_conf.stop_logging()
+    for name in ("storeapi", "uvicorn", "databases", "aiosqlite"):
+        logger = logging.getLogger(name)
+        logger.handlers.clear()
+        logger.setLevel(logging.NOTSET)
+        logger.propagate = True
+
+
+def test_configure_logging_queues_records(restore_logging, tmp_path):
+    logging_conf.configure_logging()
+
+    assert logging.getLogger("storeapi").handlers == [logging_conf.queue_handler]
+    logging.getLogger("storeapi.test").info("Queued record")
+    logging_conf.stop_logging()
+
+    assert "Queued record" in (tmp_path / "storeapi.log").read_text()
+
+
+def test_configure_logging_inline(restore_logging, mocker):
+    mocker.patch.object(logging_conf.config, "LOG_QUEUE_SIZE", 0)
+    logging_conf.configure_logging()
+
+    assert logging_conf.queue_handler is None
+    assert len(logging.getLogger("storeapi").handlers) == 2
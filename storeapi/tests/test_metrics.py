@@ -0,0 +1,155 @@
+import json
+import math
+import os
+import time
+
+from storeapi.metrics import (
+    Histogram,
+    MultiProcessStore,
+    RequestMetrics,
+    family,
+    histogram_family,
+    labels,
+    merge_families,
+    render,
+)
+
+
+def test_observe_counts_into_buckets():
+    histogram = Histogram(buckets=(1, 10))
+    for value in (0.5, 1, 5, 50):
+        histogram.observe(value)
+
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.count == 4
+    assert histogram.sum == 56.5
+
+
+def test_percentile_is_bucket_upper_bound():
+    histogram = Histogram(buckets=(1, 10, 100))
+    for value in [0.5] * 90 + [5] * 9 + [50]:
+        histogram.observe(value)
+
+    assert histogram.percentile(50) == 1
+    assert histogram.percentile(95) == 10
+    assert histogram.percentile(100) == 100
+
+
+def test_percentile_overflow_and_empty():
+    histogram = Histogram(buckets=(1,))
+    assert histogram.percentile(99) == 0.0
+
+    histogram.observe(5)
+    assert histogram.percentile(99) == math.inf
+    assert histogram.snapshot()["p99"] is None
+
+
+def test_snapshot():
+    histogram = Histogram(buckets=(1, 10))
+    histogram.observe(2)
+
+    assert histogram.snapshot() == {
+        "count": 1,
+        "sum": 2.0,
+        "buckets": {"1": 0, "10": 1, "+Inf": 0},
+        "p50": 10,
+        "p95": 10,
+        "p99": 10,
+    }
+
+
+def test_labels_escaped():
+    assert labels(route='/a"b', method="GET") == 'route="/a\\"b",method="GET"'
+
+
+def test_render_counter_and_histogram():
+    histogram = Histogram(buckets=(1, 10))
+    histogram.observe(5)
+    families = [
+        family("requests_total", "counter", "Requests.", {labels(route="/post"): 3}),
+        histogram_family("duration_seconds", "Durations.", {"": histogram}),
+    ]
+
+    assert render(families) == "\n".join([
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{route="/post"} 3',
+        "# HELP duration_seconds Durations.",
+        "# TYPE duration_seconds histogram",
+        'duration_seconds_bucket{le="0.001"} 0',
+        'duration_seconds_bucket{le="0.01"} 1',
+        'duration_seconds_bucket{le="+Inf"} 1',
+        "duration_seconds_sum 0.005",
+        "duration_seconds_count 1",
+    ]) + "\n"
+
+
+def test_merge_families_sums_samples():
+    first, second = Histogram(buckets=(1,)), Histogram(buckets=(1,))
+    first.observe(0.5)
+    second.observe(5)
+
+    merged = merge_families([
+        [family("hits", "counter", "", {"a": 1}), histogram_family("t", "", {"": first})],
+        [family("hits", "counter", "", {"a": 2, "b": 1}), histogram_family("t", "", {"": second})],
+    ])
+
+    assert merged[0]["samples"] == {"a": 3, "b": 1}
+    assert merged[1]["samples"][""]["counts"] == [1, 1]
+    assert merged[1]["samples"][""]["count"] == 2
+
+
+def test_multiprocess_store_merges_workers(tmp_path):
+    store = MultiProcessStore(str(tmp_path), stale_after=60)
+    other = [
+        family("hits", "counter", "", {"": 2}),
+        family("in_flight", "gauge", "", {"": 5}),
+    ]
+    (tmp_path / "1.json").write_text(json.dumps(other))
+
+    merged = store.collect([
+        family("hits", "counter", "", {"": 1}),
+        family("in_flight", "gauge", "", {"": 1}),
+    ])
+
+    assert {source["name"]: source["samples"][""] for source in merged} == {
+        "hits": 3, "in_flight": 6,
+    }
+    assert (tmp_path / f"{os.getpid()}.json").exists()
+
+
+def test_multiprocess_store_drops_stale_gauges(tmp_path):
+    store = MultiProcessStore(str(tmp_path), stale_after=60)
+    stale = tmp_path / "1.json"
+    stale.write_text(json.dumps([
+        family("hits", "counter", "", {"": 2}),
+        family("in_flight", "gauge", "", {"": 5}),
+    ]))
+    os.utime(stale, (time.time() - 120, time.time() - 120))
+
+    merged = store.collect([
+        family("hits", "counter", "", {"": 1}),
+        family("in_flight", "gauge", "", {"": 1}),
+    ])
+
+    assert {source["name"]: source["samples"][""] for source in merged} == {
+        "hits": 3, "in_flight": 1,
+    }
+
+
+def test_request_metrics_families():
+    metrics = RequestMetrics()
+    metrics.observe("GET", "/post", 200, 3.0)
+    metrics.observe("GET", "/post", 500, 30.0)
+
+    families = {source["name"]: source for source in metrics.families()}
+
+    assert families["storeapi_http_requests_total"]["samples"] == {
+        'method="GET",route="/post",status="200"': 1,
+        'method="GET",route="/post",status="500"': 1,
+    }
+    assert families["storeapi_http_request_errors_total"]["samples"] == {
+        'method="GET",route="/post"': 1,
+    }
+    latency = families["storeapi_http_request_duration_seconds"]["samples"]
+    assert latency['method="GET",route="/post"']["count"] == 2
@@ -0,0 +1,141 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import sqlalchemy
+
+from storeapi import migrations
+from storeapi.migrations import LATEST_VERSION, file_lock, migrate, migration_lock, reconcile_likes_queries
+from storeapi.search import sqlite_has_fts5
+
+LEGACY_SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, email VARCHAR UNIQUE, password VARCHAR, confirmed BOOLEAN)",
+    "CREATE TABLE posts (id INTEGER PRIMARY KEY, body VARCHAR, user_id INTEGER NOT NULL REFERENCES users (id))",
+    "CREATE TABLE comments (id INTEGER PRIMARY KEY, body VARCHAR, "
+    "post_id INTEGER NOT NULL REFERENCES posts (id), user_id INTEGER NOT NULL REFERENCES users (id))",
+    "CREATE TABLE likes (id INTEGER PRIMARY KEY, "
+    "post_id INTEGER NOT NULL REFERENCES posts (id), user_id INTEGER NOT NULL REFERENCES users (id))",
+    "INSERT INTO users (id, email, password, confirmed) VALUES (1, 'maun@test.com', 'x', 1)",
+    "INSERT INTO posts (id, body, user_id) VALUES (1, 'Demo 1', 1), (2, 'Demo 2', 1)",
+    "INSERT INTO likes (post_id, user_id) VALUES (1, 1), (1, 1), (2, 1)",
+]
+
+
+@pytest.fixture()
+def engine(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'migrate.db'}")
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture()
+def legacy_engine(engine):
+    with engine.begin() as connection:
+        for statement in LEGACY_SCHEMA:
+            connection.execute(sqlalchemy.text(statement))
+    return engine
+
+
+def index_names(engine, table: str) -> set[str]:
+    return {index["name"] for index in sqlalchemy.inspect(engine).get_indexes(table)}
+
+
+def test_migrate_new_database(engine):
+    assert migrate(engine) == LATEST_VERSION
+
+    assert "ix_posts_likes_id" in index_names(engine, "posts")
+    assert "ix_comments_post_id" in index_names(engine, "comments")
+
+
+def test_migrate_legacy_database(legacy_engine):
+    assert migrate(legacy_engine) == LATEST_VERSION
+
+    with legacy_engine.connect() as connection:
+        likes = connection.execute(sqlalchemy.text("SELECT id, likes FROM posts ORDER BY id")).all()
+        like_count = connection.execute(sqlalchemy.text("SELECT count(*) FROM likes")).scalar()
+    assert [tuple(row) for row in likes] == [(1, 1), (2, 1)]
+    assert like_count == 2
+    assert {"ix_likes_post_id_user_id", "ix_likes_user_id"} <= index_names(legacy_engine, "likes")
+
+
+def test_migrate_is_idempotent(legacy_engine):
+    migrate(legacy_engine)
+    assert migrate(legacy_engine) == LATEST_VERSION
+
+
+def test_migrate_adds_email_variables(engine):
+    migrate(engine)
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text("ALTER TABLE email_outbox DROP COLUMN variables"))
+        connection.execute(sqlalchemy.text("UPDATE schema_version SET version = 3"))
+
+    assert migrate(engine) == LATEST_VERSION
+
+    columns = {column["name"] for column in sqlalchemy.inspect(engine).get_columns("email_outbox")}
+    assert "variables" in columns
+
+
+@pytest.mark.skipif(not sqlite_has_fts5(), reason="SQLite was built without FTS5")
+def test_migrate_indexes_existing_posts_for_search(legacy_engine):
+    migrate(legacy_engine)
+
+    with legacy_engine.connect() as connection:
+        hits = connection.execute(sqlalchemy.text(
+            "SELECT kind, doc_id FROM search_index WHERE search_index MATCH 'demo' ORDER BY doc_id"
+        )).all()
+    assert [tuple(row) for row in hits] == [("post", 1), ("post", 2)]
+
+
+def test_migrate_waits_for_migration_lock(engine):
+    with migration_lock(engine):
+        thread = threading.Thread(target=migrate, args=(engine,))
+        thread.start()
+        thread.join(0.2)
+        assert thread.is_alive()
+        assert not sqlalchemy.inspect(engine).has_table("schema_version")
+
+    thread.join(5)
+    assert not thread.is_alive()
+    with engine.connect() as connection:
+        assert connection.execute(sqlalchemy.text("SELECT version FROM schema_version")).scalar() == LATEST_VERSION
+
+
+def test_concurrent_migrations(legacy_engine):
+    with ThreadPoolExecutor(4) as executor:
+        versions = list(executor.map(lambda _: migrate(legacy_engine), range(4)))
+
+    assert versions == [LATEST_VERSION] * 4
+    with legacy_engine.connect() as connection:
+        assert connection.execute(sqlalchemy.text("SELECT count(*) FROM schema_version")).scalar() == 1
+
+
+def test_reconcile_likes_reads_likes_once_without_indexes(legacy_engine):
+    with legacy_engine.connect() as connection:
+        connection.execute(sqlalchemy.text("ALTER TABLE posts ADD COLUMN likes INTEGER NOT NULL DEFAULT 0"))
+        for query in reconcile_likes_queries():
+            sql = query.compile(legacy_engine, compile_kwargs={"literal_binds": True})
+            plan = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")
+            details = [row[-1] for row in plan]
+            assert not any("CORRELATED" in detail for detail in details), details
+            assert sum("SCAN likes" in detail for detail in details) == 1, details
+
+
+def test_file_lock_is_exclusive(tmp_path):
+    path = str(tmp_path / "test.lock")
+    acquired = threading.Event()
+
+    def take_lock():
+        with file_lock(path):
+            acquired.set()
+
+    with file_lock(path):
+        thread = threading.Thread(target=take_lock)
+        thread.start()
+        assert not acquired.wait(0.2)
+    thread.join(5)
+    assert acquired.is_set()
+
+
+def test_platform_lock_modules_imported_lazily():
+    # fcntl is POSIX only and msvcrt Windows only
+    assert not {"fcntl", "msvcrt"} & set(vars(migrations))
@@ -0,0 +1,28 @@
+import pytest
+
+from storeapi.pagination import decode_cursor, encode_cursor, is_int64
+
+
+def test_cursor_round_trip():
+    key = {"sort": "most_likes", "likes": 3, "id": 42}
+    assert decode_cursor(encode_cursor(key)) == key
+
+
+def test_cursor_is_url_safe():
+    cursor = encode_cursor({"sort": "new", "id": 2 ** 40})
+    assert cursor.replace("-", "").replace("_", "").isalnum()
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "", "WzEsMl0"])
+def test_decode_cursor_malformed(cursor: str):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+@pytest.mark.parametrize("value, expected", [
+    (0, True), (2 ** 63 - 1, True), (-2 ** 63, True),
+    (2 ** 63, False), (-2 ** 63 - 1, False), (10 ** 30, False),
+    (True, False), (1.0, False), ("1", False), (None, False),
+])
+def test_is_int64(value, expected: bool):
+    assert is_int64(value) is expected
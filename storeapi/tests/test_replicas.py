@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+import pytest
+
+from storeapi.replicas import STICKY_COOKIE, ReadState, ReplicaSet, read_state
+from storeapi.tests.conftest import FakeTimer
+
+
+def fake_database(name: str, in_flight: int = 0):
+    return SimpleNamespace(name=name, in_flight=in_flight)
+
+
+def test_without_replicas_reads_primary():
+    primary = fake_database("primary")
+    replicas = ReplicaSet(primary, [])
+
+    replicas.mark_written()
+    assert replicas.reader() is primary
+
+
+def test_round_robin():
+    first, second = fake_database("first"), fake_database("second")
+    replicas = ReplicaSet(fake_database("primary"), [first, second])
+
+    assert [replicas.reader() for _ in range(4)] == [first, second, first, second]
+
+
+def test_least_loaded():
+    busy, idle = fake_database("busy", in_flight=3), fake_database("idle", in_flight=1)
+    replicas = ReplicaSet(fake_database("primary"), [busy, idle], policy="least_loaded")
+
+    assert replicas.reader() is idle
+    idle.in_flight = 5
+    assert replicas.reader() is busy
+
+
+@pytest.fixture()
+def request_state():
+    state = ReadState()
+    token = read_state.set(state)
+    yield state
+    read_state.reset(token)
+
+
+def test_written_request_reads_primary(request_state: ReadState, fake_timer: FakeTimer):
+    primary, replica = fake_database("primary"), fake_database("replica")
+    replicas = ReplicaSet(primary, [replica], sticky_seconds=5, timer=fake_timer)
+    assert replicas.reader() is replica
+
+    replicas.mark_written()
+
+    assert replicas.reader() is primary
+    assert request_state.set_cookie.startswith(f"{STICKY_COOKIE}=5.000; Max-Age=5;")
+
+
+@pytest.mark.parametrize("cookie, now, pinned", [
+    ("5.000", 0, True),
+    ("5.000", 4.9, True),
+    ("5.000", 5, False),
+    ("1e12", 0, False),
+    ("nan", 0, False),
+    ("not-a-time", 0, False),
+])
+def test_cookie_pins_client(
+        request_state: ReadState, fake_timer: FakeTimer, cookie: str, now: float, pinned: bool
+):
+    fake_timer.now = now
+    primary, replica = fake_database("primary"), fake_database("replica")
+    replicas = ReplicaSet(primary, [replica], sticky_seconds=5, timer=fake_timer)
+    request_state.cookie = cookie
+
+    assert (replicas.reader() is primary) is pinned
+
+
+def test_mark_written_outside_a_request():
+    primary, replica = fake_database("primary"), fake_database("replica")
+    replicas = ReplicaSet(primary, [replica])
+
+    replicas.mark_written()
+
+    assert replicas.reader() is replica
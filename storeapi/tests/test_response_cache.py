@@ -0,0 +1,136 @@
+from starlette.requests import Request
+
+from storeapi.cache import LRUCache
+from storeapi.response_cache import ResponseCache
+from storeapi.tests.conftest import FakeTimer
+
+
+def make_request(headers: dict[str, str] | None = None) -> Request:
+    raw_headers = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": raw_headers})
+
+
+def make_cache() -> ResponseCache:
+    return ResponseCache(LRUCache(maxsize=8, ttl=60))
+
+
+def test_set_and_get():
+    cache = make_cache()
+    entry = cache.set("a", b"[]", ["tag"], {"X-Next-Cursor": "abc"})
+
+    assert cache.get("a") is entry
+    assert entry.headers == {"X-Next-Cursor": "abc", "ETag": entry.etag}
+
+
+def test_invalidate_tag_only_drops_tagged_entries():
+    cache = make_cache()
+    cache.set("a", b"1", ["one", "shared"])
+    cache.set("b", b"2", ["two", "shared"])
+
+    cache.invalidate("one")
+    assert cache.get("a") is None
+    assert cache.get("b") is not None
+
+    cache.invalidate("shared")
+    assert cache.get("b") is None
+
+
+def test_set_skipped_after_concurrent_invalidation():
+    cache = make_cache()
+    generation = cache.generation
+    cache.invalidate("one")
+
+    cache.set("a", b"1", ["one"], generation=generation)
+    assert cache.get("a") is None
+
+
+def test_set_kept_after_invalidation_of_other_tags():
+    cache = make_cache()
+    cache.invalidate("one")
+    generation = cache.generation
+    cache.invalidate("two")
+
+    cache.set("a", b"1", ["one", "three"], generation=generation)
+    assert cache.get("a") is not None
+
+
+def test_set_skipped_once_invalidation_is_forgotten():
+    cache = ResponseCache(LRUCache(maxsize=8, ttl=60), max_invalidated_tags=2)
+    generation = cache.generation
+    cache.invalidate("one")
+    cache.invalidate("two")
+    cache.invalidate("three")
+
+    cache.set("a", b"1", ["one"], generation=generation)
+    assert cache.get("a") is None
+    cache.set("b", b"2", ["one"], generation=cache.generation)
+    assert cache.get("b") is not None
+
+
+def test_set_skipped_while_tags_recently_invalidated(fake_timer: FakeTimer):
+    cache = ResponseCache(LRUCache(maxsize=8, ttl=60), timer=fake_timer)
+    cache.invalidate("one")
+
+    cache.set("a", b"1", ["one"], min_tag_age=5)
+    cache.set("b", b"2", ["two"], min_tag_age=5)
+    assert cache.get("a") is None
+    assert cache.get("b") is not None
+
+    fake_timer.now = 5
+    cache.set("a", b"1", ["one"], min_tag_age=5)
+    assert cache.get("a") is not None
+
+
+def test_evicted_keys_leave_their_tags():
+    cache = ResponseCache(LRUCache(maxsize=2, ttl=60))
+    for key in "abcd":
+        cache.set(key, b"[]", [f"tag-{key}", "shared"])
+
+    assert cache.tagged_keys == 4
+    assert cache._keys_by_tag == {"tag-c": {"c"}, "tag-d": {"d"}, "shared": {"c", "d"}}
+
+
+def test_invalidate_and_overwrite_keep_tag_count():
+    cache = make_cache()
+    cache.set("a", b"1", ["one", "shared"])
+    cache.set("a", b"2", ["two"])
+    cache.set("b", b"3", ["one", "two"])
+    assert cache.tagged_keys == 3
+
+    cache.invalidate("two")
+    assert cache.tagged_keys == 0
+    assert cache._keys_by_tag == {}
+
+
+def test_many_tags_do_not_clear_the_cache():
+    cache = ResponseCache(LRUCache(maxsize=512, ttl=60))
+    for key in range(512):
+        cache.set(key, b"[]", [f"post:{key * 100 + tag}" for tag in range(101)])
+
+    assert cache.get(0) is not None
+    assert cache.tagged_keys == 512 * 101
+
+
+def test_disabled_backend_keeps_no_tags():
+    cache = ResponseCache(LRUCache(maxsize=0, ttl=60))
+    cache.set("a", b"1", ["one"])
+
+    assert cache.tagged_keys == 0
+    assert cache._keys_by_tag == {}
+
+
+def test_to_response_not_modified():
+    entry = make_cache().set("a", b"[1]", ["one"])
+
+    response = entry.to_response(make_request({"If-None-Match": f'"other", {entry.etag}'}))
+    assert response.status_code == 304
+    assert response.body == b""
+    assert response.headers["etag"] == entry.etag
+
+
+def test_to_response_modified():
+    entry = make_cache().set("a", b"[1]", ["one"])
+
+    response = entry.to_response(make_request({"If-None-Match": '"other"'}))
+    assert response.status_code == 200
+    assert response.body == b"[1]"
@@ -0,0 +1,62 @@
+from array import array
+
+import pytest
+import sqlalchemy
+
+from storeapi.database import database, post_table
+from storeapi.models.post import Comment, UserPostWithLikes
+from storeapi.rows import Columns, fetch_columns, model_columns
+
+
+def test_integer_fields_are_packed():
+    rows = Columns.for_model(Comment)
+    rows.append(("The Comment", 1, 2, 3))
+
+    assert rows.fields == ("body", "post_id", "id", "user_id")
+    assert type(rows.column("body")) is list
+    assert rows.column("id") == array("q", [2])
+    assert rows.row(0) == {"body": "The Comment", "post_id": 1, "id": 2, "user_id": 3}
+
+
+def test_null_in_integer_column():
+    rows = Columns(["body", "id"], integers=["id"])
+    rows.append(("First", 1))
+    rows.append(("Second", None))
+
+    assert rows.column("id") == [1, None]
+    assert len(rows) == 2
+
+
+def test_truncate():
+    rows = Columns(["body", "id"], integers=["id"])
+    for id in range(5):
+        rows.append((f"Post {id}", id))
+
+    rows.truncate(2)
+
+    assert len(rows) == 2
+    assert list(rows.column("body")) == ["Post 0", "Post 1"]
+
+
+def test_chunks():
+    rows = Columns(["id"], integers=["id"])
+    for id in range(5):
+        rows.append((id,))
+
+    assert [[row["id"] for row in chunk] for chunk in rows.chunks(size=2)] == [[0, 1], [2, 3], [4]]
+    assert list(Columns(["id"]).chunks()) == []
+
+
+@pytest.mark.anyio
+async def test_fetch_columns(registered_user: dict):
+    await database.execute(post_table.insert().values(
+        [{"body": f"Post {id}", "user_id": registered_user["id"]} for id in range(3)]
+    ))
+    query = sqlalchemy.select(*model_columns(post_table, UserPostWithLikes)).order_by(post_table.c.id)
+
+    rows = await fetch_columns(database, query, UserPostWithLikes)
+
+    assert len(rows) == 3
+    assert rows.row(2) == {
+        "body": "Post 2", "id": rows.column("id")[2], "user_id": registered_user["id"], "likes": 0
+    }
@@ -0,0 +1,109 @@
+import pytest
+
+from storeapi.database import comment_table, database, post_table
+from storeapi.search import (
+    FTS5Index,
+    MemoryIndex,
+    comment_document,
+    post_document,
+    query_terms,
+    search_index,
+    search_table,
+    tokenize,
+)
+from storeapi.tests.conftest import FakeTimer
+
+DOCUMENTS = [
+    post_document(1, "The quick brown fox"),
+    post_document(2, "A fox, a fox, and another fox"),
+    post_document(3, "Lazy dogs sleep all day long in the sun"),
+    comment_document(1, 3, "The dog and the fox are friends"),
+]
+
+
+def test_tokenize_folds_case_and_diacritics():
+    assert tokenize("Crème BRÛLÉE, naïve_café!") == ["creme", "brulee", "naive", "cafe"]
+
+
+def test_query_terms_are_distinct():
+    assert query_terms("fox Fox dog") == ["fox", "dog"]
+
+
+@pytest.mark.anyio
+async def test_memory_index_ranks_with_bm25():
+    index = MemoryIndex()
+    await index.add(DOCUMENTS)
+
+    hits = await index.search(None, ["fox"], limit=10, offset=0)
+
+    assert [(hit.kind, hit.id) for hit in hits] == [("post", 2), ("post", 1), ("comment", 1)]
+    assert hits[0].score > hits[1].score > hits[2].score
+    assert await index.search(None, ["fox", "unicorn"], limit=10, offset=0) == []
+
+
+@pytest.mark.anyio
+async def test_memory_index_ignores_repeated_documents():
+    index = MemoryIndex()
+    await index.add(DOCUMENTS)
+    await index.add(DOCUMENTS[:1])
+
+    assert len(index.documents) == len(DOCUMENTS)
+
+
+@pytest.mark.anyio
+@pytest.mark.skipif(not isinstance(search_index, FTS5Index), reason="SQLite was built without FTS5")
+async def test_memory_index_scores_match_fts5():
+    memory_index = MemoryIndex()
+    await memory_index.add(DOCUMENTS)
+    # Posts and comments would get here through the triggers
+    await database.execute(
+        search_table.insert().values([document._asdict() for document in DOCUMENTS])
+    )
+
+    for terms in (["fox"], ["the", "fox"], ["dog"]):
+        expected = await search_index.search(database, terms, limit=10, offset=0)
+        actual = await memory_index.search(None, terms, limit=10, offset=0)
+        assert [(hit.kind, hit.id) for hit in actual] == [(hit.kind, hit.id) for hit in expected]
+        assert [hit.score for hit in actual] == pytest.approx([hit.score for hit in expected])
+
+
+async def insert_post(body: str, user_id: int) -> int:
+    return await database.execute(post_table.insert().values(body=body, user_id=user_id))
+
+
+@pytest.mark.anyio
+async def test_memory_index_catches_up_with_other_writers(registered_user: dict, fake_timer: FakeTimer):
+    index = MemoryIndex(refresh_interval=10, timer=fake_timer)
+    await insert_post("Loaded at startup", registered_user["id"])
+    await index.rebuild()
+    # Written by another process
+    post_id = await insert_post("Written elsewhere", registered_user["id"])
+    await database.execute(comment_table.insert().values(
+        body="Also elsewhere", post_id=post_id, user_id=registered_user["id"]
+    ))
+
+    assert await index.search(None, ["elsewhere"], limit=10, offset=0) == []
+
+    fake_timer.now = 10
+    hits = await index.search(None, ["elsewhere"], limit=10, offset=0)
+    assert {(hit.kind, hit.post_id) for hit in hits} == {("post", post_id), ("comment", post_id)}
+    assert index.loaded_ids["post"] == post_id
+
+
+@pytest.mark.anyio
+async def test_memory_index_own_writes_leave_loaded_ids(registered_user: dict, fake_timer: FakeTimer):
+    index = MemoryIndex(refresh_interval=10, timer=fake_timer)
+    await index.rebuild()
+
+    await index.add([post_document(100, "Written here")])
+
+    assert index.loaded_ids == {"post": 0, "comment": 0}
+    assert [hit.id for hit in await index.search(None, ["here"], limit=10, offset=0)] == [100]
+
+
+@pytest.mark.anyio
+async def test_memory_index_without_refresh_interval_does_not_catch_up(registered_user: dict):
+    index = MemoryIndex()
+    await insert_post("Written elsewhere", registered_user["id"])
+
+    assert await index.search(None, ["elsewhere"], limit=10, offset=0) == []
@@ -96,6 +96,50 @@ def test_get_subject_for_token_type_wrong_type():
     with pytest.raises(security.HTTPException) as exc_info:
         security.get_subject_for_token_type(token, "access")
     assert "Token has incorrect type, expected 'access'" == exc_info.value.detail
+def test_get_subject_for_token_type_is_cached(mocker):
+    token = security.create_access_token("maun@test.com")
+    security.get_subject_for_token_type(token, "access")
+    spy = mocker.spy(security.jwt, "decode")
+
+    assert "maun@test.com" == security.get_subject_for_token_type(token, "access")
+    spy.assert_not_called()
+
+
+def test_get_subject_for_token_type_cached_wrong_type():
+    token = security.create_confirmation_token("maun@test.com")
+    security.get_subject_for_token_type(token, "confirmation")
+
+    with pytest.raises(security.HTTPException) as exc_info:
+        security.get_subject_for_token_type(token, "access")
+    assert "Token has incorrect type, expected 'access'" == exc_info.value.detail
+
+
+def test_get_subject_for_token_type_cache_expires_with_token(mocker):
+    token = security.create_access_token("maun@test.com")
+    security.get_subject_for_token_type(token, "access")
+    expired = security.token_cache.timer() + security.access_token_expire_minutes() * 60 + 1
+    mocker.patch.object(security.token_cache, "timer", return_value=expired)
+    spy = mocker.spy(security.jwt, "decode")
+
+    security.get_subject_for_token_type(token, "access")
+    spy.assert_called_once()
+
+
+def test_get_subject_for_token_type_revoked():
+    token = security.create_access_token("maun@test.com")
+    security.get_subject_for_token_type(token, "access")
+    security.revoke_token(token)
+
+    with pytest.raises(security.HTTPException) as exc_info:
+        security.get_subject_for_token_type(token, "access")
+    assert "Token has been revoked" == exc_info.value.detail
+
+
+def test_revoke_token_invalid_token():
+    security.revoke_token("invalid token")
+    assert security.revoked_tokens == {}
+
+
 @pytest.mark.anyio
 async def test_get_user(registered_user: dict):
     user = await security.get_user(registered_user["email"])
@@ -128,6 +172,31 @@ async def test_get_current_user(registered_user: dict):
     assert user.email == registered_user["email"]
 
 
+@pytest.mark.anyio
+async def test_get_current_user_is_cached(registered_user: dict, mocker):
+    token = security.create_access_token(registered_user["email"])
+    await security.get_current_user(token)
+    spy = mocker.spy(security, "get_user")
+
+    user = await security.get_current_user(token)
+
+    assert user.email == registered_user["email"]
+    spy.assert_not_called()
+    assert security.user_cache.stats()["hits"] >= 1
+
+
+@pytest.mark.anyio
+async def test_invalidate_user(registered_user: dict, mocker):
+    token = security.create_access_token(registered_user["email"])
+    await security.get_current_user(token)
+    security.invalidate_user(registered_user["email"])
+    spy = mocker.spy(security, "get_user")
+
+    await security.get_current_user(token)
+
+    spy.assert_called_once()
+
+
 @pytest.mark.anyio
 async def test_get_current_user_invalid_token():
     with pytest.raises(security.HTTPException):
@@ -0,0 +1,65 @@
+import pytest
+import sqlalchemy
+from pydantic import TypeAdapter
+
+from storeapi import serialization
+from storeapi.database import database, post_table
+from storeapi.models.post import UserPostWithLikes
+from storeapi.rows import fetch_columns, model_columns
+from storeapi.serialization import dumps, join_lists, ndjson_lines
+
+BODIES = [
+    "plain",
+    'quote " and back\\slash',
+    "control \x00\x01\x1f\x7f",
+    "whitespace \n\r\t\b\f",
+    "unicode é 漢 😀   ",
+    "</script>",
+    "",
+]
+
+
+@pytest.fixture(params=["orjson", "json"])
+def json_library(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(serialization, "orjson", None)
+    elif serialization.orjson is None:
+        pytest.skip("orjson is not installed")
+    return request.param
+
+
+@pytest.mark.anyio
+async def test_fast_dumps_match_pydantic(json_library, registered_user: dict):
+    await database.execute(post_table.insert().values(
+        [{"body": body, "user_id": registered_user["id"]} for body in BODIES]
+    ))
+    query = sqlalchemy.select(*model_columns(post_table, UserPostWithLikes)).order_by(post_table.c.id)
+    rows = await fetch_columns(database, query, UserPostWithLikes)
+    adapter = TypeAdapter(list[UserPostWithLikes])
+
+    expected = adapter.dump_json(adapter.validate_python(next(rows.chunks())))
+    assert join_lists(dumps(chunk) for chunk in rows.chunks(size=3)) == expected
+
+
+@pytest.mark.parametrize(
+    "parts, expected",
+    [
+        ([], b"[]"),
+        ([b"[]", b"[]"], b"[]"),
+        ([b"[1,2]"], b"[1,2]"),
+        ([b"[]", b"[1]", b"[]", b'[{"a":[2]},3]'], b'[1,{"a":[2]},3]'),
+    ],
+)
+def test_join_lists(parts: list[bytes], expected: bytes):
+    assert join_lists(parts) == expected
+
+
+@pytest.mark.anyio
+async def test_ndjson_lines_follow_field_order():
+    async def rows():
+        yield ("The Post", 1)
+        yield ("Another", 2)
+
+    lines = [line async for line in ndjson_lines(("body", "id"), rows())]
+
+    assert lines == [b'{"body":"The Post","id":1}\n', b'{"body":"Another","id":2}\n']
@@ -0,0 +1,58 @@
+import logging
+
+import pytest
+from sqlalchemy.sql import Select
+
+from storeapi import sql_logging
+from storeapi.database import database, post_table
+
+
+@pytest.fixture(autouse=True)
+def clear_sql_text_cache():
+    sql_logging.sql_text_cache.clear()
+
+
+def test_sql_text_is_cached_per_shape(mocker):
+    spy = mocker.spy(Select, "__str__")
+    first = sql_logging.sql_text(post_table.select().where(post_table.c.id == 1))
+    second = sql_logging.sql_text(post_table.select().where(post_table.c.id == 2))
+
+    assert first == second
+    assert spy.call_count == 1
+    assert len(sql_logging.sql_text_cache) == 1
+
+
+def test_sql_text_of_string():
+    assert sql_logging.sql_text("SELECT 1") == "SELECT 1"
+
+
+def test_lazy_sql_renders_on_str(mocker):
+    spy = mocker.spy(sql_logging, "sql_text")
+    lazy = sql_logging.LazySQL(post_table.select())
+    spy.assert_not_called()
+
+    assert str(lazy).startswith("SELECT posts.id")
+    spy.assert_called_once()
+
+
+@pytest.mark.anyio
+async def test_query_not_rendered_when_debug_disabled(caplog, mocker):
+    caplog.set_level(logging.INFO, logger="storeapi.sql_logging")
+    spy = mocker.spy(sql_logging, "sql_text")
+
+    await database.fetch_all(post_table.select())
+
+    spy.assert_not_called()
+    assert caplog.records == []
+
+
+@pytest.mark.anyio
+async def test_query_logged_with_timing_and_rows(caplog):
+    caplog.set_level(logging.DEBUG, logger="storeapi.sql_logging")
+
+    await database.fetch_all(post_table.select())
+
+    record = caplog.records[-1]
+    assert record.rows == 0
+    assert record.duration_ms >= 0
+    assert "SELECT posts.id" in record.getMessage()
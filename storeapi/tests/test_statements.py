@@ -0,0 +1,89 @@
+import pytest
+import sqlalchemy
+from databases.backends.sqlite import SQLiteBackend
+
+from storeapi import statements as statements_module
+from storeapi.database import comment_table, database, post_table, user_table
+from storeapi.instrumentation import InstrumentedDatabase
+from storeapi.statements import (
+    CachedSQLiteConnection,
+    CompiledCache,
+    compiled_cache_supported,
+)
+
+
+def statements(n: int) -> list:
+    return [
+        user_table.select().where(user_table.c.email == f"user{n}@example.net"),
+        post_table.select().where(post_table.c.id < n).order_by(post_table.c.id.desc()).limit(n + 1),
+        post_table.select().where(
+            sqlalchemy.tuple_(post_table.c.likes, post_table.c.id) < sqlalchemy.tuple_(n, n)
+        ),
+        sqlalchemy.select(post_table.c.id).where(post_table.c.id.in_(range(n))),
+        post_table.insert().values([{"body": f"Post {i}", "user_id": 1} for i in range(n)]),
+        comment_table.insert().from_select(
+            ["body", "post_id", "user_id"],
+            sqlalchemy.select(
+                sqlalchemy.literal(f"Comment {n}"), sqlalchemy.literal(n), sqlalchemy.literal(1)
+            ).where(sqlalchemy.exists().where(post_table.c.id == n)),
+        ).returning(comment_table.c.id),
+        post_table.update().where(post_table.c.id.in_([n, n + 1])).values(likes=post_table.c.likes + 1),
+        sqlalchemy.text("SELECT :value").bindparams(value=n),
+    ]
+
+
+def test_compiles_like_databases():
+    backend = SQLiteBackend("sqlite:///unused.db")
+    plain = backend.connection()
+    cached = CachedSQLiteConnection(backend._pool, backend._dialect, CompiledCache(100))
+
+    for n in (1, 3, 2):
+        for query in statements(n):
+            expected_sql, expected_args, expected_columns, _ = plain._compile(query)
+            sql, args, columns, _ = cached._compile(query)
+            assert (sql, args) == (expected_sql, expected_args)
+            assert columns == expected_columns
+
+
+def test_reuses_compiled_statements():
+    backend = SQLiteBackend("sqlite:///unused.db")
+    cache = CompiledCache(100)
+    connection = CachedSQLiteConnection(backend._pool, backend._dialect, cache)
+
+    for n in range(1, 6):
+        connection._compile(user_table.select().where(user_table.c.email == f"user{n}"))
+
+    assert (cache.hits, cache.misses, len(cache)) == (4, 1, 1)
+
+
+def test_compiled_cache_supported_by_pinned_versions():
+    assert compiled_cache_supported()
+
+
+def test_stock_backend_without_private_apis(monkeypatch):
+    def missing(*args, **kwargs):
+        raise AttributeError("_compile_w_cache")
+
+    compiled_cache_supported.cache_clear()
+    monkeypatch.setattr(statements_module, "compilation_context", missing)
+    try:
+        db = InstrumentedDatabase("sqlite:///unused.db", compiled_cache_size=100)
+        assert db.compiled_cache is None
+        assert type(db._backend) is SQLiteBackend
+    finally:
+        compiled_cache_supported.cache_clear()
+
+
+@pytest.mark.anyio
+async def test_database_results_with_cached_statements(async_client, logged_in_token):
+    assert database.compiled_cache is not None
+    user_id = (await database.fetch_one(user_table.select())).id
+    await database.execute(
+        post_table.insert().values([{"body": f"Post {i}", "user_id": user_id} for i in range(5)])
+    )
+    ids = [row.id for row in await database.fetch_all(post_table.select().order_by(post_table.c.id))]
+
+    for count in (2, 4, 3):
+        query = sqlalchemy.select(post_table.c.body).where(post_table.c.id.in_(ids[:count]))
+        rows = await database.fetch_all(query.order_by(post_table.c.id))
+        assert [row.body for row in rows] == [f"Post {i}" for i in range(count)]
@@ -1,19 +1,309 @@
-# import httpx
-# import pytest
-# from storeapi.tasks import APIResponseError, send_simple_message
-#
-#
-# @pytest.mark.anyio
-# async def test_send_simple_message(mock_httpx_client):
-#     await send_simple_message("test@example.net", "Test Subject", "Test Body")
-#     mock_httpx_client.post.assert_called()
-#
-#
-# @pytest.mark.asyncio
-# async def test_send_simple_message_api_error(mock_httpx_client):
-#     mock_httpx_client.post.return_value = httpx.Response(
-#         status_code=500, content="", request=httpx.Request("POST", "//")
-#     )
-#
-#     with pytest.raises(APIResponseError, match="API request failed with status code"):
-#         await send_simple_message("test@example.com", "Test Subject", "Test Body")
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from storeapi.database import database, email_outbox_table
+from storeapi.tasks import (
+    APIResponseError,
+    EmailOutbox,
+    dead_letters,
+    enqueue_email,
+    requeue_dead_letters,
+    send_batch_message,
+    send_simple_message,
+)
+from storeapi.tests.conftest import FakeTimer
+
+
+@pytest.fixture()
+def fake_timer(fake_timer: FakeTimer) -> FakeTimer:
+    # Emails are enqueued at the real time.time()
+    fake_timer.now = time.time() + 1
+    return fake_timer
+
+
+def make_outbox(timer: FakeTimer, **options) -> EmailOutbox:
+    options = {
+        "workers": 2,
+        "max_attempts": 3,
+        "base_delay": 10.0,
+        "max_delay": 60.0,
+        "poll_interval": 0.05,
+        "lease_seconds": 30.0,
+        "timer": timer,
+        **options,
+    }
+    return EmailOutbox(**options)
+
+
+async def outbox_row(email_id: int):
+    query = email_outbox_table.select().where(email_outbox_table.c.id == email_id)
+    return await database.fetch_one(query)
+
+
+@pytest.mark.anyio
+async def test_send_simple_message(mailgun):
+    await send_simple_message("test@example.net", "Test Subject", "Test Body")
+
+    [request] = mailgun.requests
+    assert request["path"] == "/v3/test.example.com/messages"
+    assert request["authorization"].startswith("Basic ")
+    assert request["form"]["to"] == ["test@example.net"]
+    assert request["form"]["subject"] == ["Test Subject"]
+    assert request["form"]["text"] == ["Test Body"]
+
+
+@pytest.mark.anyio
+async def test_send_simple_message_api_error(mailgun):
+    mailgun.statuses.append(500)
+
+    with pytest.raises(APIResponseError, match="API request failed with status code") as err:
+        await send_simple_message("test@example.com", "Test Subject", "Test Body")
+    assert err.value.status_code == 500
+
+
+@pytest.mark.anyio
+async def test_send_simple_message_reuses_connection(mailgun):
+    for _ in range(3):
+        await send_simple_message("test@example.com", "Test Subject", "Test Body")
+
+    assert len(mailgun.requests) == 3
+    assert mailgun.connections == 1
+
+
+@pytest.mark.anyio
+async def test_send_batch_message(mailgun):
+    await send_batch_message(
+        {"a@example.net": {"name": "A"}, "b@example.net": {"name": "B"}},
+        "Hi %recipient.name%",
+        "Body",
+    )
+
+    [request] = mailgun.requests
+    assert request["form"]["to"] == ["a@example.net", "b@example.net"]
+    assert json.loads(request["form"]["recipient-variables"][0]) == {
+        "a@example.net": {"name": "A"},
+        "b@example.net": {"name": "B"},
+    }
+
+
+@pytest.mark.anyio
+async def test_outbox_delivers_and_deletes(mailgun, fake_timer: FakeTimer):
+    outbox = make_outbox(fake_timer)
+    email_id = await enqueue_email("test@example.net", "Subject", "Body")
+
+    assert await outbox.run_once() == 1
+    assert mailgun.requests[0]["form"]["to"] == ["test@example.net"]
+    assert await outbox_row(email_id) is None
+    assert outbox.sent == 1
+
+
+@pytest.mark.anyio
+async def test_outbox_retries_with_backoff(mailgun, fake_timer: FakeTimer):
+    outbox = make_outbox(fake_timer)
+    email_id = await enqueue_email("test@example.net", "Subject", "Body")
+    mailgun.statuses.extend([500, 503])
+
+    await outbox.run_once()
+    row = await outbox_row(email_id)
+    assert row.status == "pending"
+    assert row.attempts == 1
+    assert row.next_attempt_at == fake_timer.now + 10.0
+    assert "500" in row.last_error
+
+    # Not due yet
+    assert await outbox.run_once() == 0
+
+    fake_timer.now += 10.0
+    await outbox.run_once()
+    row = await outbox_row(email_id)
+    assert row.attempts == 2
+    assert row.next_attempt_at == fake_timer.now + 20.0
+    assert outbox.retried == 2
+
+
+@pytest.mark.anyio
+async def test_outbox_gives_up_on_rejection(mailgun, fake_timer: FakeTimer):
+    outbox = make_outbox(fake_timer)
+    email_id = await enqueue_email("not-an-address", "Subject", "Body")
+    mailgun.statuses.append(400)
+
+    await outbox.run_once()
+
+    row = await outbox_row(email_id)
+    assert row.status == "dead"
+    assert row.attempts == 1
+    assert outbox.dead == 1
+
+
+@pytest.mark.anyio
+async def test_outbox_dead_letters_and_requeue(mailgun, fake_timer: FakeTimer):
+    outbox = make_outbox(fake_timer, max_attempts=2)
+    email_id = await enqueue_email("test@example.net", "Subject", "Body")
+    mailgun.statuses.extend([500, 500])
+
+    await outbox.run_once()
+    fake_timer.now += 10.0
+    await outbox.run_once()
+
+    [dead] = await dead_letters()
+    assert dead.id == email_id
+    assert dead.attempts == 2
+
+    assert await requeue_dead_letters() == 1
+    assert await dead_letters() == []
+    assert await outbox.run_once() == 1
+    assert await outbox_row(email_id) is None
+
+
+@pytest.mark.anyio
+async def test_outbox_lease_stops_double_delivery(mailgun, fake_timer: FakeTimer):
+    outbox = make_outbox(fake_timer)
+    await enqueue_email("test@example.net", "Subject", "Body")
+
+    [job] = await outbox.claim(10)
+    assert await outbox.claim(10) == []
+
+    # The worker holding the claim died; the lease runs out
+    fake_timer.now += 30.0
+    [again] = await outbox.claim(10)
+    assert again.id == job.id
+    assert again.attempts == 2
+
+
+@pytest.mark.anyio
+async def test_outbox_bounds_concurrent_sends(fake_timer: FakeTimer):
+    running = 0
+    most_running = 0
+
+    async def send(recipient_variables, subject, body):
+        nonlocal running, most_running
+        running += 1
+        most_running = max(most_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    outbox = make_outbox(fake_timer, send=send)
+    for i in range(5):
+        await enqueue_email(f"user{i}@example.net", "Subject", "Body")
+
+    delivered = 0
+    while count := await outbox.run_once():
+        delivered += count
+
+    assert delivered == 5
+    assert most_running == 2
+
+
+@pytest.mark.anyio
+async def test_outbox_background_delivery(mailgun, fake_timer: FakeTimer):
+    outbox = make_outbox(fake_timer)
+    outbox.start()
+    try:
+        email_id = await enqueue_email("test@example.net", "Subject", "Body")
+        outbox.notify()
+        for _ in range(100):
+            if outbox.sent:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await outbox.stop()
+
+    assert outbox.sent == 1
+    assert await outbox_row(email_id) is None
+
+
+@pytest.mark.anyio
+async def test_outbox_batches_same_template(mailgun, fake_timer: FakeTimer):
+    outbox = make_outbox(fake_timer, batch_size=10)
+    for i in range(5):
+        await enqueue_email(f"user{i}@example.net", "Welcome", "Hi %recipient.name%", {"name": i})
+    await enqueue_email("other@example.net", "Other", "Body")
+
+    assert await outbox.run_once() == 6
+
+    assert outbox.requests == 2
+    assert outbox.sent == 6
+    batched = next(r for r in mailgun.requests if r["form"]["subject"] == ["Welcome"])
+    assert len(batched["form"]["to"]) == 5
+    assert json.loads(batched["form"]["recipient-variables"][0])["user3@example.net"] == {"name": 3}
+
+
+def test_outbox_batches_split_on_size_and_repeats(fake_timer: FakeTimer):
+    outbox = make_outbox(fake_timer, batch_size=2)
+    jobs = [
+        SimpleNamespace(recipient=recipient, subject="S", body="B")
+        for recipient in ["a", "b", "c", "c"]
+    ]
+
+    assert [[job.recipient for job in batch] for batch in outbox.batches(jobs)] == [
+        ["a", "b"], ["c"], ["c"],
+    ]
+
+
+@pytest.mark.anyio
+async def test_outbox_isolates_rejected_recipient(fake_timer: FakeTimer):
+    requests = []
+
+    async def send(recipient_variables, subject, body):
+        requests.append(list(recipient_variables))
+        if "bad@example.net" in recipient_variables:
+            raise APIResponseError("rejected", status_code=400)
+
+    outbox = make_outbox(fake_timer, batch_size=10, send=send)
+    ids = [
+        await enqueue_email(f"user{i}@example.net", "Subject", "Body") for i in range(3)
+    ]
+    bad_id = await enqueue_email("bad@example.net", "Subject", "Body")
+
+    await outbox.run_once()
+
+    assert outbox.sent == 3
+    assert outbox.dead == 1
+    assert (await outbox_row(bad_id)).status == "dead"
+    for email_id in ids:
+        assert await outbox_row(email_id) is None
+    # The whole batch, then halves until the bad address is alone
+    assert len(requests) == 5
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("status_code", [401, 403, 404])
+async def test_outbox_retries_whole_batch_on_account_error(status_code: int, caplog, fake_timer: FakeTimer):
+    requests = []
+
+    async def send(recipient_variables, subject, body):
+        requests.append(list(recipient_variables))
+        raise APIResponseError("refused", status_code=status_code)
+
+    outbox = make_outbox(fake_timer, batch_size=10, send=send)
+    ids = [await enqueue_email(f"user{i}@example.net", "Subject", "Body") for i in range(4)]
+
+    await outbox.run_once()
+
+    assert len(requests) == 1
+    assert outbox.dead == 0
+    assert outbox.retried == 4
+    for email_id in ids:
+        row = await outbox_row(email_id)
+        assert row.status == "pending"
+        assert row.next_attempt_at == fake_timer.now + 10.0
+    assert "check MAILGUN_API_KEY and MAILGUN_DOMAIN" in caplog.text
+
+
+@pytest.mark.anyio
+async def test_outbox_retries_whole_batch_on_server_error(mailgun, fake_timer: FakeTimer):
+    outbox = make_outbox(fake_timer, batch_size=10)
+    ids = [await enqueue_email(f"user{i}@example.net", "Subject", "Body") for i in range(3)]
+    mailgun.statuses.append(503)
+
+    await outbox.run_once()
+
+    assert len(mailgun.requests) == 1
+    for email_id in ids:
+        row = await outbox_row(email_id)
+        assert row.status == "pending"
+        assert row.next_attempt_at == fake_timer.now + 10.0